@@ -0,0 +1,178 @@
+# Thread object which sends the entries read by an agent (a monitor running
+# on a web node) to the aggregator as per-second aggregates: the seconds
+# changed since the last sending are batched in one message every period,
+# and kept while the aggregator cannot be reached (see wire_format)
+
+from sliding_window import Bucket
+from wire_format import encode_message
+from threading import Thread, Event, Lock
+from time import monotonic
+from select import select
+import socket
+
+# Delays before connecting again after a failure in seconds
+# (doubled after each failure)
+MIN_RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+# Timeout of the connection and of the sending of a message in seconds
+SOCKET_TIMEOUT = 5
+
+
+def parse_address(text):
+    """Returns the address of the aggregator written as host:port (TCP)
+    or unix:path (Unix socket), raises ValueError if it is not valid
+    :return: (host, port) tuple or path of the socket"""
+    text = text.strip()
+    if text.startswith("unix:"):
+        return text[len("unix:"):]
+    host, separator, port = text.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError("Invalid address: %s" % text)
+    return host or "127.0.0.1", int(port)
+
+
+def connect(address, timeout=SOCKET_TIMEOUT):
+    """Returns a socket connected to an address (see parse_address())
+    Raises OSError if the connection fails"""
+    if isinstance(address, str):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        try:
+            connection.connect(address)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+    return socket.create_connection(address, timeout)
+
+
+def is_closed(connection):
+    """Returns True if the aggregator closed a connection (it never sends
+    anything: the socket is only readable at the end of the stream)"""
+    readable, writable, errors = select([connection], [], [], 0)
+    return len(readable) != 0
+
+
+class Agent(Thread):
+    """Sends per-second aggregates of entries to an aggregator"""
+
+    def __init__(self, address, name=None, capacity=None, period=1,
+                 maxPending=3600):
+        """Constructor
+        :param address: address of the aggregator (see parse_address())
+        :param name: name of the agent (host name by default)
+        :param capacity: capacity of the buckets (see Bucket)
+        :param period: time between two messages in seconds
+        :param maxPending: maximum number of seconds kept while the
+        aggregator cannot be reached (the oldest ones are dropped)
+        """
+        Thread.__init__(self, daemon=True)
+        self.address = address
+        self.name = name or socket.gethostname()
+        self.capacity = capacity
+        self.period = period
+        self.maxPending = maxPending
+        # Buckets of the entries not sent yet by second
+        self.pending = {}
+        self.lock = Lock()
+        # Set by close() to end the thread
+        self.closed = Event()
+        self.connection = None
+        # The connection is retried after retryTime (monotonic clock)
+        self.retryTime = 0
+        self.retryDelay = MIN_RETRY_DELAY
+        # Messages sent and seconds dropped since the beginning
+        self.sent = 0
+        self.dropped = 0
+
+    def bucket(self, timestamp):
+        """Returns the pending bucket of a second (lock held)"""
+        bucket = self.pending.get(timestamp)
+        if bucket is None:
+            bucket = self.pending[timestamp] = Bucket(timestamp,
+                                                      self.capacity)
+        return bucket
+
+    def add_entries(self, entries, logPath):
+        """Counts the parsed LogEntry objects of a batch
+        :param logPath: path of the log file of the entries"""
+        with self.lock:
+            for entry in entries:
+                if entry.parsed:
+                    self.bucket(entry.timestamp).add(entry, logPath)
+
+    def add_bucket(self, bucket):
+        """Counts the entries aggregated in a Bucket (which is not kept)"""
+        with self.lock:
+            self.bucket(bucket.timestamp).merge(bucket)
+
+    def run(self):
+        """Sending loop: a message every period until close() is called"""
+        while not self.closed.wait(self.period):
+            self.flush()
+
+    def flush(self):
+        """Sends the pending buckets (kept if they cannot be sent, there
+        is no acknowledgement: a message sent while the aggregator stops
+        can be lost)
+        :return: True if nothing is left to send"""
+        with self.lock:
+            buckets, self.pending = self.pending, {}
+        if len(buckets) == 0:
+            return True
+        if self.connection is None and monotonic() < self.retryTime:
+            self.restore(buckets)
+            return False
+        message = encode_message(self.name, [buckets[timestamp] for
+                                             timestamp in sorted(buckets)])
+        try:
+            # Closed by a restarted aggregator: the first message sent
+            # would be lost
+            if self.connection is not None and is_closed(self.connection):
+                self.disconnect()
+            if self.connection is None:
+                self.connection = connect(self.address)
+            self.connection.sendall(message)
+        except OSError:
+            self.disconnect()
+            self.restore(buckets)
+            return False
+        self.sent += 1
+        self.retryDelay = MIN_RETRY_DELAY
+        return True
+
+    def restore(self, buckets):
+        """Puts back buckets which could not be sent
+        :param buckets: dict of Bucket objects by second"""
+        with self.lock:
+            for timestamp, bucket in buckets.items():
+                if timestamp in self.pending:
+                    bucket.merge(self.pending[timestamp])
+                self.pending[timestamp] = bucket
+            # The oldest seconds are dropped
+            while len(self.pending) > self.maxPending:
+                del self.pending[min(self.pending)]
+                self.dropped += 1
+
+    def disconnect(self):
+        """Closes the connection: it is opened again with the next message
+        if it was open, after a growing delay if it could not be opened"""
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            # The aggregator was reached: retry at once
+            self.retryTime = 0
+            return
+        self.retryTime = monotonic() + self.retryDelay
+        self.retryDelay = min(2 * self.retryDelay, MAX_RETRY_DELAY)
+
+    def close(self):
+        """Sends the pending buckets once more and ends the thread"""
+        self.closed.set()
+        if self.is_alive():
+            self.join()
+        self.retryTime = 0
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,104 @@
+# Thread object which receives the per-second aggregates of the agents
+# (see Agent) over TCP or a Unix socket, each connection being read by its
+# own thread, and gives them to the LogHandler merging them in its window
+
+from wire_format import read_frame, decode_message
+from socketserver import ThreadingMixIn, TCPServer, StreamRequestHandler
+from threading import Thread, Lock
+import socket
+import os
+
+
+class AgentRequestHandler(StreamRequestHandler):
+    """Reads the messages of an agent until it disconnects"""
+
+    def handle(self):
+        """Decodes each message and gives its buckets to the receiver
+        (the connection is closed when a message is not valid)"""
+        aggregator = self.server.aggregator
+        aggregator.connected(self.connection, True)
+        try:
+            while True:
+                payload = read_frame(self.rfile)
+                if payload is None:
+                    break
+                name, buckets = decode_message(payload, aggregator.capacity)
+                aggregator.receive(name, buckets)
+        except (OSError, ValueError):
+            pass
+        finally:
+            aggregator.connected(self.connection, False)
+
+
+class ThreadingTCPServer(ThreadingMixIn, TCPServer):
+    """TCP server reading each connection in a thread"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socket, "AF_UNIX"):
+    from socketserver import UnixStreamServer
+
+    class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+        """Unix socket server reading each connection in a thread"""
+        daemon_threads = True
+
+
+class AggregatorServer(Thread):
+    """Receives the buckets sent by the agents"""
+
+    def __init__(self, address, receive, capacity=None):
+        """Constructor (binds the address, raises OSError if it is used)
+        :param address: (host, port) tuple, port 0 for any free port
+        (see port attribute), or path of a Unix socket
+        :param receive: function called with the name of the agent and
+        the list of Bucket objects of each message (by the thread of the
+        connection)
+        :param capacity: capacity of the buckets (see Bucket)
+        """
+        Thread.__init__(self, daemon=True)
+        self.address = address
+        self.receive = receive
+        self.capacity = capacity
+        self.port = None
+        if isinstance(address, str):
+            # Socket file left by a monitor which did not stop cleanly
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = ThreadingUnixServer(address, AgentRequestHandler)
+        else:
+            self.server = ThreadingTCPServer(address, AgentRequestHandler)
+            self.port = self.server.server_address[1]
+        self.server.aggregator = self
+        # Sockets of the agents connected
+        self.connections = set()
+        self.lock = Lock()
+
+    def connected(self, connection, opened):
+        """Records a connection opened or closed
+        :param connection: socket of the connection
+        :param opened: True if it was opened, False if it was closed"""
+        with self.lock:
+            if opened:
+                self.connections.add(connection)
+            else:
+                self.connections.discard(connection)
+
+    def run(self):
+        """Serving loop, until close() is called"""
+        self.server.serve_forever()
+
+    def close(self):
+        """Stops accepting connections, closes the socket and the
+        connections (the agents keep what they could not send)"""
+        if self.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
@@ -0,0 +1,108 @@
+# The AlertEngine object decides when the traffic alert starts and ends:
+# the hits of the monitored time frame are counted in a ring of one slot
+# per second, so that the rate is evaluated at the end of every second of
+# log time at a constant cost, whatever the traffic and the time frame
+
+
+class AlertEngine:
+    """Alert state on the hits/min of the monitored time frame, with a
+    hysteresis band, a minimum hold time and an optional EWMA smoothing"""
+
+    def __init__(self, threshold, duration, hysteresis=0, holdTime=0,
+                 halfLife=0):
+        """Constructor
+        :param threshold: hits/min above which the alert starts
+        :param duration: monitored time frame in seconds
+        :param hysteresis: the alert ends below threshold*(1-hysteresis)
+        (e.g. 0.1 for 10% under the threshold)
+        :param holdTime: seconds of log time a crossing must last before
+        the alert starts or ends
+        :param halfLife: half-life in seconds of the exponentially weighted
+        moving average of the rate compared to the threshold (0 to compare
+        the rate itself)
+        """
+        self.threshold = threshold
+        self.duration = duration
+        self.hysteresis = hysteresis
+        self.holdTime = holdTime
+        self.halfLife = halfLife
+        # Weight of the rate of a new second in the average
+        self.alpha = 1 - 0.5 ** (1/halfLife) if halfLife > 0 else 1
+        # Hits by second of the time frame (slot: second % len(slots))
+        # and their total
+        self.slots = [0] * (int(duration) + 1)
+        self.hits = 0
+        # Second of log time being counted (None before the first hit)
+        self.second = None
+        # Rate compared to the threshold (smoothed) at the last evaluation
+        self.value = 0
+        self.status = False
+        # Second since which the rate is over (or under) the threshold
+        self.crossing = None
+        # (crossing second, high, value) changes of status not handled yet
+        self.events = []
+
+    def add(self, timestamp, hits=1):
+        """Counts hits of a second of log time, the seconds before the
+        most recent one are evaluated (hits of evaluated seconds are
+        counted, hits older than the time frame are ignored)
+        :param timestamp: second of the hits, in seconds since EPOCH"""
+        if self.second is None:
+            self.second = timestamp
+        elif timestamp > self.second:
+            self.advance(timestamp)
+        if timestamp > self.second - len(self.slots):
+            self.slots[timestamp % len(self.slots)] += hits
+            self.hits += hits
+
+    def advance(self, timestamp):
+        """Evaluates the seconds of log time before a given second (e.g. the
+        current time when no hits are written)
+        :param timestamp: second being counted, in seconds since EPOCH"""
+        if self.second is None:
+            self.second = timestamp
+            return
+        while self.second < timestamp:
+            self.evaluate(self.second)
+            self.second += 1
+            # The oldest second leaves the time frame
+            slot = self.second % len(self.slots)
+            self.hits -= self.slots[slot]
+            self.slots[slot] = 0
+            if self.hits == 0 and self.value == 0 and not self.status:
+                # Nothing changes until the next hit
+                self.second = timestamp
+                self.crossing = None
+
+    def evaluate(self, second):
+        """Updates the status at the end of a second of log time"""
+        rate = self.hits/self.duration*60
+        self.value += self.alpha * (rate - self.value)
+        # The average reaches 0 in finite time
+        if self.value < 1e-6:
+            self.value = 0
+        if self.status:
+            crossed = self.value < self.threshold * (1 - self.hysteresis)
+        else:
+            crossed = self.value > self.threshold
+        if not crossed:
+            self.crossing = None
+            return
+        if self.crossing is None:
+            self.crossing = second
+        if second - self.crossing >= self.holdTime:
+            self.status = not self.status
+            self.events.append((self.crossing, self.status, self.value))
+            self.crossing = None
+
+    def pop(self):
+        """Returns the changes of status since the last call
+        :return: list of (crossing second, high, rate) tuples"""
+        events, self.events = self.events, []
+        return events
+
+    def same_settings(self, other):
+        """Returns True if another engine has the same parameters"""
+        return all(getattr(self, name) == getattr(other, name)
+                   for name in ["threshold", "duration", "hysteresis",
+                                "holdTime", "halfLife"])
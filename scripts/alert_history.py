@@ -0,0 +1,121 @@
+# The AlertHistory object keeps the most recent alerts as records
+# in a ring of fixed capacity, so memory and display time stay bounded
+
+from rollups import format_duration
+from collections import deque
+from datetime import datetime
+
+# Format of the time of the alerts in the alert log (see to_dict())
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class Alert:
+    """Crossing of the alert threshold (or recovery)"""
+
+    __slots__ = ("time", "high", "rate", "threshold", "window", "rates",
+                 "subject", "share")
+
+    def __init__(self, time, high, rate, threshold, window, rates=(),
+                 subject=None, share=False):
+        """Constructor
+        :param time: datetime of the crossing
+        :param high: True when the alert is triggered, False when recovered
+        :param rate: observed hits/min over the window
+        :param threshold: alert threshold in hits/min
+        :param window: monitored time frame in seconds
+        :param rates: hits/min over shorter and longer time frames
+        as (duration, rate) tuples (see Rollups)
+        :param subject: key of a per-key alert (e.g. "ip 1.2.3.4", see
+        KeyAlerts), None for the alert on all the hits
+        :param share: True if rate and threshold are percentages of the hits
+        """
+        self.time = time
+        self.high = high
+        self.rate = rate
+        self.threshold = threshold
+        self.window = window
+        self.rates = tuple(tuple(rate) for rate in rates)
+        self.subject = subject
+        self.share = share
+
+    def message(self):
+        """Returns the message displayed for the alert (without newline)"""
+        time = self.time.strftime("%d/%b/%Y:%H:%M:%S")
+        if self.subject is not None:
+            if not self.high:
+                return ("[%s] Traffic of %s slowed down, the alert has "
+                        "recovered" % (time, self.subject))
+            if self.share:
+                return ("[%s] HIGH SHARE of %s generated an alert - "
+                        "%.1f%% of the hits" % (time, self.subject, self.rate))
+            return ("[%s] HIGH TRAFFIC on %s generated an alert - "
+                    "hits/min = %d" % (time, self.subject, self.rate))
+        if self.high:
+            message = ("[%s] HIGH TRAFFIC generated an alert - hits/min = %d"
+                       % (self.time.strftime("%d/%b/%Y:%H:%M:%S"), self.rate))
+            if len(self.rates) != 0:
+                message += " (%s)" % ", ".join(
+                    "%s: %d" % (format_duration(duration), rate)
+                    for duration, rate in self.rates)
+            return message
+        return ("[%s] Traffic slowed down, the alert has recovered"
+                % self.time.strftime("%d/%b/%Y:%H:%M:%S"))
+
+    def to_dict(self):
+        """Returns the alert as a dict (record of the alert log)"""
+        record = {"time": self.time.strftime(TIME_FORMAT),
+                  "event": "alert" if self.high else "recovered",
+                  "rate": round(self.rate, 3),
+                  "threshold": self.threshold,
+                  "window": self.window}
+        if len(self.rates) != 0:
+            record["rates"] = [[duration, round(rate, 3)]
+                               for duration, rate in self.rates]
+        if self.subject is not None:
+            record["subject"] = self.subject
+            record["share"] = self.share
+        return record
+
+
+class AlertHistory:
+    """Ring of the most recent Alert records"""
+
+    def __init__(self, capacity=500):
+        """Constructor
+        :param capacity: number of alerts kept, the oldest ones are dropped
+        """
+        self.records = deque(maxlen=capacity)
+        # Number of alerts added since the beginning (the display uses it
+        # to only draw the new ones)
+        self.count = 0
+
+    def add(self, alert):
+        """Adds an Alert record, dropping the oldest one when full"""
+        self.records.append(alert)
+        self.count += 1
+
+    def recent(self, count=None):
+        """Returns the most recent alerts, most recent first
+        :param count: maximum number of alerts (all of them by default)"""
+        if count is None:
+            count = len(self.records)
+        return [self.records[-1 - i]
+                for i in range(min(count, len(self.records)))]
+
+    def text(self):
+        """Returns the messages of the alerts, most recent first"""
+        return "".join(alert.message() + "\n" for alert in self.recent())
+
+    def __len__(self):
+        """Number of alerts kept"""
+        return len(self.records)
+
+
+def from_dict(record):
+    """Returns the Alert object of a record of the alert log
+    (records of older versions have no rates nor subject)"""
+    return Alert(datetime.strptime(record["time"], TIME_FORMAT),
+                 record["event"] == "alert", record["rate"],
+                 record["threshold"], record["window"],
+                 record.get("rates", ()), record.get("subject"),
+                 record.get("share", False))
@@ -0,0 +1,154 @@
+# Thread object which writes the alerts to the alert log in the background:
+# the monitoring thread only queues them, they are written by batches
+# as JSON Lines records in a file rotated when it gets too large
+
+from alert_history import from_dict
+from threading import Thread, Condition, Lock
+import json
+import os
+
+# Size of the blocks read when reading the alert log backwards in bytes
+BLOCK_SIZE = 1 << 16
+
+
+class AlertWriter(Thread):
+    """Writes Alert records to a rotated JSON Lines file"""
+
+    def __init__(self, logPath, flushInterval=1, maxBytes=10 << 20,
+                 backupCount=3):
+        """Constructor
+        :param logPath: path of the alert log
+        :param flushInterval: maximum time in seconds between the queuing of
+        an alert and its writing
+        :param maxBytes: the log is rotated when it exceeds this size
+        (logPath.1 is the most recent backup, 0 to disable the rotation)
+        :param backupCount: number of backups kept
+        """
+        Thread.__init__(self, daemon=True)
+        self.logPath = logPath
+        self.flushInterval = flushInterval
+        self.maxBytes = maxBytes
+        self.backupCount = backupCount
+        # Records not written yet
+        self.pending = []
+        self.condition = Condition()
+        # Held while records are written so that they stay in order
+        self.writeLock = Lock()
+        # Set to False to write the pending records and end the thread
+        self.running = True
+        self.logFile = None
+
+    def write(self, alert):
+        """Queues an alert (does not block on the file)
+        :param alert: Alert object"""
+        with self.condition:
+            self.pending.append(alert.to_dict())
+            if len(self.pending) == 1:
+                self.condition.notify()
+
+    def run(self):
+        """Writing loop: waits for records then for flushInterval
+        so that the records queued meanwhile are written at once"""
+        while True:
+            with self.condition:
+                while self.running and len(self.pending) == 0:
+                    self.condition.wait()
+                if self.running:
+                    self.condition.wait(self.flushInterval)
+                running = self.running
+            self.flush()
+            if not running:
+                break
+        if self.logFile is not None:
+            self.logFile.close()
+
+    def flush(self):
+        """Writes the pending records now (e.g. before reading the log)"""
+        with self.writeLock:
+            with self.condition:
+                records, self.pending = self.pending, []
+            if len(records) != 0:
+                self.write_records(records)
+
+    def write_records(self, records):
+        """Appends records to the alert log, rotating it if needed"""
+        try:
+            if self.logFile is None:
+                self.logFile = open(self.logPath, "a")
+            self.logFile.write("".join(json.dumps(record, sort_keys=True)
+                                       + "\n" for record in records))
+            self.logFile.flush()
+            if self.maxBytes > 0 and self.logFile.tell() > self.maxBytes:
+                self.rotate()
+        except OSError:
+            print("Cannot write alerts to %s" % self.logPath)
+
+    def rotate(self):
+        """Renames the log to logPath.1 (and the older backups to .2, ...)
+        and starts a new log"""
+        self.logFile.close()
+        self.logFile = None
+        for index in range(self.backupCount - 1, 0, -1):
+            backup = "%s.%d" % (self.logPath, index)
+            if os.path.exists(backup):
+                os.replace(backup, "%s.%d" % (self.logPath, index + 1))
+        if self.backupCount > 0:
+            os.replace(self.logPath, self.logPath + ".1")
+        else:
+            os.remove(self.logPath)
+
+    def close(self):
+        """Writes the pending records and ends the thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.is_alive():
+            self.join()
+
+
+def reverse_lines(path):
+    """Generator on the lines of a file, last line first
+    (read backwards by blocks, nothing if the file does not exist)"""
+    try:
+        logFile = open(path, "rb")
+    except OSError:
+        return
+    with logFile:
+        end = logFile.seek(0, os.SEEK_END)
+        partial = b""
+        while end > 0:
+            start = max(end - BLOCK_SIZE, 0)
+            logFile.seek(start)
+            lines = (logFile.read(end - start) + partial).split(b"\n")
+            end = start
+            # The first line might begin in the previous block
+            partial = lines.pop(0) if start > 0 else b""
+            for line in reversed(lines):
+                if line:
+                    yield line.decode("utf-8", "replace")
+
+
+def read_alerts(logPath, skip, count, backupCount=3):
+    """Reads alerts from the alert log and its backups, most recent first
+    (lines which are not records, e.g. of older versions, are ignored)
+    :param logPath: path of the alert log
+    :param skip: number of most recent alerts skipped
+    :param count: maximum number of alerts returned
+    :param backupCount: number of backups of the log
+    :return: list of Alert objects"""
+    alerts = []
+    paths = [logPath] + ["%s.%d" % (logPath, index)
+                         for index in range(1, backupCount + 1)]
+    for path in paths:
+        for line in reverse_lines(path):
+            try:
+                alert = from_dict(json.loads(line))
+            except (ValueError, KeyError, TypeError):
+                continue
+            if skip > 0:
+                skip -= 1
+                continue
+            alerts.append(alert)
+            if len(alerts) == count:
+                return alerts
+    return alerts
@@ -0,0 +1,214 @@
+# Benchmark suite of the monitor on generated logs: parsing rate,
+# LogHandler.read latency per tick, cost of drop_old_entries,
+# memory per window entry, rendering time of the summary and time to
+# seek a time in the log at startup
+# Results are printed and stored in a JSON file to compare runs
+
+from entry_generator import EntryGenerator
+from log_entry import parse_many, to_timestamp
+from log_tailer import LogTailer
+from log_handler import LogHandler
+from sliding_window import SlidingWindow
+from snapshot import Snapshot
+from datetime import datetime
+from datetime import timedelta
+from itertools import islice
+from time import perf_counter
+import tracemalloc
+import platform
+import argparse
+import json
+import os
+
+# Time of the first generated entry (the log is replayed from it)
+START = datetime(2015, 5, 30, 14, 13, 9)
+# Number of seconds covered by the generated entries (monitored window)
+WINDOW_SECONDS = 120
+# Number of LogHandler.read calls to ingest the whole log
+TICKS = 100
+# Number of lines parsed at once when measuring the parsing rate
+BLOCK_LINES = 100000
+# Number of summaries rendered to measure the rendering time
+RENDERS = 100
+# Number of times sought in the log
+SEEKS = 100
+
+
+def statistics(durations):
+    """Returns a dict of statistics on durations in seconds
+    (in milliseconds)"""
+    durations = sorted(durations)
+    return {"mean_ms": sum(durations)/len(durations)*1000,
+            "p50_ms": durations[len(durations)//2]*1000,
+            "max_ms": durations[-1]*1000}
+
+
+def generate_lines(entryGenerator, first, count, lineCount):
+    """Returns generated lines spread uniformly over the window
+    :param first: index of the first line
+    :param count: number of lines
+    :param lineCount: total number of lines of the log"""
+    return [entryGenerator.generate_entry(
+        START + timedelta(seconds=i*WINDOW_SECONDS//lineCount))
+        for i in range(first, first + count)]
+
+
+def read_blocks(logPath):
+    """Generator on the lines of a log by blocks of BLOCK_LINES lines"""
+    with open(logPath) as logFile:
+        while True:
+            block = [line.rstrip("\n")
+                     for line in islice(logFile, BLOCK_LINES)]
+            if len(block) == 0:
+                break
+            yield block
+
+
+def benchmark_read(logPath, lineCount, seed):
+    """Writes the log in TICKS parts, reading each part with a LogHandler
+    :param seed: seed of the generated entries
+    :return: (LogHandler object, dict of results)"""
+    entryGenerator = EntryGenerator(logPath, 60, seed)
+    entryGenerator.clear_log()
+    logHandler = LogHandler(logPath, 10, 1e12, WINDOW_SECONDS)
+    # The clock of the monitor is the end of the generated window
+    logHandler.replayTime = START + timedelta(seconds=WINDOW_SECONDS)
+    # Same (sequential) reading path whatever the number of cores
+    logHandler.catchUpProcesses = 1
+    durations = []
+    with open(logPath, "a") as logFile:
+        for tick in range(TICKS):
+            first = lineCount*tick//TICKS
+            count = lineCount*(tick + 1)//TICKS - first
+            logFile.write("".join(generate_lines(entryGenerator, first,
+                                                 count, lineCount)))
+            logFile.flush()
+            startTime = perf_counter()
+            logHandler.read()
+            durations.append(perf_counter() - startTime)
+    results = statistics(durations)
+    results["lines_per_tick"] = lineCount//TICKS
+    results["hits"] = logHandler.hits
+    return logHandler, results
+
+
+def benchmark_parse(logPath, lineCount):
+    """Measures the parsing rate of the lines of the log"""
+    duration = 0
+    parsed = 0
+    for block in read_blocks(logPath):
+        startTime = perf_counter()
+        parsed += sum(1 for entry in parse_many(block) if entry.parsed)
+        duration += perf_counter() - startTime
+    return {"lines_per_s": lineCount/duration, "parsed": parsed}
+
+
+def benchmark_memory(logPath, lineCount):
+    """Measures the memory of a window holding all the lines of the log"""
+    window = SlidingWindow()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for block in read_blocks(logPath):
+        for entry in parse_many(block):
+            window.add(entry, logPath)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {"bytes_per_entry": memory/lineCount, "buckets": len(window)}
+
+
+def benchmark_drop(logHandler):
+    """Measures drop_old_entries while the window expires second by second
+    (one bucket removed by call, the window is empty at the end)"""
+    durations = []
+    for second in range(WINDOW_SECONDS + 1):
+        logHandler.lastReadTime = START + timedelta(
+            seconds=WINDOW_SECONDS + 1 + second)
+        startTime = perf_counter()
+        logHandler.drop_old_entries()
+        durations.append(perf_counter() - startTime)
+    results = statistics(durations)
+    results["total_ms"] = sum(durations)*1000
+    return results
+
+
+def benchmark_render(logHandler):
+    """Measures the rendering time of the summary of a full window
+    (including the snapshot of the window it is rendered from)"""
+    durations = []
+    for i in range(RENDERS):
+        startTime = perf_counter()
+        logHandler.snapshot = Snapshot(logHandler)
+        logHandler.summary_message()
+        durations.append(perf_counter() - startTime)
+    return statistics(durations)
+
+
+def benchmark_seek(logPath):
+    """Measures the binary search of times spread over the log
+    (done at startup to skip the lines older than the time frames)"""
+    durations = []
+    tailer = LogTailer(logPath)
+    for i in range(SEEKS):
+        tailer.close()
+        timestamp = to_timestamp(START) + i*WINDOW_SECONDS//SEEKS
+        startTime = perf_counter()
+        tailer.seek_time(timestamp)
+        durations.append(perf_counter() - startTime)
+    tailer.close()
+    return statistics(durations)
+
+
+def run(lineCount, logPath, seed):
+    """Runs the benchmarks on a log of lineCount lines
+    :param seed: seed of the generated entries
+    :return: dict of results by benchmark"""
+    logHandler, readResults = benchmark_read(logPath, lineCount, seed)
+    results = {"lines": lineCount,
+               "parse": benchmark_parse(logPath, lineCount),
+               "read": readResults,
+               "render": benchmark_render(logHandler),
+               "drop_old_entries": benchmark_drop(logHandler),
+               "seek": benchmark_seek(logPath),
+               "memory": benchmark_memory(logPath, lineCount)}
+    logHandler.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP monitor benchmarks")
+    parser.add_argument("--sizes", default="1e4,1e5,1e6",
+                        help="comma-separated numbers of generated lines "
+                        "(from 1e4 to 1e7)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="seed of the generated logs")
+    parser.add_argument("--log", default="benchmark.log",
+                        help="path of the generated log")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="JSON file where results are stored")
+    args = parser.parse_args()
+
+    report = {"date": datetime.now().isoformat(),
+              "python": platform.python_version(),
+              "platform": platform.platform(),
+              "seed": args.seed,
+              "runs": []}
+    for size in args.sizes.split(","):
+        lineCount = int(float(size))
+        # Same generated log for a given seed and size
+        results = run(lineCount, args.log, args.seed)
+        report["runs"].append(results)
+        print("%d lines:" % lineCount)
+        print("  Parsing: %d lines/s" % results["parse"]["lines_per_s"])
+        print("  Read: %.3fms/tick (max %.3fms) for %d lines/tick"
+              % (results["read"]["mean_ms"], results["read"]["max_ms"],
+                 results["read"]["lines_per_tick"]))
+        print("  drop_old_entries: %.3fms/second expired"
+              % results["drop_old_entries"]["mean_ms"])
+        print("  Memory per window entry: %d bytes"
+              % results["memory"]["bytes_per_entry"])
+        print("  Summary rendering: %.3fms" % results["render"]["mean_ms"])
+        print("  Startup seek: %.3fms" % results["seek"]["mean_ms"])
+    os.remove(args.log)
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print("Results stored in %s" % args.output)
@@ -0,0 +1,118 @@
+# Parallel parsing of a large part of a log not read yet (backlog):
+# the byte range is split in line-aligned chunks parsed by a process pool,
+# each process returning the entries aggregated in per-second buckets
+
+from log_entry import parse_many
+from sliding_window import Bucket
+import multiprocessing
+
+# Size of the blocks read from the file at once in bytes
+BLOCK_SIZE = 1 << 20
+# Number of chunks given to each process (balances the work)
+CHUNKS_PER_PROCESS = 4
+# Start method of the processes: forking the monitor while its other
+# threads hold locks (queue, alert writer...) can hang the children
+START_METHOD = "spawn"
+
+
+def last_line_end(logFile, start, end):
+    """Returns the offset following the last newline between two offsets,
+    start if there is none
+    :param logFile: file object opened in binary mode
+    :param start: offset where the search stops
+    :param end: offset where the search starts (going backwards)"""
+    while end > start:
+        blockStart = max(end - BLOCK_SIZE, start)
+        logFile.seek(blockStart)
+        index = logFile.read(end - blockStart).rfind(b"\n")
+        if index >= 0:
+            return blockStart + index + 1
+        end = blockStart
+    return start
+
+
+def split_chunks(logPath, start, end, count):
+    """Splits a byte range of a log in line-aligned chunks
+    :param logPath: path of the log file
+    :param start: offset of the beginning of a line
+    :param end: offset following a newline
+    :param count: maximum number of chunks
+    :return: list of (start, end) offsets"""
+    bounds = [start]
+    with open(logPath, "rb") as logFile:
+        for i in range(1, count):
+            position = start + (end - start) * i // count
+            if position <= bounds[-1]:
+                continue
+            # Move to the beginning of the next line
+            logFile.seek(position - 1)
+            logFile.readline()
+            position = logFile.tell()
+            if position >= end:
+                break
+            bounds.append(position)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def read_chunk(logPath, start, end):
+    """Generator on the lines of a line-aligned chunk of a log
+    (read by blocks, without their trailing newline)"""
+    with open(logPath, "rb") as logFile:
+        logFile.seek(start)
+        partial = b""
+        remaining = end - start
+        while remaining > 0:
+            block = logFile.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            data = partial + block
+            lineEnd = data.rfind(b"\n") + 1
+            partial = data[lineEnd:]
+            if lineEnd == 0:
+                continue
+            for line in data[:lineEnd - 1].decode("utf-8",
+                                                  "replace").split("\n"):
+                yield line
+
+
+def parse_chunk(task):
+    """Parses a chunk of a log (called in a worker process)
+    :param task: tuple (logPath, start, end, limitTime, capacity), entries
+    older than limitTime are ignored, capacity is the one of the buckets
+    :return: list of Bucket objects"""
+    logPath, start, end, limitTime, capacity = task
+    buckets = {}
+    for entry in parse_many(read_chunk(logPath, start, end)):
+        if entry.parsed and entry.timestamp >= limitTime:
+            bucket = buckets.get(entry.timestamp)
+            if bucket is None:
+                bucket = Bucket(entry.timestamp, capacity)
+                buckets[entry.timestamp] = bucket
+            bucket.add(entry, logPath)
+    return list(buckets.values())
+
+
+def catch_up(logPath, start, end, limitTime, processes, capacity=None):
+    """Parses a byte range of a log with a pool of processes
+    :param logPath: path of the log file
+    :param start: offset of the beginning of a line
+    :param end: offset following a newline
+    :param limitTime: entries older than this timestamp are ignored
+    :param processes: number of worker processes
+    :param capacity: capacity of the buckets (see Bucket)
+    :return: list of Bucket objects (several buckets can have the same
+    second when it is split between chunks)"""
+    chunks = split_chunks(logPath, start, end, processes * CHUNKS_PER_PROCESS)
+    tasks = [(logPath, chunkStart, chunkEnd, limitTime, capacity)
+             for chunkStart, chunkEnd in chunks]
+    buckets = []
+    pool = multiprocessing.get_context(START_METHOD).Pool(processes)
+    try:
+        for chunkBuckets in pool.imap(parse_chunk, tasks):
+            buckets.extend(chunkBuckets)
+    finally:
+        pool.terminate()
+        pool.join()
+    return buckets
@@ -0,0 +1,44 @@
+# Checkpoints of the state of the monitor: the buckets of the window, the
+# rollups, the read offsets of the logs and the alerts are written
+# periodically so that a restarted monitor resumes from them and only
+# reads what was written to the logs since
+
+import pickle
+import zlib
+import os
+
+# Version of the format, checkpoints of other versions are ignored
+VERSION = 1
+
+
+def write_checkpoint(path, state):
+    """Writes a checkpoint (compressed pickle), replacing the previous one
+    at once so that a crash never leaves a partial checkpoint
+    :param path: path of the checkpoint file
+    :param state: dict of picklable objects (see LogHandler.checkpoint())"""
+    state = dict(state, version=VERSION)
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL), 1)
+    try:
+        with open(path + ".tmp", "wb") as checkpointFile:
+            checkpointFile.write(data)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        print("Cannot write the checkpoint %s" % path)
+
+
+def read_checkpoint(path, keys=()):
+    """Reads a checkpoint
+    :param path: path of the checkpoint file
+    :param keys: keys the state must have
+    :return: dict given to write_checkpoint(), None if there is no valid
+    checkpoint"""
+    try:
+        with open(path, "rb") as checkpointFile:
+            state = pickle.loads(zlib.decompress(checkpointFile.read()))
+    except Exception:
+        # A damaged checkpoint can raise almost anything while unpickled
+        return None
+    if not isinstance(state, dict) or state.get("version") != VERSION \
+            or any(key not in state for key in keys):
+        return None
+    return state
@@ -1,19 +1,44 @@
 # Thread object which generates random entries
 # and writes to a simulation log to test the LogHandler
 
-from time import sleep
+from time import sleep, monotonic
 from datetime import datetime
 from threading import Thread
 import random
 
+# Period of the batches written in load mode in seconds
+BATCH_PERIOD = 0.01
+# Traffic profiles of the load mode
+PROFILES = ("steady", "ramp", "burst", "square")
+
+
+def profile_rate(profile, rate, elapsed, duration, period):
+    """Returns the target rate of a traffic profile at a given time
+    :param profile: "steady" (constant rate), "ramp" (from 0 to rate
+    over the duration), "burst" (rate/10 with bursts at rate during the
+    first tenth of each period) or "square" (rate during the first half of
+    each period and nothing during the second one, for alert flapping)
+    :param rate: (peak) rate in entries per second
+    :param elapsed: seconds since the beginning of the generation
+    :param duration: duration of the generation in seconds
+    :param period: period of the burst and square profiles in seconds"""
+    if profile == "ramp":
+        return rate * min(elapsed/duration, 1)
+    if profile == "burst":
+        return rate if elapsed % period < period/10 else rate/10
+    if profile == "square":
+        return rate if elapsed % period < period/2 else 0
+    return rate
+
 
 class EntryGenerator(Thread):
     """Generates random entries and writes to a simulation log"""
 
-    def __init__(self, logPath, rate):
+    def __init__(self, logPath, rate, seed=None):
         """Constructor:
         :param logPath: path of the simulation log
-        :param rate: entry generation rate in number of entries per minute"""
+        :param rate: entry generation rate in number of entries per minute
+        :param seed: seed of the random entries (None for a random one)"""
         Thread.__init__(self)
         self.logPath = logPath
         # Set to False to stop the generation loop and end the thread (stop())
@@ -26,27 +51,51 @@ class EntryGenerator(Thread):
         self.codes = ["200", "200", "200", "200", "200", "304", "403", "404"]
         # Number of entries generated per minute
         self.rate = rate
+        # Own random generator so that seeded runs can be reproduced
+        self.random = random.Random(seed)
+        # Load mode (see load()): rate in entries per second, None to
+        # generate entries one by one at the rate above
+        self.loadRate = None
+        self.profile = "steady"
+        self.loadDuration = 60
+        self.loadPeriod = 10
+        # Number of entries written and rate achieved by the last load
+        self.written = 0
+        self.achievedRate = 0
 
     def generate_entry(self, entryTime):
         """Returns a random entry string at the time given in parameter
         :param entryTime: Time of the generated entry"""
-        # Chooses randomly between predefined ips or a random one
-        ip = random.choice([random.choice(self.ips), self.random_ip()])
-        method = random.choice(self.methods)
-        # Randomize section choose first part as random
-        # and then choose if it's a file or if there will be another section
-        section = random.choice(self.sections) \
-            + random.choice([".html",
-                            random.choice(self.sections)+".html"])
-        code = random.choice(self.codes)
-        size = random.randint(10, 100000)
-        return ('%s - - [%s +1000] "%s %s HTTP/1.1" %s %d\n'
-                % (ip,
-                   entryTime.strftime("%d/%b/%Y:%H:%M:%S"),
-                   method,
-                   section,
-                   code,
-                   size))
+        return self.generate_entries(entryTime, 1)[0]
+
+    def generate_entries(self, entryTime, count):
+        """Returns a list of random entry strings at the same time
+        (the time is only formatted once)
+        :param entryTime: Time of the generated entries
+        :param count: number of entries"""
+        time = entryTime.strftime("%d/%b/%Y:%H:%M:%S")
+        choice = self.random.choice
+        entries = []
+        for i in range(count):
+            # Chooses randomly between predefined ips or a random one
+            if self.random.random() < 0.5:
+                ip = choice(self.ips)
+            else:
+                ip = self.random_ip()
+            method = choice(self.methods)
+            # Randomize section choose first part as random
+            # and then choose if it's a file or if there will be
+            # another section
+            section = choice(self.sections)
+            if self.random.random() < 0.5:
+                section += ".html"
+            else:
+                section += choice(self.sections) + ".html"
+            code = choice(self.codes)
+            size = self.random.randint(10, 100000)
+            entries.append('%s - - [%s +1000] "%s %s HTTP/1.1" %s %d\n'
+                           % (ip, time, method, section, code, size))
+        return entries
 
     def write_entry(self, entryTime):
         """Write a random entry to the simulation log file
@@ -75,9 +124,44 @@ class EntryGenerator(Thread):
 
     def random_ip(self):
         """Returns a random IP as a string"""
-        return str(random.randint(0, 255)) + "." + str(random.randint(0, 255)) \
-            + "." + str(random.randint(0, 255)) + "." \
-            + str(random.randint(0, 255))
+        return "%d.%d.%d.%d" % tuple(self.random.getrandbits(32)
+                                     .to_bytes(4, "big"))
+
+    def load(self, rate, profile="steady", duration=60, period=10):
+        """Writes entries at a precise target rate (load mode): the log is
+        kept open and entries are written by buffered batches
+        every BATCH_PERIOD seconds, late batches are caught up
+        :param rate: (peak) rate in entries per second
+        :param profile: traffic profile (see profile_rate())
+        :param duration: duration of the generation in seconds
+        :param period: period of the burst and square profiles in seconds
+        :return: achieved rate in entries per second"""
+        if profile not in PROFILES:
+            raise ValueError("Unknown traffic profile: %s" % profile)
+        self.written = 0
+        # Number of entries to write so far (integral of the rate)
+        target = 0.0
+        batch = 0
+        with open(self.logPath, "a", buffering=1 << 20) as generatedLog:
+            start = monotonic()
+            elapsed = 0
+            while self.running and elapsed < duration:
+                target += profile_rate(profile, rate, batch*BATCH_PERIOD,
+                                       duration, period) * BATCH_PERIOD
+                count = int(target) - self.written
+                if count > 0:
+                    generatedLog.write("".join(
+                        self.generate_entries(datetime.now(), count)))
+                    generatedLog.flush()
+                    self.written += count
+                batch += 1
+                # Sleep until the next batch unless late
+                delay = start + batch*BATCH_PERIOD - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                elapsed = monotonic() - start
+        self.achievedRate = self.written/max(elapsed, 1e-9)
+        return self.achievedRate
 
     def stop(self):
         """Stops the generation loop and thus stop the thread"""
@@ -93,9 +177,13 @@ class EntryGenerator(Thread):
 
     def run(self):
         """Main generation loop"""
+        if self.loadRate is not None:
+            self.load(self.loadRate, self.profile, self.loadDuration,
+                      self.loadPeriod)
+            return
         while(self.running):
             if self.generating:
                 now = datetime.now()
                 self.write_entry(now)
             # Sleep on average during (1/rate*60) seconds
-            sleep(random.random()*2/self.rate*60)
+            sleep(self.random.random()*2/self.rate*60)
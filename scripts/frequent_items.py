@@ -0,0 +1,78 @@
+# The FrequentItems object counts the most frequent keys of a stream
+# (clients, sections) with a fixed amount of memory
+
+from collections import Counter
+
+
+class FrequentItems:
+    """Misra-Gries summary keeping at most capacity counters
+    Error bound: for a stream of n keys, the estimated count of a key
+    is between its true count - n/(capacity+1) and its true count,
+    so every key seen more than n/(capacity+1) times is kept
+    Summaries of several streams (seconds of the window) can be merged
+    by adding their counts, the error bound holds for the merged stream
+    """
+
+    __slots__ = ("capacity", "counts", "total")
+
+    def __init__(self, capacity):
+        """Constructor
+        :param capacity: maximum number of keys counted
+        """
+        self.capacity = capacity
+        # Estimated count by key
+        self.counts = {}
+        # Number of keys added (n)
+        self.total = 0
+
+    def add(self, key, count=1):
+        """Counts occurrences of a key
+        :param key: hashable object
+        :param count: number of occurrences"""
+        self.total += count
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif len(counts) < self.capacity:
+            counts[key] = count
+        else:
+            # Full: all the counters (and the new one) are decremented
+            # by the smallest one, the counters reaching 0 are removed
+            decrement = min(count, min(counts.values()))
+            for other in list(counts):
+                if counts[other] == decrement:
+                    del counts[other]
+                else:
+                    counts[other] -= decrement
+            if count > decrement:
+                counts[key] = count - decrement
+
+    def merge(self, other):
+        """Adds the keys of another summary (same capacity)"""
+        self.total += other.total
+        counts = self.counts
+        for key, count in other.counts.items():
+            counts[key] = counts.get(key, 0) + count
+        if len(counts) > self.capacity:
+            # Decrement by the (capacity+1)-th largest count
+            decrement = sorted(counts.values(),
+                               reverse=True)[self.capacity]
+            for key in list(counts):
+                if counts[key] <= decrement:
+                    del counts[key]
+                else:
+                    counts[key] -= decrement
+
+    def __len__(self):
+        """Number of keys counted"""
+        return len(self.counts)
+
+
+def merge_counts(summaries):
+    """Returns a Counter of the estimated counts over several summaries
+    (each estimate is at most sum(n)/(capacity+1) below the true count)
+    :param summaries: iterable of FrequentItems objects"""
+    counts = Counter()
+    for summary in summaries:
+        counts.update(summary.counts)
+    return counts
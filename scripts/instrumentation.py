@@ -0,0 +1,123 @@
+# The Instrumentation object records the hot-path metrics of the monitor
+# itself (lines read and parsed, parse failures, eviction, update and
+# rendering times) and the Profiler object captures cProfile profiles of
+# its threads, to see why the monitor is slow when it is
+
+from threading import Lock
+import cProfile
+import pstats
+
+# Timings recorded (see Instrumentation.time())
+TIMINGS = ("parse", "evict", "update", "render")
+
+
+class Timing:
+    """Number, total, last and maximum durations of an operation"""
+
+    __slots__ = ("count", "total", "last", "max")
+
+    def __init__(self):
+        """Constructor"""
+        self.count = 0
+        self.total = 0
+        self.last = 0
+        self.max = 0
+
+    def add(self, duration, count=1):
+        """Records a duration
+        :param duration: duration in seconds
+        :param count: number of operations of the duration (e.g. lines)"""
+        self.count += count
+        self.total += duration
+        self.last = duration/count if count != 0 else 0
+        self.max = max(self.max, self.last)
+
+    def mean(self):
+        """Returns the mean duration of an operation in seconds"""
+        return self.total/self.count if self.count != 0 else 0
+
+
+class Instrumentation:
+    """Counters and timings of the monitor itself"""
+
+    def __init__(self):
+        """Constructor"""
+        # Totals since the beginning (updated by the reading thread)
+        self.lines = 0
+        self.bytes = 0
+        self.failures = 0
+        # Durations by operation (parse: by line)
+        self.timings = {name: Timing() for name in TIMINGS}
+        # Lines and bytes read during the last tick (see tick())
+        self.tickLines = 0
+        self.tickBytes = 0
+        self.tickStart = (0, 0)
+
+    def read(self, lines, size, failures, duration):
+        """Records lines read and parsed
+        :param lines: number of lines
+        :param size: number of bytes
+        :param failures: number of lines which could not be parsed
+        :param duration: time spent reading and parsing them in seconds"""
+        self.lines += lines
+        self.bytes += size
+        self.failures += failures
+        if lines != 0:
+            self.timings["parse"].add(duration, lines)
+
+    def time(self, name, duration):
+        """Records the duration of an operation (see TIMINGS)"""
+        self.timings[name].add(duration)
+
+    def tick(self):
+        """Ends a tick (refresh): lines and bytes read since the last one"""
+        self.tickLines = self.lines - self.tickStart[0]
+        self.tickBytes = self.bytes - self.tickStart[1]
+        self.tickStart = (self.lines, self.bytes)
+
+    def to_dict(self):
+        """Returns the metrics as a dict (copied, e.g. for a snapshot)"""
+        metrics = {"lines": self.lines, "bytes": self.bytes,
+                   "parse_failures": self.failures,
+                   "tick_lines": self.tickLines,
+                   "tick_bytes": self.tickBytes}
+        for name, timing in self.timings.items():
+            metrics[name] = {"count": timing.count,
+                             "mean_ms": timing.mean()*1000,
+                             "last_ms": timing.last*1000,
+                             "max_ms": timing.max*1000}
+        return metrics
+
+
+class Profiler:
+    """cProfile profiles of several threads, dumped as a single one"""
+
+    def __init__(self, path):
+        """Constructor
+        :param path: file where the profile is dumped (see pstats)
+        """
+        self.path = path
+        self.profiles = []
+        self.lock = Lock()
+
+    def run(self, function, *args):
+        """Calls a function under a profiler of the current thread
+        :return: what the function returned"""
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            with self.lock:
+                self.profiles.append(profile)
+
+    def dump(self):
+        """Writes the profiles of the functions run so far"""
+        with self.lock:
+            if len(self.profiles) == 0:
+                return
+            stats = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        stats.dump_stats(self.path)
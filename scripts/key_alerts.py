@@ -0,0 +1,250 @@
+# The KeyAlerts object evaluates alert rules on the hits of single keys
+# (sections, client ips, status codes, methods) over the monitored time
+# frame, e.g. "section api over 2000 hits/min", "any ip over 500 hits/min"
+# or "5xx codes over 5% of the hits": the counts are updated with each
+# entry and the keys are forgotten when their last second expires
+
+from frequent_items import FrequentItems
+from sliding_window import subtract
+from collections import Counter
+from heapq import heappush, heappop, heapify
+from fnmatch import fnmatch
+
+# Attribute of the Bucket objects holding the counts of each field
+FIELDS = {"section": "sections", "ip": "ips", "code": "codes",
+          "method": "methods"}
+# Shares of the hits only trigger alerts over this number of hits
+MIN_SHARE_HITS = 100
+# The heaps of the counts of the share rules are rebuilt when they hold
+# more than twice their number of keys plus this number of stale counts
+HEAP_MARGIN = 1024
+
+
+class KeyRule:
+    """Threshold on the hits of the keys of a field"""
+
+    __slots__ = ("name", "field", "pattern", "threshold", "share")
+
+    def __init__(self, name, field, pattern, threshold, share=False):
+        """Constructor
+        :param name: name of the rule
+        :param field: section, ip, code or method
+        :param pattern: * to evaluate each key on its own, otherwise the
+        keys matching this pattern are counted together (e.g. 5??)
+        :param threshold: hits/min, or percentage of the hits if share
+        :param share: True if the threshold is a share of all the hits
+        """
+        if field not in FIELDS:
+            raise ValueError("Unknown field: %s" % field)
+        self.name = name
+        self.field = field
+        self.pattern = pattern
+        self.threshold = threshold
+        self.share = share
+
+    def key(self, value):
+        """Returns the key counted for a value of the field
+        (None if the rule does not count it)"""
+        if self.pattern == "*":
+            return value
+        if fnmatch(value, self.pattern):
+            return self.pattern
+        return None
+
+    def value(self, count, hits, duration):
+        """Returns the value compared to the threshold
+        :param count: hits of a key in the time frame
+        :param hits: hits of all the keys in the time frame
+        :param duration: time frame in seconds"""
+        if self.share:
+            return count/hits*100 if hits >= MIN_SHARE_HITS else 0
+        return count/duration*60
+
+    def subject(self, key):
+        """Returns the description of a key of the rule (e.g. ip 1.2.3.4)"""
+        return "%s %s" % (self.field, key)
+
+    def text(self):
+        """Returns the rule as written in parameters.cfg"""
+        return "%s %s %g%s" % (self.field, self.pattern, self.threshold,
+                               "%" if self.share else "")
+
+
+def parse_rule(name, text):
+    """Returns the KeyRule of a line of the [Alerts] section of
+    parameters.cfg: field, pattern and threshold (e.g. "ip * 500",
+    "code 5?? 5%"), raises ValueError if it is not valid"""
+    words = text.split()
+    if len(words) != 3:
+        raise ValueError("Invalid alert rule %s: %s" % (name, text))
+    field, pattern, threshold = words
+    share = threshold.endswith("%")
+    # Sections are written with their slash (e.g. /api)
+    if field == "section" and pattern != "*":
+        pattern = pattern.strip("/") or "root"
+    return KeyRule(name, field, pattern, float(threshold.rstrip("%")), share)
+
+
+class KeyAlerts:
+    """Alert rules evaluated on the hits of the keys
+    of the monitored time frame"""
+
+    def __init__(self, rules, monitorDuration, hysteresis=0):
+        """Constructor
+        :param rules: list of KeyRule objects
+        :param monitorDuration: monitored time frame in seconds
+        :param hysteresis: the alert of a key ends under
+        threshold*(1-hysteresis) (see AlertEngine)
+        """
+        self.rules = list(rules)
+        self.monitorDuration = monitorDuration
+        self.hysteresis = hysteresis
+        # Most recent second of log time (time of the crossings)
+        self.second = 0
+        # Hits of all the keys by second and in the time frame
+        self.secondHits = {}
+        self.hits = 0
+        # Heap of the seconds with hits (oldest first)
+        self.timestamps = []
+        # By rule: Counter of the hits of each key by second,
+        # Counter of the time frame and keys in alert
+        self.buckets = [{} for rule in self.rules]
+        self.counts = [Counter() for rule in self.rules]
+        self.active = [set() for rule in self.rules]
+        # By rule on shares: max-heap of (-count, key), a key being pushed
+        # again when its count changes (the other counts are stale)
+        self.heaps = [[] for rule in self.rules]
+        # (second, rule, key, high, value) crossings not handled yet
+        # (see pop())
+        self.events = []
+
+    def add(self, entry):
+        """Counts a parsed LogEntry for each rule"""
+        self.add_second(entry.timestamp, 1)
+        for index, rule in enumerate(self.rules):
+            key = rule.key(getattr(entry, rule.field))
+            if key is not None:
+                self.count(index, entry.timestamp, key, 1)
+
+    def add_bucket(self, bucket):
+        """Counts the entries aggregated in a Bucket for each rule
+        (approximate when its sections and ips are)"""
+        self.add_second(bucket.timestamp, bucket.hits)
+        for index, rule in enumerate(self.rules):
+            counts = getattr(bucket, FIELDS[rule.field])
+            if isinstance(counts, FrequentItems):
+                counts = counts.counts
+            for value, hits in counts.items():
+                key = rule.key(value)
+                if key is not None:
+                    self.count(index, bucket.timestamp, key, hits)
+
+    def add_second(self, timestamp, hits):
+        """Counts hits of all the keys in a second"""
+        if timestamp not in self.secondHits:
+            self.secondHits[timestamp] = 0
+            heappush(self.timestamps, timestamp)
+        self.secondHits[timestamp] += hits
+        self.hits += hits
+        self.second = max(self.second, timestamp)
+
+    def count(self, index, timestamp, key, hits):
+        """Counts hits of a key of a rule and checks its threshold"""
+        bucket = self.buckets[index].get(timestamp)
+        if bucket is None:
+            bucket = self.buckets[index][timestamp] = Counter()
+        bucket[key] += hits
+        self.counts[index][key] += hits
+        self.push(index, key)
+        self.check(index, key)
+
+    def push(self, index, key):
+        """Pushes the count of a key of a rule on shares to its heap"""
+        if self.rules[index].share:
+            count = self.counts[index].get(key, 0)
+            if count > 0:
+                heappush(self.heaps[index], (-count, key))
+
+    def check(self, index, key):
+        """Records the crossing of the threshold by a key of a rule"""
+        rule = self.rules[index]
+        value = rule.value(self.counts[index].get(key, 0), self.hits,
+                           self.monitorDuration)
+        active = self.active[index]
+        if key in active:
+            if value < rule.threshold * (1 - self.hysteresis):
+                active.remove(key)
+                self.events.append((self.second, rule, key, False, value))
+        elif value > rule.threshold:
+            active.add(key)
+            self.events.append((self.second, rule, key, True, value))
+
+    def drop_before(self, limitTime):
+        """Removes the seconds older than a given time, the keys without
+        hits left are forgotten
+        :param limitTime: timestamp of the oldest second to keep"""
+        self.second = max(self.second, limitTime + int(self.monitorDuration))
+        while len(self.timestamps) != 0 and self.timestamps[0] < limitTime:
+            timestamp = heappop(self.timestamps)
+            self.hits -= self.secondHits.pop(timestamp)
+            for index in range(len(self.rules)):
+                bucket = self.buckets[index].pop(timestamp, None)
+                if bucket is not None:
+                    subtract(self.counts[index], bucket)
+                    for key in bucket:
+                        self.push(index, key)
+                        self.check(index, key)
+        self.check_shares()
+
+    def check_shares(self):
+        """Checks the keys of the rules on shares, which change with the
+        hits of the other keys (called after each batch): the keys in
+        alert and the largest keys, down to the first one under the
+        threshold"""
+        for index, rule in enumerate(self.rules):
+            if rule.share:
+                keys = set(self.active[index])
+                keys.update(self.largest_keys(index))
+                for key in keys:
+                    self.check(index, key)
+
+    def largest_keys(self, index):
+        """Returns the keys of a rule on shares over its threshold"""
+        rule = self.rules[index]
+        counts = self.counts[index]
+        heap = self.heaps[index]
+        if len(heap) > 2 * len(counts) + HEAP_MARGIN:
+            heap[:] = [(-count, key) for key, count in counts.items()]
+            heapify(heap)
+        largest = []
+        while len(heap) != 0:
+            count, key = heap[0]
+            if counts.get(key, 0) != -count:
+                heappop(heap)
+            elif rule.value(-count, self.hits, self.monitorDuration) \
+                    > rule.threshold:
+                largest.append(heappop(heap))
+            else:
+                break
+        for item in largest:
+            heappush(heap, item)
+        return [key for count, key in largest]
+
+    def pop(self):
+        """Returns the crossings recorded since the last call
+        :return: list of (second, rule, key, high, value) tuples"""
+        events, self.events = self.events, []
+        return events
+
+    def __len__(self):
+        """Number of keys counted over all the rules"""
+        return sum(len(counts) for counts in self.counts)
+
+
+def read_rules(config):
+    """Returns the KeyRule objects of the [Alerts] section of a
+    ConfigParser object (none if there is no such section)"""
+    if not config.has_section("Alerts"):
+        return []
+    return [parse_rule(name, text) for name, text
+            in config.items("Alerts", raw=True)]
@@ -0,0 +1,114 @@
+# Reading of the rotated files of a log (access.log.1, access.log.2.gz...)
+# by chunks, decompressed on the fly when they are compressed with gzip,
+# so that the part of the time frames written before a rotation can be
+# read (startup, restart, replay) with a constant amount of memory
+
+from log_entry import LogEntry
+from log_tailer import LogTailer
+import gzip
+import os
+
+# Suffix of the compressed files
+GZIP_SUFFIX = ".gz"
+# Size of the blocks read (decompressed) at once in bytes
+CHUNK_SIZE = 1 << 20
+# Number of lines read to find the time of the beginning of a file
+FIRST_LINES = 100
+
+
+def rotated_paths(logPath):
+    """Returns the rotated files of a log, most recent first
+    (logPath.1, logPath.2.gz...: numbered suffixes, the chain stops at
+    the first missing number)"""
+    paths = []
+    index = 1
+    while True:
+        for path in ["%s.%d" % (logPath, index),
+                     "%s.%d%s" % (logPath, index, GZIP_SUFFIX)]:
+            if os.path.isfile(path):
+                paths.append(path)
+                break
+        else:
+            return paths
+        index += 1
+
+
+def open_log(path):
+    """Opens a log file in binary mode (decompressed on the fly if its
+    name ends with GZIP_SUFFIX)"""
+    if path.endswith(GZIP_SUFFIX):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_lines(path, offset=0):
+    """Generator on the lines of a whole file, without their newline
+    (read by chunks: memory does not depend on the size of the file)
+    Raises OSError if the file cannot be read
+    :param path: path of the file, compressed or not
+    :param offset: offset of the first line (in the decompressed data)"""
+    with open_log(path) as logFile:
+        if offset > 0:
+            logFile.seek(offset)
+        partial = b""
+        while True:
+            chunk = logFile.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = partial + chunk
+            # Keep the bytes after the last newline for the next chunk
+            end = data.rfind(b"\n") + 1
+            partial = data[end:]
+            if end == 0:
+                continue
+            for line in data[:end - 1].decode("utf-8", "replace").split("\n"):
+                yield line
+        # A rotated file is complete, even without a last newline
+        if partial:
+            yield partial.decode("utf-8", "replace")
+
+
+def first_time(path):
+    """Returns the time of the first parsed line of a file
+    among its FIRST_LINES first lines (None if there is none)"""
+    for index, line in enumerate(read_lines(path)):
+        entry = LogEntry(line)
+        if entry.parsed:
+            return entry.timestamp
+        if index + 1 == FIRST_LINES:
+            break
+    return None
+
+
+def rotated_lines(logPath, timestamp=None):
+    """Generator on the lines of the rotated files of a log, oldest first
+    Raises OSError if a file cannot be read
+    :param logPath: path of the log
+    :param timestamp: if not None, the files which only have older lines
+    are not read and the uncompressed ones are read from the first line
+    at or after this time (the older lines of the compressed ones are
+    read, the caller ignores them)"""
+    paths = []
+    for path in rotated_paths(logPath):
+        paths.append(path)
+        if timestamp is not None:
+            time = first_time(path)
+            if time is not None and time <= timestamp:
+                break
+    for path in reversed(paths):
+        offset = 0
+        if timestamp is not None and not path.endswith(GZIP_SUFFIX):
+            tailer = LogTailer(path)
+            offset = tailer.seek_time(timestamp)
+            tailer.close()
+        for line in read_lines(path, offset):
+            yield line
+
+
+def find_inode(logPath, inode):
+    """Returns the uncompressed rotated file of a log which has a given
+    inode, None if there is none (e.g. already compressed)"""
+    for path in rotated_paths(logPath):
+        if not path.endswith(GZIP_SUFFIX) and os.stat(path).st_ino == inode:
+            return path
+    return None
@@ -1,11 +1,44 @@
 # The LogEntry object represents an entry in the log
 
 from datetime import datetime
+from datetime import timedelta
+from calendar import timegm
+from sys import intern, getsizeof
+import re
+
+# Pattern of a line of a w3c-formatted log, matches in order:
+# ip, time (without the zone), method, section (None if root), code, size
+LINE_PATTERN = re.compile(r'(\S+) \S+ \S+ \[([^\]\s]+)[^\]]*\] '
+                          r'"(\S+) [^/\s]*(?:/([^/\s]*)/)?\S* [^"]*" '
+                          r'(\S+) (\S+)')
+# Time strings already converted to timestamps
+timeCache = {}
+# Maximum number of time strings kept in the cache
+TIME_CACHE_SIZE = 10000
+# Origin of the timestamps
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_timestamp(time):
+    """Returns the number of seconds between EPOCH and a datetime
+    (microseconds are dropped, the zone is not taken into account)
+    :param time: datetime object to convert"""
+    return timegm(time.timetuple())
+
+
+def from_timestamp(timestamp):
+    """Returns the datetime object of a timestamp
+    :param timestamp: number of seconds since EPOCH"""
+    return EPOCH + timedelta(seconds=timestamp)
 
 
 class LogEntry:
     """Represents an entry in the log"""
 
+    # No per-instance __dict__ to keep the entries of the window small
+    __slots__ = ("ip", "timestamp", "method", "section", "code", "size",
+                 "parsed")
+
     def __init__(self, entryLine):
         """Constructor
         Parses string assuming it is a line of a w3c-formatted log
@@ -15,43 +48,65 @@ class LogEntry:
         :param entryLine: String representing a log entry to be parsed
         """
 
-        # If string is not well formatted, errors occur
-        try:
-            entryValues = entryLine.split(' ')
-            self.ip = entryValues[0]
-
-            # 3rd item is the time,
-            # we don't take the zone into account though (4th item)
-            timeString = entryValues[3].strip("[]")
-            self.time = datetime.strptime(timeString, "%d/%b/%Y:%H:%M:%S")
-
-            self.method = entryValues[5].strip("\"")
-
-            # Split path on / to get different sections:
-            # "/icons/blank.gif" will yield ['', 'icons', 'blank.gif']
-            sections = entryValues[6].split('/')
-            # If 3 items or more (2 slashes or more), take the second item
-            if len(sections) > 2:
-                self.section = sections[1]
-            else:    # else the path was root of the website (only one /)
-                self.section = "root"
-
-            self.code = entryValues[8]
-
-            sizeString = entryValues[9].strip("\n")
-            # if size is not provided, there is a dash instead
-            if sizeString == "-":
-                self.size = 0
-            else:
+        match = LINE_PATTERN.match(entryLine)
+        # If string is not well formatted, it does not match the pattern
+        if match is None:
+            self.not_parsed()
+            return
+        (self.ip, timeString, method, section,
+         code, sizeString) = match.groups()
+
+        # Lines of the same second share the same time string,
+        # so each string is only converted once
+        # (and the entries share the same timestamp object)
+        timestamp = timeCache.get(timeString)
+        if timestamp is None:
+            try:
+                time = datetime.strptime(timeString, "%d/%b/%Y:%H:%M:%S")
+            except ValueError:
+                self.not_parsed()
+                return
+            timestamp = to_timestamp(time)
+            if len(timeCache) >= TIME_CACHE_SIZE:
+                timeCache.clear()
+            timeCache[timeString] = timestamp
+        self.timestamp = timestamp
+
+        # Few different values: interned so that entries share them
+        self.method = intern(method)
+        self.code = intern(code)
+        # The section is what is between the first two / of the path:
+        # "/icons/blank.gif" will yield "icons"
+        # if there is only one / the path was root of the website
+        if section is None:
+            self.section = "root"
+        else:
+            self.section = intern(section)
+
+        # if size is not provided, there is a dash instead
+        if sizeString == "-":
+            self.size = 0
+        else:
+            try:
                 self.size = int(sizeString)
-            # no errors -> string was parsed correctly
-            self.parsed = True
-        except:
-            # errors -> string was not parsed
-            self.parsed = False
-            # Set the time to now so that it does not stop
-            # the LogHandlerreading process
-            self.time = datetime.now()
+            except ValueError:
+                self.not_parsed()
+                return
+        # no errors -> string was parsed correctly
+        self.parsed = True
+
+    def not_parsed(self):
+        """Marks the entry as not parsed"""
+        # errors -> string was not parsed
+        self.parsed = False
+        # Set the time to now so that it does not stop
+        # the LogHandler reading process
+        self.timestamp = to_timestamp(datetime.now())
+
+    @property
+    def time(self):
+        """datetime of the entry"""
+        return from_timestamp(self.timestamp)
 
     def __str__(self):
         """toString method, provides a readable String representation
@@ -62,4 +117,27 @@ class LogEntry:
     def __eq__(self, other):
         """Method to compare two LogEntry objects
         They are equal if all their attributes are the equal"""
-        return self.__dict__ == other.__dict__
+        return all(getattr(self, name, None) == getattr(other, name, None)
+                   for name in self.__slots__)
+
+
+def parse_many(lines):
+    """Generator on the LogEntry objects of several log lines
+    Unparsed lines are yielded too (their parsed attribute is False)
+    :param lines: iterable of strings representing log entries
+    """
+    for line in lines:
+        yield LogEntry(line)
+
+
+def entry_footprint(entry):
+    """Returns the number of bytes used by an entry kept in memory
+    Objects shared with other entries (interned strings, cached timestamps,
+    small integers) are not counted, the reference kept by the container is
+    :param entry: parsed LogEntry object"""
+    # Reference to the entry in the container + the entry itself
+    footprint = 8 + getsizeof(entry) + getsizeof(entry.ip)
+    # Integers from -5 to 256 are shared by the interpreter
+    if not -5 <= entry.size <= 256:
+        footprint += getsizeof(entry.size)
+    return footprint
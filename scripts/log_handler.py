@@ -1,16 +1,55 @@
 # The LogHandler object is a thread that handles
 # the processing and monitoring of the log
 
-from log_entry import LogEntry
-from collections import deque, Counter
-from time import sleep
+from log_entry import parse_many, to_timestamp, from_timestamp
+from log_tailer import LogTailer
+from sliding_window import SlidingWindow
+from rollups import Rollups, format_duration
+from log_watcher import LogWatcher
+from catch_up import catch_up, last_line_end
+from alert_history import Alert, AlertHistory
+from alert_engine import AlertEngine
+from alert_writer import AlertWriter, read_alerts
+from snapshot import Snapshot
+from metrics_server import MetricsServer, metrics_text
+from checkpoint import write_checkpoint, read_checkpoint
+from log_archive import rotated_lines, read_lines, find_inode, GZIP_SUFFIX
+from instrumentation import Instrumentation
+from agent import Agent
+from aggregator import AggregatorServer
+from time import sleep, monotonic, perf_counter
 from datetime import datetime
 from datetime import timedelta
 from threading import Thread
+from queue import Queue, Empty, Full
+from heapq import merge
+from itertools import chain
+from functools import partial
+from fnmatch import fnmatch
+from glob import glob
+import json
+import sys
 import os
 if os.name == "posix":
     import curses
 
+# Rows of the linux display: summary lines and alerts (see draw_row())
+SUMMARY_ROW = 9
+ALERTS_ROW = 22
+# Number of alerts kept in memory and displayed
+ALERT_HISTORY = 500
+# Maximum number of entries of a batch read from a log (see read_batches())
+BATCH_SIZE = 10000
+# Maximum number of batches waiting to be added to the window
+QUEUE_SIZE = 64
+# The first read of a log starts SEEK_MARGIN seconds before the time
+# frames so that lines slightly out of order are read (see read_batches())
+SEEK_MARGIN = 60
+# Entries of the state written by checkpoint()
+CHECKPOINT_KEYS = ("logPaths", "monitorDuration", "capacity", "buckets",
+                   "rollups", "offsets", "alerts", "alertCount",
+                   "alertStatus", "alertEngine", "keyAlerts", "entryCount")
+
 
 class LogHandler(Thread):
     """Handles the processing and monitoring of the log"""
@@ -19,145 +58,571 @@ class LogHandler(Thread):
                  logPath,
                  refreshPeriod,
                  alertThreshold,
-                 monitorDuration):
+                 monitorDuration,
+                 sketchCapacity=None):
         """Constructor
-        :param logPath: path of the log file
+        :param logPath: path of the log file, or several paths
+        and glob patterns (list or string separated by commas)
         :param refreshPeriod: Period to check on the log in seconds
         :param alertThreshold: Number of hits/minute to trigger alarm
         :param monitorDuration: Data is only kept during this time in seconds
+        :param sketchCapacity: if not None, clients and sections are
+        counted approximately with at most sketchCapacity keys per second
+        (bounded memory, see FrequentItems)
         """
 
         Thread.__init__(self)
         self.logPath = logPath
+        if isinstance(logPath, str):
+            logPath = logPath.split(",")
+        self.logPaths = [path.strip() for path in logPath if path.strip()]
+        # Wakes the monitoring loop up when a log changes (see run())
+        self.watcher = None
+        # curses window (see init_window())
+        self.stdscr = None
+        # Message printed when the console is restored (see stop())
+        self.stopMessage = None
+        # Follow each log file so that only new lines are read
+        # (by absolute path, see discover())
+        self.tailers = {}
+        self.discover()
         self.refreshPeriod = refreshPeriod
         self.alertThreshold = alertThreshold
         self.monitorDuration = monitorDuration
+        # Time given by the entries of the log when replaying it
+        # (None when monitoring in real time, see replay())
+        self.replayTime = None
         # initialize lastReadTime: current time - monitorDuration
         # (to only process this time frame)
         delta = timedelta(seconds=self.monitorDuration)
-        self.lastReadTime = datetime.now() - delta
-        # Attribute where we will store the log entries
-        # (list-like container with fast appends and pops on either end)
-        self.log = deque()
+        self.lastReadTime = self.now() - delta
+        # Statistics on the entries of the monitored time frame,
+        # aggregated by second
+        self.window = SlidingWindow(sketchCapacity)
+        # Hits by second and by minute, giving the hit rates over shorter
+        # and longer time frames (e.g. 10s and 1h, see rates())
+        self.rollups = Rollups()
         # Set it to False to stop the monitoring loop (call stop())
         self.running = True
-        self.hits = 0
-        self.size = 0
-        # Counter: dict subclass for counting hashable objects
-        self.sections = Counter()
-        self.ips = Counter()
-        self.methods = Counter()
-        self.codes = Counter()
         self.alertStatus = False
+        # The alert ends under alertThreshold*(1-alertHysteresis), crossings
+        # must last alertHoldTime seconds and the rate is averaged with a
+        # half-life of alertHalfLife seconds (0 to disable, see AlertEngine)
+        self.alertHysteresis = 0
+        self.alertHoldTime = 0
+        self.alertHalfLife = 0
+        # Created with the first hits (see engine())
+        self.alertEngine = None
+        # Alert rules on the hits of single sections, ips, codes...
+        # (KeyAlerts object, None to disable)
+        self.keyAlerts = None
         # Set it to False to stop displaying messages in the console
         self.printStatus = True
-        # Alerts messages will be stored in this string
-        self.alerts = "\n"
+        # Backlogs larger than catchUpSize bytes (e.g. at startup) are
+        # parsed by catchUpProcesses processes, set it to 1 to disable it
+        self.catchUpProcesses = os.cpu_count() or 1
+        self.catchUpSize = 64 << 20
+        # Most recent alerts (records, see AlertHistory)
+        self.alerts = AlertHistory(ALERT_HISTORY)
+        # File where alerts are stored to keep history (None to disable)
+        # as JSON Lines, rotated when larger than alertLogMaxBytes
+        self.alertLogPath = "alerts.log"
+        self.alertLogMaxBytes = 10 << 20
+        # Writes the alerts in the background (created with the first one)
+        self.alertWriter = None
+        # Batches of entries read by the reading thread and added to the
+        # window by the monitoring thread (see run())
+        self.queue = Queue(QUEUE_SIZE)
+        # Time in seconds the last batch waited in the queue
+        # and number of bytes of the logs not read yet
+        self.lag = 0
+        self.backlog = 0
+        # Number of entries added to the window since the beginning
+        self.entryCount = 0
+        # Files whose entries are in the window up to (inode, offset)
+        # by absolute path, and files partly added (see add_batch())
+        self.offsets = {}
+        self.partialReads = set()
+        # The state is written to checkpointPath every checkpointPeriod
+        # seconds and restored at startup (None to disable, see run())
+        self.checkpointPath = None
+        self.checkpointPeriod = 60
+        # Read the rotated files of the logs (logPath.1, logPath.2.gz...)
+        # when the time frames begin before their rotation and when
+        # replaying (see log_archive)
+        self.backfill = True
+        # (rotated path, offset) of the rest of the files rotated since
+        # the checkpoint by absolute path (see resume())
+        self.rotatedReads = {}
+        # Headless mode: (address, port) where the metrics are served
+        # in the Prometheus text format (None to disable, see run())
+        self.metricsAddress = None
+        self.metricsServer = None
+        # Agent mode: address of the aggregator the per-second aggregates
+        # of the entries read are sent to every agentPeriod seconds, under
+        # the name agentName (host name by default, see Agent)
+        self.agentAddress = None
+        self.agentName = None
+        self.agentPeriod = 1
+        self.agent = None
+        # Aggregator mode: address where the aggregates of the agents are
+        # received and added to the window (see AggregatorServer)
+        self.aggregatorAddress = None
+        self.aggregatorServer = None
+        # Wakes the display thread up when a key is pressed or a new
+        # snapshot is taken
+        self.presenterWatcher = None
+        # Hot-path metrics of the monitor itself, displayed instead of the
+        # statistics when showStats is True (key i) and written to
+        # statsPath on demand (key d, see dump_stats())
+        self.stats = Instrumentation()
+        self.showStats = False
+        self.statsPath = "monitor_stats.json"
+        # Profiler of the threads (Profiler object, None to disable)
+        self.profiler = None
+        # Statistics displayed (see update())
+        self.snapshot = Snapshot(self)
+
+    def now(self):
+        """Returns the current time,
+        the time of the last replayed entry when replaying a log"""
+        if self.replayTime is not None:
+            return self.replayTime
+        return datetime.now()
+
+    @property
+    def hits(self):
+        """Number of hits in the monitored time frame"""
+        return self.window.hits
+
+    @property
+    def size(self):
+        """Total size of the hits in the monitored time frame"""
+        return self.window.size
+
+    @property
+    def sections(self):
+        """Counter of the hits by section"""
+        return self.window.top_counts("sections")
+
+    @property
+    def ips(self):
+        """Counter of the hits by client ip"""
+        return self.window.top_counts("ips")
+
+    @property
+    def uniqueIps(self):
+        """Number of distinct client ips"""
+        return self.window.unique_ips()
+
+    @property
+    def methods(self):
+        """Counter of the hits by method"""
+        return self.window.methods
+
+    @property
+    def codes(self):
+        """Counter of the hits by status code"""
+        return self.window.codes
+
+    @property
+    def files(self):
+        """Counter of the hits by log file"""
+        return self.window.files
+
+    def discover(self):
+        """Starts following the log files matching the paths and patterns
+        that are not followed yet"""
+        for pattern in self.logPaths:
+            if is_pattern(pattern):
+                logPaths = sorted(glob(pattern))
+            else:
+                # Always followed, even if it does not exist yet
+                logPaths = [pattern]
+            for logPath in logPaths:
+                key = os.path.abspath(logPath)
+                if key not in self.tailers:
+                    self.tailers[key] = LogTailer(logPath)
+                    if self.watcher is not None:
+                        self.watcher.watch(logPath)
+
+    def is_followed(self, logPath):
+        """Returns True if a file is (or should be) followed
+        :param logPath: absolute path of the file"""
+        return logPath in self.tailers or any(
+            fnmatch(logPath, os.path.abspath(pattern))
+            for pattern in self.logPaths)
 
-    def add_entry(self, entry):
-        """Adds an LogEntry to the handler and updates stats"""
+    def add_entry(self, entry, logPath=None):
+        """Adds an LogEntry to the handler and updates stats
+        :param entry: LogEntry object
+        :param logPath: path of the log file of the entry
+        (first configured path by default)"""
         if entry.parsed:
-            self.log.append(entry)
-            self.hits += 1
-            self.size += entry.size
-            self.sections[entry.section] += 1
-            self.ips[entry.ip] += 1
-            self.methods[entry.method] += 1
-            self.codes[entry.code] += 1
-
-    def delete_entry(self):
-        """Deletes oldest entry of the handler and updates stats"""
-        entry = self.log.popleft()
-        self.hits -= 1
-        self.size -= entry.size
-
-        # When a Counter key has a value of 0 I prefer removing it
-        self.sections[entry.section] -= 1
-        if self.sections[entry.section] == 0:
-            del self.sections[entry.section]
-
-        self.ips[entry.ip] -= 1
-        if self.ips[entry.ip] == 0:
-            del self.ips[entry.ip]
-
-        self.methods[entry.method] -= 1
-        if self.methods[entry.method] == 0:
-            del self.methods[entry.method]
-
-        self.codes[entry.code] -= 1
-        if self.codes[entry.code] == 0:
-            del self.codes[entry.code]
-
-    def read(self):
-        """Reads the log file and adds entries
-        that happened during the monitored time frame"""
-        # Store lastReadTime value temporarily (attribute updated next line)
-        lastReadTime = self.lastReadTime
+            if logPath is None:
+                logPath = self.logPaths[0]
+            self.window.add(entry, logPath)
+            self.rollups.add(entry.timestamp, 1, entry.size)
+            self.engine().add(entry.timestamp)
+            if self.keyAlerts is not None:
+                self.keyAlerts.add(entry)
+            self.entryCount += 1
+
+    def read(self, logPaths=None):
+        """Reads the log files and adds entries
+        that happened during the monitored time frame
+        :param logPaths: absolute paths of the files to read
+        (all the followed files by default)"""
         # Update the lastReadTime before reading file
-        # so as not to miss any value next time
-        now = datetime.now()
-        # Remove microseconds
-        self.lastReadTime = datetime(now.year,
-                                     now.month,
-                                     now.day,
-                                     now.hour,
-                                     now.minute,
-                                     now.second)
+        self.lastReadTime = truncate(self.now())
+        for batch in self.read_batches(logPaths):
+            self.add_batch(batch)
+
+    def read_batches(self, logPaths=None):
+        """Generator on the entries appended to the log files
+        that happened during the monitored time frame
+        :param logPaths: absolute paths of the files to read
+        (all the followed files by default)
+        :return: (read time, path, entries, buckets, position) tuples
+        where entries is a list of at most BATCH_SIZE LogEntry objects,
+        buckets a list of Bucket objects of a backlog parsed in parallel
+        and position the (inode, offset) read in the file for its last
+        batch (None for the others)"""
+        # Entries older than the monitored time frame and than the time
+        # frames of the rates are ignored
+        limitTime = to_timestamp(truncate(self.now())) - max(
+            (self.monitorDuration,) + self.rollups.durations)
+        if logPaths is None:
+            logPaths = list(self.tailers)
+        for key in logPaths:
+            tailer = self.tailers.get(key)
+            if tailer is None:
+                continue
+            try:
+                # Rest of the file rotated since the checkpoint
+                rotated = self.rotatedReads.pop(key, None)
+                if rotated is not None:
+                    for batch in self.line_batches(
+                            tailer.logPath, read_lines(*rotated), limitTime):
+                        yield batch
+                # First read: the older lines are skipped without being
+                # parsed (binary search of the time in the file)
+                if tailer.logFile is None:
+                    tailer.seek_time(limitTime - SEEK_MARGIN)
+                    # The time frames begin before the rotation of the log
+                    if tailer.offset == 0 and self.backfill:
+                        for batch in self.line_batches(
+                                tailer.logPath,
+                                rotated_lines(tailer.logPath,
+                                              limitTime - SEEK_MARGIN),
+                                limitTime):
+                            yield batch
+                if self.catchUpProcesses > 1 \
+                        and tailer.backlog() > self.catchUpSize:
+                    yield (monotonic(), tailer.logPath, [],
+                           self.catch_up(tailer, limitTime), None)
+                # iterate over the lines appended since the last read
+                # (oldest first), the whole file is only read the first time
+                # each line is parsed once
+                # The tailer returns each line only once (byte offset), so
+                # entries of an already read second need no duplicate check
+                # and identical requests of the same second are all counted
+                entries = []
+                # Lines read and not parsed since start (time spent waiting
+                # for a batch to be queued is not counted)
+                lines = failures = 0
+                offset = tailer.offset
+                start = perf_counter()
+                for logEntry in parse_many(tailer.read_lines()):
+                    lines += 1
+                    if not logEntry.parsed:
+                        failures += 1
+                    if logEntry.timestamp >= limitTime:
+                        entries.append(logEntry)
+                        if len(entries) == BATCH_SIZE:
+                            self.stats.read(
+                                lines, max(tailer.offset - offset, 0),
+                                failures, perf_counter() - start)
+                            yield (monotonic(), tailer.logPath, entries, [],
+                                   None)
+                            entries = []
+                            lines = failures = 0
+                            offset = tailer.offset
+                            start = perf_counter()
+                self.stats.read(lines, max(tailer.offset - offset, 0),
+                                failures, perf_counter() - start)
+                # The last batch is queued even if it is empty: the file
+                # is in the window up to its position once it is added
+                yield (monotonic(), tailer.logPath, entries, [],
+                       (tailer.inode, tailer.offset))
+            except OSError:
+                if tailer.logPath in self.logPaths:
+                    self.stop("ERROR: LogHandler cannot read the log file")
+                    return
+                # File matched by a pattern removed in the meantime,
+                # followed again if it comes back (see discover())
+                del self.tailers[key]
+
+    def line_batches(self, logPath, lines, limitTime):
+        """Generator on the batches of the entries of the lines of rotated
+        files (see read_batches()), the rest of a file which cannot be read
+        or decompressed is ignored
+        :param logPath: path of the log the files were rotated from
+        :param lines: iterable of lines (see log_archive)
+        :param limitTime: entries older than this timestamp are ignored"""
+        entries = []
         try:
-            with open(self.logPath, "r") as logFile:
-                lines = logFile.readlines()
-
-            # iterate over lines in reversed order (most recent first)
-            # of entries in the monitored time frame
-            i = 1
-            while i <= len(lines) and LogEntry(lines[-i]).time >= lastReadTime:
-                logEntry = LogEntry(lines[-i])
-                if logEntry.time > lastReadTime:
-                    self.add_entry(logEntry)
-
-                # Entries dated at the same second might have been added
-                elif logEntry.time == lastReadTime:
-                    if logEntry not in self.log:
-                        self.add_entry(logEntry)
-                i += 1
-        except:
-            self.stop("ERROR: LogHandler cannot read the log file")
+            for logEntry in parse_many(lines):
+                if logEntry.timestamp >= limitTime:
+                    entries.append(logEntry)
+                    if len(entries) == BATCH_SIZE:
+                        yield monotonic(), logPath, entries, [], None
+                        entries = []
+        except (OSError, EOFError):
+            pass
+        if len(entries) != 0:
+            yield monotonic(), logPath, entries, [], None
+
+    def add_batch(self, batch):
+        """Adds a batch of entries read by read_batches() (or buckets
+        received from the agents, without path) to the window
+        :param batch: (read time, path, entries, buckets, position) tuple
+        """
+        readTime, logPath, entries, buckets, position = batch
+        if self.agent is not None:
+            for bucket in buckets:
+                self.agent.add_bucket(bucket)
+            self.agent.add_entries(entries, logPath)
+        # Older entries are only counted in the rates of the longer
+        # time frames
+        limitTime = to_timestamp(self.lastReadTime) - self.monitorDuration
+        for bucket in buckets:
+            if bucket.timestamp >= limitTime:
+                self.window.add_bucket(bucket)
+                self.entryCount += bucket.hits
+                self.engine().add(bucket.timestamp, bucket.hits)
+                if self.keyAlerts is not None:
+                    self.keyAlerts.add_bucket(bucket)
+            self.rollups.add(bucket.timestamp, bucket.hits, bucket.size)
+        for logEntry in entries:
+            if logEntry.timestamp >= limitTime:
+                self.add_entry(logEntry, logPath)
+            else:
+                self.rollups.add(logEntry.timestamp, 1, logEntry.size)
+        # Crossings are found as soon as the entries are added
+        self.check_alerts()
+        self.key_alerts()
+        self.lag = monotonic() - readTime
+        # Buckets received from the agents are not read from a file
+        if logPath is None:
+            return
+        key = os.path.abspath(logPath)
+        if position is None:
+            self.partialReads.add(key)
+        else:
+            self.partialReads.discard(key)
+            self.offsets[key] = position
+
+    def catch_up(self, tailer, limitTime):
+        """Parses the backlog of a log file with a pool of processes
+        :param tailer: LogTailer object of the log file
+        :param limitTime: entries older than this timestamp are ignored
+        :return: list of Bucket objects"""
+        # The processes open the file by its path: it must be the same file
+        if os.stat(tailer.logPath).st_ino != tailer.inode:
+            return []
+        # The last line might not be complete yet
+        end = last_line_end(tailer.logFile, tailer.offset,
+                            tailer.offset + tailer.backlog())
+        buckets = catch_up(tailer.logPath, tailer.offset, end, limitTime,
+                           self.catchUpProcesses, self.window.capacity)
+        tailer.seek(end)
+        return buckets
 
     def drop_old_entries(self):
         """Remove entries older than the monitored duration"""
-        # while first element (assuming it's the oldest) of log is too old,
-        # remove it
-        duration = timedelta(seconds=self.monitorDuration)
-        limitTime = (self.lastReadTime - duration)
-        while len(self.log) != 0 and self.log[0].time < limitTime:
-            self.delete_entry()
-
-    def alert(self):
-        """Triggers an alert when hits are too high"""
-        alert = ("[%s] HIGH TRAFFIC generated an alert - hits/min = %d\n"
-                 % (datetime.now().strftime("%d/%b/%Y:%H:%M:%S"),
-                    self.hits/self.monitorDuration*60))
-        # Add the alert message before all the other messages
-        self.alerts = alert + self.alerts
-        # Store this alert in a file to keep history
-        try:
-            with open("alerts.log", "a") as alertLog:
-                alertLog.write(alert)
-        except:
-            print("Cannot write alerts to alerts.log")
+        start = perf_counter()
+        # Whole seconds are removed at once
+        limitTime = to_timestamp(self.lastReadTime) - self.monitorDuration
+        self.window.drop_before(limitTime)
+        self.rollups.advance(to_timestamp(self.lastReadTime))
+        if self.keyAlerts is not None:
+            self.keyAlerts.drop_before(limitTime)
+        self.stats.time("evict", perf_counter() - start)
+
+    def rates(self):
+        """Returns the hit rates over the time frames of the rollups
+        :return: tuple of (duration in seconds, hits/min) tuples"""
+        return tuple((duration, hits/duration*60) for duration, hits, size
+                     in self.rollups.counts(to_timestamp(self.lastReadTime)))
+
+    def checkpoint(self):
+        """Writes the state of the monitor to checkpointPath, unless a file
+        is partly added to the window (its offset would not match it)
+        :return: True if the checkpoint was written"""
+        if len(self.partialReads) != 0:
+            return False
+        write_checkpoint(self.checkpointPath, {
+            "logPaths": self.checkpoint_paths(),
+            "monitorDuration": self.monitorDuration,
+            "capacity": self.window.capacity,
+            "buckets": list(self.window.buckets.values()),
+            "rollups": self.rollups,
+            "offsets": self.offsets,
+            "alerts": list(self.alerts.records),
+            "alertCount": self.alerts.count,
+            "alertStatus": self.alertStatus,
+            "alertEngine": self.alertEngine,
+            "keyAlerts": self.keyAlerts,
+            "entryCount": self.entryCount})
+        return True
+
+    def checkpoint_paths(self):
+        """Returns the absolute paths and patterns of the monitored logs
+        (a checkpoint is only restored for the same logs)"""
+        return sorted(os.path.abspath(path) for path in self.logPaths)
+
+    def resume(self):
+        """Restores the state written by checkpoint(): the logs are then
+        read from the offsets of the checkpoint (from their beginning if
+        they were rotated since), nothing is restored if there is no
+        valid checkpoint or if it was written for other logs or with other
+        parameters
+        :return: True if the state was restored"""
+        state = read_checkpoint(self.checkpointPath, CHECKPOINT_KEYS)
+        if state is None or state["logPaths"] != self.checkpoint_paths() \
+                or state["monitorDuration"] != self.monitorDuration \
+                or state["capacity"] != self.window.capacity:
+            return False
+        # Expired buckets are dropped at the next update
+        buckets = sorted(state["buckets"], key=lambda bucket: bucket.timestamp)
+        for bucket in buckets:
+            self.window.add_bucket(bucket)
+        if state["rollups"].durations == self.rollups.durations:
+            self.rollups = state["rollups"]
+        # The engine created with other settings starts in this status
+        self.alertStatus = state["alertStatus"]
+        engine = state["alertEngine"]
+        if engine is not None and engine.same_settings(self.engine()):
+            self.alertEngine = engine
+        else:
+            # Hits of the restored time frame, its crossings were handled
+            # before the checkpoint
+            engine = self.engine()
+            for bucket in buckets:
+                engine.add(bucket.timestamp, bucket.hits)
+            engine.pop()
+            engine.status = self.alertStatus
+            engine.crossing = None
+        # Keys in alert and their counts, if the rules did not change
+        # (the keys over the thresholds of new rules are alerted)
+        keyAlerts = state["keyAlerts"]
+        if self.keyAlerts is not None:
+            if keyAlerts is not None \
+                    and [rule.text() for rule in keyAlerts.rules] \
+                    == [rule.text() for rule in self.keyAlerts.rules]:
+                self.keyAlerts = keyAlerts
+            else:
+                for bucket in buckets:
+                    self.keyAlerts.add_bucket(bucket)
+        # Alerts were already written to the alert log
+        for alert in state["alerts"]:
+            self.alerts.add(alert)
+        self.alerts.count = state["alertCount"]
+        self.entryCount = state["entryCount"]
+        for key, (inode, offset) in state["offsets"].items():
+            tailer = self.tailers.get(key)
+            if tailer is None:
+                continue
+            try:
+                tailer.open()
+                if tailer.inode == inode and offset <= tailer.backlog():
+                    tailer.seek(offset)
+                    self.offsets[key] = (inode, offset)
+                else:
+                    # Rotated since the checkpoint: the new file is read
+                    # from its beginning and the rest of the previous one
+                    # from its rotated copy (lost if already compressed)
+                    rotatedPath = find_inode(tailer.logPath, inode)
+                    if rotatedPath is not None:
+                        self.rotatedReads[key] = (rotatedPath, offset)
+            except OSError:
+                continue
+        return True
+
+    def engine(self):
+        """Returns the AlertEngine deciding when the alert starts and ends
+        (created with the current parameters at the first call)"""
+        if self.alertEngine is None:
+            self.alertEngine = AlertEngine(
+                self.alertThreshold, self.monitorDuration,
+                self.alertHysteresis, self.alertHoldTime, self.alertHalfLife)
+            self.alertEngine.status = self.alertStatus
+        return self.alertEngine
+
+    def check_alerts(self):
+        """Triggers or ends the alert for the crossings of the threshold
+        found by the alert engine since the last call"""
+        for second, high, rate in self.engine().pop():
+            if high:
+                self.alert(from_timestamp(second), rate)
+            else:
+                self.end_alert(from_timestamp(second), rate)
+
+    def alert(self, time=None, rate=None):
+        """Triggers an alert when hits are too high
+        :param time: datetime of the crossing (now by default)
+        :param rate: hits/min which crossed the threshold
+        (rate of the monitored time frame by default)"""
+        if time is None:
+            time = self.now()
+        if rate is None:
+            rate = self.hits/self.monitorDuration*60
+        self.add_alert(Alert(time, True, rate, self.alertThreshold,
+                             self.monitorDuration, self.rates()))
         self.alertStatus = True
 
-    def end_alert(self):
-        """Ends the alert when traffic recovered"""
-        alert = ("[%s] Traffic slowed down, the alert has recovered\n"
-                 % (datetime.now().strftime("%d/%b/%Y:%H:%M:%S")))
-        self.alerts = alert + self.alerts
-        with open("alerts.log", "a") as alertLog:
-            alertLog.write(alert)
+    def end_alert(self, time=None, rate=None):
+        """Ends the alert when traffic recovered
+        :param time: datetime of the crossing (now by default)
+        :param rate: hits/min which crossed the threshold
+        (rate of the monitored time frame by default)"""
+        if time is None:
+            time = self.now()
+        if rate is None:
+            rate = self.hits/self.monitorDuration*60
+        self.add_alert(Alert(time, False, rate, self.alertThreshold,
+                             self.monitorDuration))
         self.alertStatus = False
 
+    def key_alerts(self):
+        """Adds the alerts of the keys which crossed the threshold of
+        their rule since the last call"""
+        if self.keyAlerts is None:
+            return
+        self.keyAlerts.check_shares()
+        for second, rule, key, high, value in self.keyAlerts.pop():
+            self.add_alert(Alert(from_timestamp(second), high, value,
+                                 rule.threshold, self.monitorDuration,
+                                 subject=rule.subject(key), share=rule.share))
+
+    def add_alert(self, alert):
+        """Adds an alert to the history
+        :param alert: Alert object"""
+        self.alerts.add(alert)
+        if self.replayTime is not None and self.printStatus:
+            print(alert.message())
+        # Store this alert in a file to keep history
+        if self.alertLogPath is not None:
+            if self.alertWriter is None:
+                self.alertWriter = AlertWriter(
+                    self.alertLogPath, maxBytes=self.alertLogMaxBytes)
+                self.alertWriter.start()
+            self.alertWriter.write(alert)
+
     def display_message(self):
         """wrapper for displaying a message"""
+        start = perf_counter()
         # Different display methods depending on OS
         if os.name == "nt":
             self.display_message_windows()
@@ -165,6 +630,7 @@ class LogHandler(Thread):
             self.display_message_linux()
         else:
             self.stop("OS not supported")
+        self.stats.time("render", perf_counter() - start)
 
     def display_message_windows(self):
         """Creates and displays all informations in the console"""
@@ -175,87 +641,196 @@ class LogHandler(Thread):
         msg += "Refresh period = %ds   " % self.refreshPeriod
         msg += "Monitor duration = %ds\n\n\n" % self.monitorDuration
         msg += "Summary:\n"
-        msg += "Average hits/min: %d" % (self.hits/self.monitorDuration*60)
-        if self.alertStatus:
-            msg += (" > %d         **********ALERT**********\n"
-                    % self.alertThreshold)
-        else:
-            msg += "                    Everything OK\n"
-        if self.hits != 0:
-            avgData = self.size/1000/self.hits
-        else:
-            avgData = 0
-        msg += "\nAverage client data: %d Kb/hit" % avgData
-        msg += "\nSections     -> " + self.summary(self.sections)
-        msg += "\nClients      -> " + self.summary(self.ips)
-        msg += "\nStatus codes -> " + self.summary(self.codes)
-        msg += "\nMethods      -> " + self.summary(self.methods)
+        msg += self.summary_message()
         msg += "\n\n\n"
         msg += "Alerts (Stored in real time in alerts.log):\n"
-        msg += self.alerts
+        msg += "".join(alert.message() + "\n"
+                       for alert in self.snapshot.alerts)
         # Clear the console of the previous message
         # so that it appears to be refreshed
         os.system("cls")
         print(msg)
 
+    def summary_message(self):
+        """Returns the summary of the monitored time frame
+        (of the last snapshot)"""
+        msg = "Average hits/min: %d" % self.snapshot.hitRate
+        if self.snapshot.alertStatus:
+            msg += (" > %d         **********ALERT**********\n"
+                    % self.alertThreshold)
+        else:
+            msg += "                    Everything OK\n"
+        for line in self.statistics_lines():
+            if line:
+                msg += "\n" + line
+        return msg
+
+    def statistics_lines(self):
+        """Returns the lines of statistics of the summary of the last
+        snapshot (the files line is empty when a single file is followed,
+        the ingestion line when replaying a log), or the lines of the
+        metrics of the monitor itself when showStats is True"""
+        snapshot = self.snapshot
+        if self.showStats:
+            return self.stats_lines()
+        hits = snapshot.hits
+        if hits != 0:
+            avgData = snapshot.size/1000/hits
+        else:
+            avgData = 0
+        lines = ["Average client data: %d Kb/hit" % avgData,
+                 "Unique clients: %d   Size p50/p95/p99: %d/%d/%d bytes"
+                 % ((snapshot.uniqueIps,) + snapshot.percentiles),
+                 "Sections     -> " + self.summary(snapshot.sections, hits),
+                 "Clients      -> " + self.summary(snapshot.ips, hits),
+                 "Status codes -> " + self.summary(snapshot.codes, hits),
+                 "Methods      -> " + self.summary(snapshot.methods, hits),
+                 "Hits/min     -> " + "   ".join(
+                     "%s: %d" % (format_duration(duration), rate)
+                     for duration, rate in snapshot.rates),
+                 "", ""]
+        if snapshot.fileCount > 1:
+            lines[-2] = "Files        -> " + self.summary(snapshot.files, hits)
+        if self.replayTime is None:
+            lines[-1] = ("Ingestion    -> queue: %d batches   lag: %.3fs   "
+                         "unread: %d Kb" % (snapshot.queueDepth, snapshot.lag,
+                                            snapshot.backlog/1000))
+        return lines
+
+    def stats_lines(self):
+        """Returns the lines of the metrics of the monitor itself
+        of the last snapshot (as many as statistics_lines())"""
+        snapshot = self.snapshot
+        stats = snapshot.stats
+        timings = ["%s: %.3f/%.3fms" % (name, stats[name]["last_ms"],
+                                        stats[name]["max_ms"])
+                   for name in ("evict", "update", "render")]
+        return ["Self-monitoring (key i: back to the statistics, "
+                "key d: write them to %s)" % self.statsPath,
+                "Read         -> %d lines/tick   %d Kb/tick   %d lines "
+                "since start" % (stats["tick_lines"], stats["tick_bytes"]/1000,
+                                 stats["lines"]),
+                "Parsing      -> %.2fus/line (mean)   %.2fus/line (last)"
+                % (stats["parse"]["mean_ms"]*1000,
+                   stats["parse"]["last_ms"]*1000),
+                "Failures     -> %d lines not parsed"
+                % stats["parse_failures"],
+                "Last/max     -> " + "   ".join(timings),
+                "Ingestion    -> queue: %d batches   lag: %.3fs   "
+                "unread: %d Kb" % (snapshot.queueDepth, snapshot.lag,
+                                   snapshot.backlog/1000),
+                "Window       -> %d entries added since start"
+                % snapshot.entryCount,
+                "", ""]
+
+    def dump_stats(self, *args):
+        """Writes the metrics of the monitor itself to statsPath as JSON
+        (can be used as a signal handler)"""
+        stats = dict(self.stats.to_dict(), queue_depth=self.queue.qsize(),
+                     lag_seconds=self.lag, unread_bytes=self.backlog,
+                     entries=self.entryCount)
+        try:
+            with open(self.statsPath, "w") as statsFile:
+                json.dump(stats, statsFile, indent=2, sort_keys=True)
+        except OSError:
+            print("Cannot write the metrics to %s" % self.statsPath)
+
     def display_message_linux(self):
-        """Creates and displays all informations in the console
-        using curses package"""
+        """Updates the rows of the display that changed and displays it
+        using curses package (see init_window() for the static rows)"""
+        if self.pad is None:
+            return
+        snapshot = self.snapshot
         try:
             size = self.stdscr.getmaxyx()
-
-            # Display message
-            self.pad = curses.newpad(self.alerts.count("\n")+20, 200)
-            msg = "************************\nWelcome to HTTP Monitor\
-\n************************\n\n"
-            self.pad.addstr(0, 0, msg, curses.A_BOLD)
-
-            msg = "Parameters:\n"
-            msg += "Alert threshold = %d hits/min   " % self.alertThreshold
-            msg += "Refresh period = %ds   " % self.refreshPeriod
-            msg += "Monitor duration = %ds\n\n\n" % self.monitorDuration
-            curses.init_pair(1, curses.COLOR_BLUE, -1)
-            self.pad.addstr(msg, curses.color_pair(1))
-
-            self.pad.addstr("Summary:\n", curses.A_BOLD)
-            self.pad.addstr("Average hits/min: ")
-            self.pad.addstr(str(int(self.hits/self.monitorDuration*60)),
-                            curses.A_BOLD)
-            if self.alertStatus:
-                self.pad.addstr((" > %d         " % self.alertThreshold))
-                curses.init_pair(2, -1, curses.COLOR_RED)
-                self.pad.addstr("**********ALERT**********\n",
-                                curses.color_pair(2))
-            else:
-                self.pad.addstr("                    ")
-                curses.init_pair(3, curses.COLOR_GREEN, -1)
-                self.pad.addstr("Everything OK\n", curses.color_pair(3))
-
-            if self.hits != 0:
-                avgData = self.size/1000/self.hits
-            else:
-                avgData = 0
-            msg = "\nAverage client data: %d Kb/hit" % avgData
-            msg += "\nSections     -> " + self.summary(self.sections)
-            msg += "\nClients      -> " + self.summary(self.ips)
-            msg += "\nStatus codes -> " + self.summary(self.codes)
-            msg += "\nMethods      -> " + self.summary(self.methods)
-            msg += "\n\n\n"
-            curses.init_pair(4, curses.COLOR_YELLOW, -1)
-            self.pad.addstr(msg, curses.color_pair(4))
-
-            self.pad.addstr("Alerts (Stored in real time in alerts.log):\n",
-                            curses.A_BOLD)
-            self.pad.addstr(self.alerts)
+            # Status line
+            hitRate = int(snapshot.hitRate)
+            alertStatus = snapshot.alertStatus
+            if self.draw_row(SUMMARY_ROW, (hitRate, alertStatus)):
+                self.pad.addstr("Average hits/min: ")
+                self.pad.addstr(str(hitRate), curses.A_BOLD)
+                if alertStatus:
+                    self.pad.addstr(" > %d         " % self.alertThreshold)
+                    self.pad.addstr("**********ALERT**********",
+                                    curses.color_pair(2))
+                else:
+                    self.pad.addstr("                    ")
+                    self.pad.addstr("Everything OK", curses.color_pair(3))
+            for row, line in enumerate(self.statistics_lines()):
+                if self.draw_row(SUMMARY_ROW + 2 + row, line):
+                    self.pad.addstr(line, curses.color_pair(4))
+            if self.draw_row(ALERTS_ROW - 1, self.alertPage):
+                self.draw_alerts(snapshot)
+            elif self.alertPage == 0:
+                # New alerts are inserted at the top of the alerts, the
+                # older ones are pushed down and the last row is dropped
+                newAlerts = min(snapshot.alertCount - self.drawnAlerts,
+                                len(snapshot.alerts))
+                for alert in reversed(snapshot.alerts[:newAlerts]):
+                    self.pad.move(ALERTS_ROW, 0)
+                    self.pad.insertln()
+                    self.pad.addstr(alert.message())
+                self.alertRows = len(snapshot.alerts)
+                self.drawnAlerts = snapshot.alertCount
             self.pad.refresh(self.padPos, 0, 0, 0, size[0]-1, size[1]-1)
         except curses.error:
             self.stop("ERROR with curses operations")
 
+    def draw_alerts(self, snapshot):
+        """Draws the title and all the rows of the alerts: the most recent
+        ones (page 0) or older ones read from the alert log
+        :param snapshot: Snapshot object being displayed"""
+        if self.alertPage == 0:
+            if self.alertLogPath is None:
+                self.pad.addstr("Alerts:", curses.A_BOLD)
+            else:
+                self.pad.addstr("Alerts (Stored in real time in %s):"
+                                % self.alertLogPath, curses.A_BOLD)
+            alerts = snapshot.alerts
+        else:
+            self.pad.addstr("Alerts from %s (page %d, PageUp/PageDown):"
+                            % (self.alertLogPath, self.alertPage),
+                            curses.A_BOLD)
+            if self.alertWriter is not None:
+                self.alertWriter.flush()
+            alerts = read_alerts(self.alertLogPath,
+                                 self.alertPage * ALERT_HISTORY,
+                                 ALERT_HISTORY)
+        self.pad.move(ALERTS_ROW, 0)
+        self.pad.clrtobot()
+        for row, alert in enumerate(alerts):
+            self.pad.addstr(ALERTS_ROW + row, 0, alert.message())
+        self.alertRows = len(alerts)
+        self.drawnAlerts = snapshot.alertCount
+
+    def draw_row(self, row, content):
+        """Clears a row of the pad if its content changed since
+        it was drawn, the caller then draws it (cursor at its beginning)
+        :param row: row of the pad
+        :param content: object describing the content of the row
+        :return: True if the row must be drawn"""
+        if self.drawnRows.get(row) == content:
+            return False
+        self.drawnRows[row] = content
+        self.pad.move(row, 0)
+        self.pad.clrtoeol()
+        return True
+
     def init_window(self):
         """Initialize linux display window"""
         if os.name == "posix":
             # Postition of cursor
             self.padPos = 0
+            # Pad where the display is drawn, created once:
+            # static rows are drawn here and the others when they change
+            self.pad = None
+            # Content of the drawn rows and number of drawn alerts
+            self.drawnRows = {}
+            self.drawnAlerts = 0
+            self.alertRows = 0
+            # Page of alerts displayed, older pages are read from the
+            # alert log on demand (see draw_alerts())
+            self.alertPage = 0
             try:
                 if self.printStatus:
                     # Configure curses window
@@ -267,17 +842,32 @@ class LogHandler(Thread):
                     self.stdscr.nodelay(1)
                     self.stdscr.keypad(1)
                     self.stdscr.leaveok(1)
-                    self.stdscr.addstr("************************\nWelcome to HTTP Monitor\
-    \n************************\n\n")
+                    curses.init_pair(1, curses.COLOR_BLUE, -1)
+                    curses.init_pair(2, -1, curses.COLOR_RED)
+                    curses.init_pair(3, curses.COLOR_GREEN, -1)
+                    curses.init_pair(4, curses.COLOR_YELLOW, -1)
+                    self.pad = curses.newpad(ALERTS_ROW + ALERT_HISTORY, 200)
+                    msg = "************************\nWelcome to HTTP Monitor\
+\n************************\n\n"
+                    self.pad.addstr(0, 0, msg, curses.A_BOLD)
+                    msg = "Parameters:\n"
+                    msg += ("Alert threshold = %d hits/min   "
+                            % self.alertThreshold)
+                    msg += "Refresh period = %ds   " % self.refreshPeriod
+                    msg += "Monitor duration = %ds" % self.monitorDuration
+                    self.pad.addstr(msg, curses.color_pair(1))
+                    self.pad.addstr(SUMMARY_ROW - 1, 0, "Summary:",
+                                    curses.A_BOLD)
             except curses.error:
                 self.stop("ERROR with curses operations")
 
-    def summary(self, items):
-        """Returns a String summary of a particular Counter object
-        :param items: Counter object to be summarized"""
+    def summary(self, items, hits):
+        """Returns a String summary of the most frequent items of a Counter
+        :param items: list of (item, hits) tuples of a Snapshot object
+        :param hits: total number of hits of the snapshot"""
         summary = ""
-        for item in items.most_common(3):
-            summary += str(item[0])+" (%d%%)   " % (item[1]/self.hits*100)
+        for item in items:
+            summary += str(item[0])+" (%d%%)   " % (item[1]/hits*100)
         return summary
 
     def get_key_stroke(self):
@@ -290,48 +880,316 @@ class LogHandler(Thread):
             # Scroll self.pad
             elif c == curses.KEY_DOWN:
                 # Allow scrolling down only when message is larger than window
-                maxV = 19 + self.alerts.count("\n") - self.stdscr.getmaxyx()[0]
-                self.padPos = min(self.padPos + 1, maxV)
+                maxV = ALERTS_ROW + self.alertRows - self.stdscr.getmaxyx()[0]
+                self.padPos = max(min(self.padPos + 1, maxV), 0)
             elif c == curses.KEY_UP:
                 self.padPos = max(self.padPos - 1, 0)
+            # Page older alerts from the alert log
+            elif c == curses.KEY_NPAGE and self.alertLogPath is not None \
+                    and self.alertRows == ALERT_HISTORY:
+                self.alertPage += 1
+                self.padPos = 0
+            elif c == curses.KEY_PPAGE and self.alertPage > 0:
+                self.alertPage -= 1
+                self.padPos = 0
+            # Metrics of the monitor itself
+            elif c == ord('i'):
+                self.showStats = not self.showStats
+            elif c == ord('d'):
+                self.dump_stats()
+
+    def update(self):
+        """Removes old entries, updates the alert status and the display"""
+        start = perf_counter()
+        self.drop_old_entries()
+        # The seconds without hits are evaluated too (e.g. when the
+        # traffic stops, the alert ends)
+        self.engine().advance(to_timestamp(self.lastReadTime))
+        self.check_alerts()
+        self.key_alerts()
+        self.stats.tick()
+        self.stats.time("update", perf_counter() - start)
+        # Statistics displayed until the next refresh
+        self.snapshot = Snapshot(self, self.metricsServer is not None)
+        if self.metricsServer is not None:
+            self.metricsServer.publish(metrics_text(self.snapshot, self))
+        # Check if the console output is enabled
+        if self.printStatus:
+            if self.replayTime is not None:
+                print("[%s] %s\n" % (self.replayTime.strftime(
+                    "%d/%b/%Y:%H:%M:%S"), self.summary_message()))
+            elif self.presenterWatcher is not None:
+                self.presenterWatcher.wake()
+
+    def replay(self, start=None):
+        """Reads the whole log as fast as possible, using the time of the
+        entries as the clock: the log is refreshed every refreshPeriod
+        of log time, as it would have been when monitoring it
+        :param start: if not None, datetime from which the log is replayed
+        (the older lines are skipped by a binary search in the files)
+        :return: number of lines read, duration of the replay in seconds"""
+        startTime = monotonic()
+        self.lineCount = 0
+        if start is not None:
+            start = to_timestamp(start)
+        # Entries of all the files ordered by time
+        streams = [self.replay_stream(index, tailer, start)
+                   for index, tailer in enumerate(self.tailers.values())]
+        nextRefresh = None
+        try:
+            if start is not None:
+                for tailer in self.tailers.values():
+                    if not tailer.logPath.endswith(GZIP_SUFFIX):
+                        tailer.seek_time(start)
+            for timestamp, index, line, logEntry, logPath in merge(*streams):
+                if nextRefresh is None:
+                    nextRefresh = timestamp
+                # Refreshes that happened before this entry was written
+                while timestamp > nextRefresh:
+                    self.replay_refresh(nextRefresh)
+                    nextRefresh += self.refreshPeriod
+                self.add_entry(logEntry, logPath)
+        except (OSError, EOFError):
+            self.stop("ERROR: LogHandler cannot read the log file")
+        if nextRefresh is not None:
+            self.replay_refresh(nextRefresh)
+        self.close()
+        return self.lineCount, monotonic() - startTime
+
+    def replay_stream(self, index, tailer, start=None):
+        """Generator on the parsed entries of a replayed log file
+        (after the ones of its rotated files, compressed or not)
+        as (timestamp, file index, line number, entry, path) tuples
+        (sortable by time)
+        :param index: index of the file
+        :param tailer: LogTailer object of the file
+        :param start: if not None, older entries are skipped"""
+        if tailer.logPath.endswith(GZIP_SUFFIX):
+            lines = read_lines(tailer.logPath)
+        else:
+            lines = tailer.read_lines()
+        if self.backfill:
+            lines = chain(rotated_lines(tailer.logPath, start), lines)
+        for line, logEntry in enumerate(parse_many(lines)):
+            self.lineCount += 1
+            if logEntry.parsed and (start is None
+                                    or logEntry.timestamp >= start):
+                yield (logEntry.timestamp, index, line, logEntry,
+                       tailer.logPath)
+
+    def replay_refresh(self, timestamp):
+        """Refreshes the replayed log at a given time of the log
+        :param timestamp: time of the refresh"""
+        self.replayTime = from_timestamp(timestamp)
+        self.lastReadTime = self.replayTime
+        self.update()
 
     def run(self):
-        """Method called when thread is started, main monitoring loop"""
-        self.init_window()
+        """Method called when thread is started, the threads are profiled
+        when profiler is set (see monitor())"""
+        if self.profiler is None:
+            self.monitor()
+        else:
+            self.profiler.run(self.monitor)
+            self.profiler.dump()
+
+    def profiled(self, function):
+        """Returns a function run under the profiler if there is one
+        (e.g. the target of a thread)"""
+        if self.profiler is None:
+            return function
+        return partial(self.profiler.run, function)
+
+    def monitor(self):
+        """Main monitoring loop
+        Entries are read by a reading thread (see ingest()) and added to
+        the window as soon as they are read, the window is updated every
+        refreshPeriod and displayed by a display thread (see present())"""
+        self.watcher = LogWatcher()
+        for tailer in self.tailers.values():
+            self.watcher.watch(tailer.logPath)
+        # New files of the directories of the patterns
+        for pattern in self.logPaths:
+            directory = os.path.dirname(os.path.abspath(pattern))
+            if not is_pattern(directory):
+                self.watcher.watch_directory(directory)
+        self.presenterWatcher = LogWatcher()
+        if self.metricsAddress is not None:
+            try:
+                self.metricsServer = MetricsServer(*self.metricsAddress)
+                self.metricsServer.start()
+            except OSError:
+                self.stop("ERROR: cannot serve the metrics on %s:%d"
+                          % self.metricsAddress)
+        if self.aggregatorAddress is not None:
+            try:
+                self.aggregatorServer = AggregatorServer(
+                    self.aggregatorAddress, self.receive,
+                    self.window.capacity)
+                self.aggregatorServer.start()
+            except OSError:
+                self.stop("ERROR: cannot receive the agents on %s"
+                          % (self.aggregatorAddress,))
+        if self.agentAddress is not None:
+            self.agent = Agent(self.agentAddress, self.agentName,
+                               self.window.capacity, self.agentPeriod)
+            self.agent.start()
+        # The first snapshot includes the entries already in the logs
+        # (only those written since the checkpoint if there is one)
+        if self.checkpointPath is not None:
+            self.resume()
+        self.read()
+        threads = [Thread(target=self.profiled(self.ingest)),
+                   Thread(target=self.profiled(self.present))]
+        for thread in threads:
+            thread.start()
+        nextRefresh = monotonic()
+        nextCheckpoint = monotonic() + self.checkpointPeriod
         # Loop stops when stop() is called
         while self.running:
+            # refresh only every refreshPeriod
+            timeout = nextRefresh - monotonic()
+            if timeout <= 0:
+                self.lastReadTime = truncate(self.now())
+                self.update()
+                nextRefresh = monotonic() + self.refreshPeriod
+                # Retried at the next refresh if it cannot be written
+                if self.checkpointPath is not None \
+                        and monotonic() >= nextCheckpoint \
+                        and self.checkpoint():
+                    nextCheckpoint = monotonic() + self.checkpointPeriod
+                continue
+            try:
+                batch = self.queue.get(timeout=timeout)
+            except Empty:
+                continue
+            # None is queued by stop()
+            if batch is not None:
+                self.add_batch(batch)
+        for thread in threads:
+            thread.join()
+        # Batches still queued are read again after a restart
+        if self.checkpointPath is not None:
+            self.checkpoint()
+        self.watcher.close()
+        self.presenterWatcher.close()
+        if self.metricsServer is not None:
+            self.metricsServer.close()
+        if self.aggregatorServer is not None:
+            self.aggregatorServer.close()
+        if self.agent is not None:
+            self.agent.close()
+        self.close()
+
+    def ingest(self):
+        """Reading loop: sleeps until a log changes and queues its new
+        entries, looks for new files every refreshPeriod"""
+        nextDiscovery = monotonic() + self.refreshPeriod
+        while self.running:
+            timeout = nextDiscovery - monotonic()
+            if timeout <= 0:
+                # New files matching the patterns
+                self.discover()
+                self.enqueue(self.read_batches())
+                nextDiscovery = monotonic() + self.refreshPeriod
+                continue
+            ready, changed = self.watcher.wait(timeout)
+            # New lines are read as soon as they are written
+            changed = [logPath for logPath in changed
+                       if self.is_followed(logPath)]
+            if len(changed) != 0 and self.running:
+                # Files created since the last discovery
+                if any(logPath not in self.tailers for logPath in changed):
+                    self.discover()
+                self.enqueue(self.read_batches(changed))
+
+    def enqueue(self, batches):
+        """Queues batches of entries, waiting while the queue is full
+        :param batches: iterable of batches (see read_batches())"""
+        for batch in batches:
+            while self.running:
+                try:
+                    self.queue.put(batch, timeout=0.1)
+                    break
+                except Full:
+                    continue
+        self.backlog = sum(tailer.backlog()
+                           for tailer in list(self.tailers.values()))
+
+    def present(self):
+        """Display loop: displays each new snapshot and handles the keys"""
+        self.init_window()
+        # The keyboard is only watched when curses is used
+        inputs = []
+        if os.name == "posix" and self.printStatus:
+            inputs.append(sys.stdin)
+        displayed = None
+        while self.running:
+            ready, changed = self.presenterWatcher.wait(self.refreshPeriod,
+                                                        inputs)
             # Check if user sent key stroke
-            self.get_key_stroke()
-
-            # refresh only every delta
-            delta = timedelta(seconds=self.refreshPeriod)
-            if self.lastReadTime + delta < datetime.now():
-                self.read()
-                # If log file cannot be accessed self.running is set to false
-                if self.running:
-                    self.drop_old_entries()
-                    # if threshold is exceeded
-                    # but the alert was not activated before, call alert()
-                    hitRate = self.hits/self.monitorDuration*60
-                    if hitRate > self.alertThreshold and not self.alertStatus:
-                        self.alert()
-                    # else, if alert on but hits went below the threshold,
-                    # end the alert
-                    elif hitRate < self.alertThreshold and self.alertStatus:
-                        self.end_alert()
-                    # Check if the console output is enabled
-                    if self.printStatus:
-                        self.display_message()
+            if len(ready) != 0 and self.running:
+                self.get_key_stroke()
+            # Shows the new snapshot or the scrolling
+            if self.printStatus and self.running \
+                    and (len(ready) != 0 or self.snapshot is not displayed):
+                displayed = self.snapshot
+                self.display_message()
+        self.end_window()
+
+    def receive(self, name, buckets):
+        """Queues the buckets of a message of an agent, waiting while the
+        queue is full (called by the thread of its connection)
+        :param name: name of the agent
+        :param buckets: list of Bucket objects (see AggregatorServer)"""
+        self.enqueue([(monotonic(), None, [], buckets, None)])
+
+    def close(self):
+        """Closes the followed log files and writes the pending alerts"""
+        for tailer in self.tailers.values():
+            tailer.close()
+        if self.alertWriter is not None:
+            self.alertWriter.close()
+            self.alertWriter = None
 
     def stop(self, *args):
         """Stops the monitoring loop"""
         self.running = False
+        if len(args) == 1 and isinstance(args[0], str):
+            self.stopMessage = args[0]
+        # Interrupt the threads if they are waiting
+        for watcher in [self.watcher, self.presenterWatcher]:
+            if watcher is not None:
+                watcher.wake()
+        try:
+            self.queue.put_nowait(None)
+        except Full:
+            pass
+        # The display thread restores the console (see end_window())
+        if self.stdscr is None:
+            self.end_window()
+
+    def end_window(self):
+        """Restores the console and prints the message given to stop()"""
         if self.printStatus:
-            if os.name == "posix":
+            if os.name == "posix" and self.stdscr is not None:
                 self.stdscr.keypad(0)
                 curses.nocbreak()
                 curses.echo()
                 curses.endwin()
-            if len(args) == 1 and isinstance(args[0], str):
-                print(args[0])
+                self.stdscr = None
+            if self.stopMessage is not None:
+                print(self.stopMessage)
+                self.stopMessage = None
                 sleep(1)
+
+
+def truncate(time):
+    """Returns a datetime without its microseconds"""
+    return datetime(time.year, time.month, time.day, time.hour, time.minute,
+                    time.second)
+
+
+def is_pattern(logPath):
+    """Returns True if a path is a glob pattern"""
+    return any(character in logPath for character in "*?[")
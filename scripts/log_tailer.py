@@ -0,0 +1,173 @@
+# The LogTailer object follows a growing log file
+# and only returns the lines appended since the last read
+
+from log_entry import LogEntry
+import mmap
+import os
+
+
+class LogTailer:
+    """Follows a log file by remembering the byte offset and inode
+    of what was already read"""
+
+    # Size of the blocks read from the file at once in bytes
+    chunkSize = 1 << 20
+
+    def __init__(self, logPath):
+        """Constructor
+        :param logPath: path of the log file to follow
+        """
+        self.logPath = logPath
+        # File object kept open between reads (binary mode)
+        self.logFile = None
+        # Inode of the opened file, used to detect log rotation
+        self.inode = None
+        # Byte offset of the end of the last complete line read
+        self.offset = 0
+        # Bytes after the last newline, waiting for the end of the line
+        self.partial = b""
+
+    def open(self):
+        """Opens the log file and starts reading it from the beginning"""
+        self.close()
+        self.logFile = open(self.logPath, "rb")
+        self.inode = os.fstat(self.logFile.fileno()).st_ino
+        self.offset = 0
+        self.partial = b""
+
+    def close(self):
+        """Closes the log file if it is opened"""
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+    def backlog(self):
+        """Returns the number of bytes not read yet
+        Raises OSError if the log file cannot be opened
+        """
+        if self.logFile is None:
+            self.open()
+        size = os.fstat(self.logFile.fileno()).st_size
+        # Truncated files are handled by read_lines()
+        return max(size - self.offset, 0)
+
+    def seek(self, offset):
+        """Continues reading from a given offset
+        :param offset: offset of the beginning of a line"""
+        self.logFile.seek(offset)
+        self.offset = offset
+        self.partial = b""
+
+    def seek_time(self, timestamp):
+        """Continues reading from the first line at or after a given time,
+        found by a binary search over the memory-mapped file (the lines
+        must be ordered by time), the lines before it are never parsed
+        Raises OSError if the log file cannot be opened
+        :param timestamp: time in seconds since EPOCH
+        :return: offset of the line"""
+        if self.logFile is None:
+            self.open()
+        size = os.fstat(self.logFile.fileno()).st_size
+        offset = self.offset
+        # Empty files cannot be mapped
+        if size > offset:
+            with mmap.mmap(self.logFile.fileno(), size,
+                           access=mmap.ACCESS_READ) as data:
+                offset = find_time(data, offset, size, timestamp)
+        self.seek(offset)
+        return offset
+
+    def read_lines(self):
+        """Generator on the complete lines appended since the last call,
+        without their trailing newline
+        Raises OSError if the log file cannot be opened
+        """
+        if self.logFile is None:
+            self.open()
+
+        # copytruncate: the file is smaller than what we already read
+        if os.fstat(self.logFile.fileno()).st_size < self.logFile.tell():
+            self.logFile.seek(0)
+            self.offset = 0
+            self.partial = b""
+
+        # Drain what is left in the opened file (even if it was rotated)
+        for line in self.read_chunks():
+            yield line
+
+        # Rotation: a new file replaced the one we have opened
+        try:
+            inode = os.stat(self.logPath).st_ino
+        except OSError:
+            # The new file is not created yet, keep the old one until then
+            return
+        if inode != self.inode:
+            # A line cut by the rotation will never be completed
+            self.open()
+            for line in self.read_chunks():
+                yield line
+
+    def read_chunks(self):
+        """Generator on the complete lines between the current position
+        and the end of the opened file"""
+        while True:
+            chunk = self.logFile.read(self.chunkSize)
+            if not chunk:
+                break
+            data = self.partial + chunk
+            # Keep the bytes after the last newline for the next chunk
+            end = data.rfind(b"\n") + 1
+            self.partial = data[end:]
+            if end == 0:
+                continue
+            self.offset += end
+            # Lines are returned without their trailing newline
+            lines = data[:end - 1].decode("utf-8", "replace").split("\n")
+            for line in lines:
+                yield line
+
+
+def line_start(data, offset, start, end):
+    """Returns the offset of the first line beginning at or after an
+    offset (end if there is none)
+    :param data: content of the log (bytes or mmap object)
+    :param start: offset of the beginning of a line, before offset"""
+    if offset == start or data[offset - 1:offset] == b"\n":
+        return offset
+    newline = data.find(b"\n", offset, end)
+    return end if newline < 0 else newline + 1
+
+
+def line_time(data, offset, end):
+    """Returns the time of the first parsed complete line beginning at or
+    after the beginning of a line, None if there is none before end"""
+    while offset < end:
+        newline = data.find(b"\n", offset, end)
+        if newline < 0:
+            return None
+        entry = LogEntry(data[offset:newline].decode("utf-8", "replace"))
+        if entry.parsed:
+            return entry.timestamp
+        offset = newline + 1
+    return None
+
+
+def find_time(data, start, end, timestamp):
+    """Returns the offset of the first line at or after a given time,
+    by a binary search over the bytes between two offsets (the unparsed
+    lines take the time of the next parsed line)
+    :param data: content of the log (bytes or mmap object)
+    :param start: offset of the beginning of a line
+    :param end: end of the searched bytes
+    :param timestamp: time in seconds since EPOCH
+    :return: offset of the line, end if all the lines are older"""
+    low, high = start, end
+    # Smallest offset whose line is not older than timestamp
+    while low < high:
+        middle = (low + high)//2
+        time = line_time(data, line_start(data, middle, start, end), end)
+        if time is None or time >= timestamp:
+            high = middle
+        else:
+            low = middle + 1
+    return line_start(data, low, start, end)
@@ -0,0 +1,181 @@
+# The LogWatcher object blocks until a log file changes,
+# a file descriptor (keyboard) is ready or a timeout expires
+
+from select import select
+from time import sleep, monotonic
+import struct
+import os
+try:
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    inotify_init1 = libc.inotify_init1
+    inotify_add_watch = libc.inotify_add_watch
+except (OSError, AttributeError, TypeError):
+    # No inotify (not Linux): the log is polled
+    inotify_init1 = None
+
+# inotify constants (from sys/inotify.h)
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+# Changes of the log and of its name in the directory (rotation)
+IN_MASK = (0x2     # IN_MODIFY
+           | 0x4   # IN_ATTRIB
+           | 0x40  # IN_MOVED_FROM
+           | 0x80  # IN_MOVED_TO
+           | 0x100  # IN_CREATE
+           | 0x200)  # IN_DELETE
+# Header of an inotify event: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class LogWatcher:
+    """Waits for changes of the log files using inotify on Linux,
+    or by polling the state of the files elsewhere"""
+
+    # Period between two checks of the files when polling in seconds
+    pollPeriod = 0.5
+
+    def __init__(self, useInotify=True):
+        """Constructor
+        :param useInotify: set to False to always poll the files
+        """
+        # inotify file descriptor, None when polling
+        self.fd = None
+        if useInotify and inotify_init1 is not None:
+            self.fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self.fd < 0:
+                self.fd = None
+        # Watched directories by inotify watch descriptor
+        self.directories = {}
+        # State of the watched files at the last check (used when polling)
+        self.states = {}
+        # Pipe used by another thread to interrupt wait() (see wake())
+        self.wakeRead = None
+        self.wakeWrite = None
+        if os.name == "posix":
+            self.wakeRead, self.wakeWrite = os.pipe()
+        # Replaces the pipe where select only works with sockets (Windows)
+        self.woken = False
+
+    def watch(self, logPath):
+        """Starts watching a log file
+        :param logPath: path of the log file"""
+        logPath = os.path.abspath(logPath)
+        if logPath not in self.states:
+            self.states[logPath] = self.file_state(logPath)
+            # The directory is watched to also see the log being rotated
+            self.watch_directory(os.path.dirname(logPath))
+
+    def watch_directory(self, directory):
+        """Reports the changes of all the files of a directory (inotify only)
+        :param directory: path of the directory"""
+        if self.fd is None:
+            return
+        directory = os.path.abspath(directory)
+        wd = inotify_add_watch(self.fd, os.fsencode(directory), IN_MASK)
+        # Same descriptor when the directory is already watched
+        if wd >= 0:
+            self.directories[wd] = directory
+
+    def file_state(self, logPath):
+        """Returns what identifies a change of a log file"""
+        try:
+            stat = os.stat(logPath)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+    def wait(self, timeout, inputs=()):
+        """Blocks until a log changes, one of the inputs is ready to be
+        read or the timeout expires
+        :param timeout: maximum time to wait in seconds
+        :param inputs: objects with a fileno() method (e.g. sys.stdin)
+        :return: list of the ready inputs, set of the changed files
+        (absolute paths, with inotify it includes all the files
+        of the watched directories)
+        """
+        fds = list(inputs)
+        if self.wakeRead is not None:
+            fds.append(self.wakeRead)
+        if self.fd is not None:
+            ready = select(fds + [self.fd], [], [], max(timeout, 0))[0]
+            changed = set()
+            if self.fd in ready:
+                changed = self.read_events()
+            return self.ready_inputs(ready), changed
+
+        # Polling: check the files every pollPeriod until the deadline
+        deadline = monotonic() + timeout
+        while not self.woken:
+            changed = set()
+            for logPath, state in self.states.items():
+                newState = self.file_state(logPath)
+                if newState != state:
+                    self.states[logPath] = newState
+                    changed.add(logPath)
+            if len(changed) != 0:
+                return [], changed
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            period = min(self.pollPeriod, remaining)
+            if len(fds) == 0:
+                # select cannot wait without file descriptors on Windows
+                sleep(period)
+                continue
+            ready = select(fds, [], [], period)[0]
+            if len(ready) != 0:
+                return self.ready_inputs(ready), set()
+        self.woken = False
+        return [], set()
+
+    def ready_inputs(self, ready):
+        """Returns the inputs among the ready file descriptors
+        (wake-up bytes are discarded)"""
+        if self.wakeRead in ready:
+            os.read(self.wakeRead, 512)
+        return [item for item in ready
+                if item is not self.fd and item is not self.wakeRead]
+
+    def wake(self):
+        """Interrupts wait() from another thread"""
+        if self.wakeWrite is None:
+            self.woken = True
+            return
+        try:
+            os.write(self.wakeWrite, b"w")
+        except OSError:
+            # The watcher was closed in the meantime
+            pass
+
+    def read_events(self):
+        """Reads the pending inotify events
+        :return: set of the paths of the files concerned"""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data,
+                                                                    offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if wd in self.directories and len(name) != 0:
+                    changed.add(os.path.join(self.directories[wd],
+                                             os.fsdecode(name)))
+
+    def close(self):
+        """Stops watching the log"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.wakeRead is not None:
+            os.close(self.wakeRead)
+            os.close(self.wakeWrite)
+            self.wakeRead = None
+            self.wakeWrite = None
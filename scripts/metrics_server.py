@@ -0,0 +1,174 @@
+# Thread object which serves the statistics of the monitor over HTTP
+# in the Prometheus text format (headless mode): the text is rendered at
+# each refresh so that scrapes only send the last rendered response
+
+from rollups import format_duration
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+
+# Content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Answers GET /metrics with the last rendered metrics"""
+
+    def do_GET(self):
+        """Sends the metrics (404 for other paths)"""
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metricsServer.body
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Scrapes are not logged"""
+        pass
+
+
+class MetricsServer(Thread):
+    """Serves the metrics rendered by publish()"""
+
+    def __init__(self, address, port):
+        """Constructor (binds the port, raises OSError if it is not free)
+        :param address: address to listen on (e.g. 127.0.0.1)
+        :param port: TCP port, 0 for any free port (see port attribute)
+        """
+        Thread.__init__(self, daemon=True)
+        self.server = HTTPServer((address, port), MetricsRequestHandler)
+        self.server.metricsServer = self
+        self.port = self.server.server_address[1]
+        # Last rendered response (replaced at once by publish())
+        self.body = b""
+
+    def publish(self, text):
+        """Sets the metrics sent to the next scrapes
+        :param text: metrics in the Prometheus text format"""
+        self.body = text.encode("utf-8")
+
+    def run(self):
+        """Serving loop, until close() is called"""
+        self.server.serve_forever()
+
+    def close(self):
+        """Stops serving and closes the socket"""
+        if self.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
+
+
+def escape(value):
+    """Returns a label value escaped for the Prometheus text format"""
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def metrics_text(snapshot, logHandler):
+    """Returns the metrics of a snapshot in the Prometheus text format
+    :param snapshot: Snapshot object taken with its counts
+    :param logHandler: LogHandler object which took the snapshot"""
+    lines = []
+
+    def metric(name, kind, description, samples):
+        """Adds a metric with its samples ((labels, value) tuples)"""
+        name = "http_monitor_" + name
+        lines.append("# HELP %s %s" % (name, description))
+        lines.append("# TYPE %s %s" % (name, kind))
+        for labels, value in samples:
+            text = ""
+            if len(labels) != 0:
+                text = "{%s}" % ",".join('%s="%s"' % (key, escape(label))
+                                         for key, label in labels)
+            lines.append("%s%s %s" % (name, text, repr(float(value))))
+
+    metric("hits_per_minute", "gauge",
+           "Average hits/min over the monitored time frame",
+           [((), snapshot.hitRate)])
+    metric("rate_hits_per_minute", "gauge",
+           "Average hits/min over shorter and longer time frames",
+           [((("window", format_duration(duration)),), rate)
+            for duration, rate in snapshot.rates])
+    metric("window_hits", "gauge", "Hits in the monitored time frame",
+           [((), snapshot.hits)])
+    metric("window_bytes", "gauge",
+           "Bytes sent to the clients in the monitored time frame",
+           [((), snapshot.size)])
+    metric("window_seconds", "gauge", "Duration of the monitored time frame",
+           [((), logHandler.monitorDuration)])
+    metric("unique_clients", "gauge",
+           "Distinct client ips in the monitored time frame",
+           [((), snapshot.uniqueIps)])
+    metric("response_bytes", "summary", "Size of the responses",
+           [((("quantile", q),), value)
+            for q, value in zip(("0.5", "0.95", "0.99"),
+                                snapshot.percentiles)])
+    lines.append("http_monitor_response_bytes_sum %r" % float(snapshot.size))
+    lines.append("http_monitor_response_bytes_count %r"
+                 % float(snapshot.hits))
+    metric("section_hits", "gauge", "Hits by section (most frequent ones)",
+           [((("section", key),), value)
+            for key, value in snapshot.counts["sections"]])
+    metric("code_hits", "gauge", "Hits by status code",
+           [((("code", key),), value)
+            for key, value in snapshot.counts["codes"]])
+    metric("method_hits", "gauge", "Hits by method",
+           [((("method", key),), value)
+            for key, value in snapshot.counts["methods"]])
+    metric("alert_active", "gauge", "1 while the traffic alert is active",
+           [((), int(snapshot.alertStatus))])
+    metric("alert_rate", "gauge",
+           "Hits/min compared to the alert threshold (averaged if smoothed)",
+           [((), logHandler.engine().value)])
+    metric("alert_threshold", "gauge", "Alert threshold in hits/min",
+           [((), logHandler.alertThreshold)])
+    if logHandler.keyAlerts is not None:
+        metric("key_alerts_active", "gauge",
+               "Keys over the threshold of each per-key alert rule",
+               [((("rule", rule.name),), len(active)) for rule, active
+                in zip(logHandler.keyAlerts.rules,
+                       logHandler.keyAlerts.active)])
+    metric("alerts_total", "counter", "Alerts and recoveries since start",
+           [((), logHandler.alerts.count)])
+    metric("ingested_entries_total", "counter",
+           "Entries added to the window since start",
+           [((), snapshot.entryCount)])
+    metric("ingest_queue_depth", "gauge",
+           "Batches of entries waiting to be added to the window",
+           [((), snapshot.queueDepth)])
+    metric("ingest_lag_seconds", "gauge",
+           "Time the last batch of entries waited in the queue",
+           [((), snapshot.lag)])
+    metric("unread_bytes", "gauge", "Bytes of the logs not read yet",
+           [((), snapshot.backlog)])
+    if logHandler.aggregatorServer is not None:
+        metric("agents_connected", "gauge", "Agents sending their entries",
+               [((), len(logHandler.aggregatorServer.connections))])
+    if logHandler.agent is not None:
+        metric("agent_messages_total", "counter",
+               "Messages sent to the aggregator",
+               [((), logHandler.agent.sent)])
+        metric("agent_pending_seconds", "gauge",
+               "Seconds of entries not sent to the aggregator yet",
+               [((), len(logHandler.agent.pending))])
+    stats = snapshot.stats
+    metric("read_lines_total", "counter", "Lines read from the logs",
+           [((), stats["lines"])])
+    metric("read_bytes_total", "counter", "Bytes read from the logs",
+           [((), stats["bytes"])])
+    metric("parse_failures_total", "counter", "Lines which were not parsed",
+           [((), stats["parse_failures"])])
+    metric("parse_seconds_per_line", "gauge",
+           "Mean time spent reading and parsing a line",
+           [((), stats["parse"]["mean_ms"]/1000)])
+    metric("operation_seconds", "gauge",
+           "Duration of the last eviction, update and rendering",
+           [((("operation", name),), stats[name]["last_ms"]/1000)
+            for name in ("evict", "update", "render")])
+    metric("snapshot_timestamp_seconds", "gauge",
+           "Time of the snapshot of the metrics",
+           [((), snapshot.time.timestamp())])
+    return "\n".join(lines) + "\n"
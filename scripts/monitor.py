@@ -1,17 +1,139 @@
 # Run the HTTP monitor with parameters from parameters.cfg
 
 from log_handler import LogHandler
+from rollups import Rollups, DURATIONS
+from key_alerts import KeyAlerts, read_rules
+from instrumentation import Profiler
+from agent import parse_address
+from datetime import datetime
 import configparser
+import argparse
+import signal
 
 
-config = configparser.ConfigParser()
-config.read("parameters.cfg")
+# The processes parsing large backlogs import this module again
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP log monitor")
+    parser.add_argument("--replay", metavar="LOG",
+                        help="replay a past log as fast as possible, "
+                        "using the time of its entries as the clock")
+    parser.add_argument("--start", metavar="TIME",
+                        help="replay from this time of the log "
+                        "(e.g. 30/May/2015:14:00:00)")
+    parser.add_argument("--headless", action="store_true",
+                        help="do not use the console, serve the statistics "
+                        "in the Prometheus text format (see metricsPort)")
+    parser.add_argument("--agent", action="store_true",
+                        help="do not use the console, send the statistics "
+                        "of the logs to the aggregator (see "
+                        "aggregatorAddress)")
+    parser.add_argument("--aggregator", action="store_true",
+                        help="monitor the statistics sent by the agents "
+                        "instead of logPath (see aggregatorAddress)")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="profile the run with cProfile and write the "
+                        "profile to FILE (python -m pstats FILE)")
+    args = parser.parse_args()
+    start = None
+    if args.start is not None:
+        try:
+            start = datetime.strptime(args.start, "%d/%b/%Y:%H:%M:%S")
+        except ValueError:
+            parser.error("invalid start time: %s" % args.start)
+    if args.agent and args.aggregator:
+        parser.error("--agent and --aggregator cannot be used together")
 
-logPath = str(config.get("Monitor", "logPath"))
-refreshPeriod = float(config.get("Monitor", "refreshPeriod"))
-treshold = float(config.get("Monitor", "treshold"))
-monitorDuration = float(config.get("Monitor", "monitorDuration"))
-logHandler = LogHandler(logPath, refreshPeriod, treshold, monitorDuration)
-logHandler.start()
-# Wait for the logHandler to finish to end the program
-logHandler.join()
+    config = configparser.ConfigParser()
+    config.read("parameters.cfg")
+
+    logPath = str(config.get("Monitor", "logPath"))
+    refreshPeriod = float(config.get("Monitor", "refreshPeriod"))
+    treshold = float(config.get("Monitor", "treshold"))
+    monitorDuration = float(config.get("Monitor", "monitorDuration"))
+    # 0: exact counts of clients and sections
+    sketchCapacity = int(config.get("Monitor", "sketchCapacity",
+                                    fallback="0")) or None
+    try:
+        rules = read_rules(config)
+    except ValueError as error:
+        parser.error(str(error))
+    hysteresis = float(config.get("Monitor", "alertHysteresis",
+                                  fallback="0"))
+    holdTime = float(config.get("Monitor", "alertHoldTime", fallback="0"))
+    halfLife = float(config.get("Monitor", "alertHalfLife", fallback="0"))
+    backfill = config.getboolean("Monitor", "backfill", fallback=True)
+    rateWindows = [int(duration) for duration in config.get(
+        "Monitor", "rateWindows",
+        fallback=",".join(map(str, DURATIONS))).split(",")]
+    try:
+        aggregatorAddress = parse_address(config.get(
+            "Monitor", "aggregatorAddress", fallback="127.0.0.1:9109"))
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.replay is not None:
+        logHandler = LogHandler(args.replay, refreshPeriod, treshold,
+                                monitorDuration, sketchCapacity)
+        logHandler.rollups = Rollups(rateWindows)
+        logHandler.backfill = backfill
+        logHandler.alertHysteresis = hysteresis
+        logHandler.alertHoldTime = holdTime
+        logHandler.alertHalfLife = halfLife
+        if len(rules) != 0:
+            logHandler.keyAlerts = KeyAlerts(rules, monitorDuration,
+                                             hysteresis)
+        # Past alerts are printed, not stored with the real time ones
+        logHandler.alertLogPath = None
+        if args.cprofile is None:
+            lineCount, duration = logHandler.replay(start)
+        else:
+            profiler = Profiler(args.cprofile)
+            lineCount, duration = profiler.run(logHandler.replay, start)
+            profiler.dump()
+        print("Replayed %d lines in %.3fs: %d lines/s"
+              % (lineCount, duration, lineCount/max(duration, 1e-9)))
+    else:
+        # The aggregator only monitors the entries of the agents
+        if args.aggregator:
+            logPath = ""
+        logHandler = LogHandler(logPath, refreshPeriod, treshold,
+                                monitorDuration, sketchCapacity)
+        logHandler.rollups = Rollups(rateWindows)
+        logHandler.backfill = backfill
+        logHandler.alertHysteresis = hysteresis
+        logHandler.alertHoldTime = holdTime
+        logHandler.alertHalfLife = halfLife
+        if len(rules) != 0:
+            logHandler.keyAlerts = KeyAlerts(rules, monitorDuration,
+                                             hysteresis)
+        logHandler.checkpointPath = config.get(
+            "Monitor", "checkpointPath", fallback="") or None
+        logHandler.checkpointPeriod = float(config.get(
+            "Monitor", "checkpointPeriod", fallback="60"))
+        if args.aggregator:
+            logHandler.aggregatorAddress = aggregatorAddress
+            # An agent can run on the same machine
+            if logHandler.checkpointPath is not None:
+                logHandler.checkpointPath += ".aggregator"
+        if args.agent:
+            logHandler.agentAddress = aggregatorAddress
+            logHandler.agentName = config.get(
+                "Monitor", "agentName", fallback="") or None
+        if args.headless:
+            logHandler.metricsAddress = (
+                config.get("Monitor", "metricsAddress",
+                           fallback="127.0.0.1"),
+                int(config.get("Monitor", "metricsPort", fallback="9108")))
+        if args.headless or args.agent:
+            logHandler.printStatus = False
+            # Stopped by the service manager or Ctrl-C
+            signal.signal(signal.SIGTERM, logHandler.stop)
+            signal.signal(signal.SIGINT, logHandler.stop)
+            # Metrics of the monitor itself written on demand
+            if hasattr(signal, "SIGUSR1"):
+                signal.signal(signal.SIGUSR1, logHandler.dump_stats)
+        if args.cprofile is not None:
+            logHandler.profiler = Profiler(args.cprofile)
+        logHandler.start()
+        # Wait for the logHandler to finish to end the program
+        logHandler.join()
@@ -0,0 +1,62 @@
+# The QuantileSketch object estimates the quantiles (p50, p95, p99)
+# of the response sizes with a fixed amount of memory
+
+from collections import Counter
+from math import ceil, log
+
+
+class QuantileSketch:
+    """Histogram of values in logarithmic bins: any quantile is estimated
+    within a relative error of accuracy (1% by default)
+    The number of bins only depends on the range of the values
+    (about 1000 bins from 1 byte to 1GB), sketches can be added
+    and subtracted so expired seconds can be removed from a window
+    """
+
+    __slots__ = ("gamma", "logGamma", "counts")
+
+    def __init__(self, accuracy=0.01):
+        """Constructor
+        :param accuracy: relative error of the estimated quantiles
+        """
+        self.gamma = (1 + accuracy)/(1 - accuracy)
+        self.logGamma = log(self.gamma)
+        # Number of values by bin, values up to 0 are in bin 0
+        self.counts = Counter()
+
+    def add(self, value):
+        """Adds a value to the sketch"""
+        if value <= 0:
+            self.counts[0] += 1
+        else:
+            # Bins start at 1 (values between gamma^(i-1) and gamma^i)
+            self.counts[int(ceil(log(value)/self.logGamma)) + 1] += 1
+
+    def merge(self, other):
+        """Adds the values of another sketch (same accuracy)"""
+        self.counts.update(other.counts)
+
+    def subtract(self, other):
+        """Removes the values of another sketch added before"""
+        for index, count in other.counts.items():
+            if self.counts[index] == count:
+                del self.counts[index]
+            else:
+                self.counts[index] -= count
+
+    def quantile(self, q):
+        """Returns the estimated q-quantile of the values (0 if empty)
+        :param q: number between 0 and 1 (0.5 for the median)"""
+        total = sum(self.counts.values())
+        if total == 0:
+            return 0
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                break
+        if index == 0:
+            return 0
+        # Middle of the bin (relative error of accuracy on both sides)
+        return 2 * self.gamma ** (index - 1)/(self.gamma + 1)
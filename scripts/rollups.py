@@ -0,0 +1,116 @@
+# The Rollups object gives the hit rates over several time frames at once
+# (e.g. 10s, 2m, 15m and 1h): hits are counted by second and the seconds
+# are rolled up into minutes, so memory depends on the number of buckets
+# and not on the number of hits
+
+# Durations of the time frames in seconds
+DURATIONS = (10, 120, 900, 3600)
+# Time frames with at least MIN_BUCKETS minutes are computed from minutes
+MIN_BUCKETS = 10
+
+
+def format_duration(duration):
+    """Returns a short string of a duration in seconds (e.g. 2m, 1h)"""
+    for unit, seconds in (("h", 3600), ("m", 60)):
+        if duration >= seconds and duration % seconds == 0:
+            return "%d%s" % (duration//seconds, unit)
+    return "%ds" % duration
+
+
+class Rollups:
+    """Hits and bytes by second and by minute"""
+
+    def __init__(self, durations=DURATIONS):
+        """Constructor
+        :param durations: durations of the time frames in seconds
+        """
+        self.durations = tuple(sorted(durations))
+        # Time frames computed from the seconds and from the minutes
+        self.secondDurations = [duration for duration in self.durations
+                                if duration < MIN_BUCKETS * 60]
+        self.minuteDurations = [duration for duration in self.durations
+                                if duration >= MIN_BUCKETS * 60]
+        # [hits, bytes] by second and by minute (start of the minute)
+        self.seconds = {}
+        self.minutes = {}
+        # Seconds before this one are rolled up into the minutes
+        self.rolledUntil = None
+
+    def add(self, timestamp, hits, size):
+        """Counts hits of a second
+        :param timestamp: second of the hits, in seconds since EPOCH
+        :param hits: number of hits
+        :param size: total size of the hits"""
+        counts = self.seconds.get(timestamp)
+        if counts is None:
+            counts = self.seconds[timestamp] = [0, 0]
+        counts[0] += hits
+        counts[1] += size
+        # Late hits of a second already rolled up
+        if self.rolledUntil is not None and timestamp < self.rolledUntil:
+            self.add_minute(timestamp - timestamp % 60, hits, size)
+
+    def add_minute(self, minute, hits, size):
+        """Counts hits of a minute
+        :param minute: start of the minute, in seconds since EPOCH"""
+        counts = self.minutes.get(minute)
+        if counts is None:
+            counts = self.minutes[minute] = [0, 0]
+        counts[0] += hits
+        counts[1] += size
+
+    def advance(self, now):
+        """Rolls the complete minutes up and drops the expired buckets
+        :param now: current second, in seconds since EPOCH"""
+        minute = now - now % 60
+        if self.rolledUntil is None:
+            self.rolledUntil = min(self.seconds, default=minute)
+            self.rolledUntil -= self.rolledUntil % 60
+        if minute > self.rolledUntil:
+            for timestamp, counts in self.seconds.items():
+                if self.rolledUntil <= timestamp < minute:
+                    self.add_minute(timestamp - timestamp % 60, *counts)
+            self.rolledUntil = minute
+        # Seconds are kept for the time frames computed from them
+        # and until they are rolled up
+        limit = min(now - max(self.secondDurations, default=0),
+                    self.rolledUntil)
+        for timestamp in [timestamp for timestamp in self.seconds
+                          if timestamp <= limit]:
+            del self.seconds[timestamp]
+        limit = minute - max(self.minuteDurations, default=0)
+        for start in [start for start in self.minutes if start < limit]:
+            del self.minutes[start]
+
+    def counts(self, now):
+        """Returns the hits and bytes of each time frame (call advance()
+        first), the hits of the oldest minute of the time frames computed
+        from minutes are counted in proportion of its seconds in the
+        time frame
+        :param now: current second, in seconds since EPOCH
+        :return: list of (duration, hits, bytes) tuples"""
+        minute = now - now % 60
+        results = []
+        for duration in self.durations:
+            # (counts, part of the counts in the time frame) tuples
+            if duration in self.secondDurations:
+                buckets = [(counts, 1) for timestamp, counts
+                           in self.seconds.items()
+                           if now - duration < timestamp <= now]
+            else:
+                # Complete minutes and seconds of the current minute
+                buckets = [(counts, min(start + 60 + duration - now - 1,
+                                        60)/60)
+                           for start, counts in self.minutes.items()
+                           if now - duration < start + 59 and start < minute]
+                buckets += [(counts, 1) for timestamp, counts
+                            in self.seconds.items()
+                            if minute <= timestamp <= now]
+            results.append((duration,
+                            sum(counts[0] * part for counts, part in buckets),
+                            sum(counts[1] * part for counts, part in buckets)))
+        return results
+
+    def __len__(self):
+        """Number of buckets (seconds and minutes)"""
+        return len(self.seconds) + len(self.minutes)
@@ -2,28 +2,53 @@
 
 from entry_generator import EntryGenerator
 from log_handler import LogHandler
+from entry_generator import PROFILES
 from time import sleep
 import configparser
+import argparse
 import os
 
 
-config = configparser.ConfigParser()
-config.read("parameters.cfg")
+# The processes parsing large backlogs import this module again
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP monitor simulation")
+    parser.add_argument("--load", type=float, metavar="RATE",
+                        help="generate RATE entries per second by batches "
+                        "instead of the generationRate of parameters.cfg")
+    parser.add_argument("--profile", choices=PROFILES, default="steady",
+                        help="traffic profile of the generated load")
+    parser.add_argument("--duration", type=float, default=60,
+                        help="duration of the generated load in seconds")
+    parser.add_argument("--period", type=float, default=10,
+                        help="period of the burst and square profiles")
+    parser.add_argument("--seed", type=int,
+                        help="seed of the generated entries")
+    args = parser.parse_args()
 
-logPath = str(config.get("Simulation", "logPath"))
-if os.path.isfile(logPath):
-    os.remove(logPath)
-refreshPeriod = float(config.get("Simulation", "refreshPeriod"))
-treshold = float(config.get("Simulation", "treshold"))
-monitorDuration = float(config.get("Simulation", "monitorDuration"))
-generationRate = float(config.get("Simulation", "generationRate"))
-entryGenerator = EntryGenerator(logPath, generationRate)
-logHandler = LogHandler(logPath, refreshPeriod, treshold, monitorDuration)
-entryGenerator.start()
-sleep(1)
-logHandler.start()
+    config = configparser.ConfigParser()
+    config.read("parameters.cfg")
 
-# Wait for the logHandler to finish to end the generator
-logHandler.join()
-entryGenerator.stop()
-entryGenerator.join()
+    logPath = str(config.get("Simulation", "logPath"))
+    if os.path.isfile(logPath):
+        os.remove(logPath)
+    refreshPeriod = float(config.get("Simulation", "refreshPeriod"))
+    treshold = float(config.get("Simulation", "treshold"))
+    monitorDuration = float(config.get("Simulation", "monitorDuration"))
+    generationRate = float(config.get("Simulation", "generationRate"))
+    entryGenerator = EntryGenerator(logPath, generationRate, args.seed)
+    entryGenerator.loadRate = args.load
+    entryGenerator.profile = args.profile
+    entryGenerator.loadDuration = args.duration
+    entryGenerator.loadPeriod = args.period
+    logHandler = LogHandler(logPath, refreshPeriod, treshold, monitorDuration)
+    entryGenerator.start()
+    sleep(1)
+    logHandler.start()
+
+    # Wait for the logHandler to finish to end the generator
+    logHandler.join()
+    entryGenerator.stop()
+    entryGenerator.join()
+    if args.load is not None:
+        print("Generated %d entries: %d entries/s achieved"
+              % (entryGenerator.written, entryGenerator.achievedRate))
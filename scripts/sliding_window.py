@@ -0,0 +1,197 @@
+# The SlidingWindow object aggregates the entries of the monitored time frame
+# in one Bucket per second, so that old entries are removed bucket by bucket
+
+from frequent_items import FrequentItems, merge_counts
+from hyper_log_log import HyperLogLog, merge_count
+from quantile_sketch import QuantileSketch
+from collections import Counter
+from heapq import heappush, heappop
+
+
+def subtract(total, counts):
+    """Subtracts a Counter from another one, removing the keys reaching 0
+    :param total: Counter object to update
+    :param counts: Counter object to subtract"""
+    for key, count in counts.items():
+        if total[key] == count:
+            # When a Counter key has a value of 0 I prefer removing it
+            del total[key]
+        else:
+            total[key] -= count
+
+
+class Bucket:
+    """Aggregate of the entries of one second"""
+
+    __slots__ = ("timestamp", "hits", "size", "capacity", "sizes",
+                 "sections", "ips", "uniqueIps", "methods", "codes", "files")
+
+    def __init__(self, timestamp, capacity=None):
+        """Constructor
+        :param timestamp: second of the entries, in seconds since EPOCH
+        :param capacity: if not None, sections and ips are counted
+        approximately with at most capacity keys (FrequentItems)
+        and distinct ips are estimated (HyperLogLog)
+        """
+        self.timestamp = timestamp
+        self.hits = 0
+        self.size = 0
+        self.capacity = capacity
+        # Distribution of the sizes of the hits
+        self.sizes = QuantileSketch()
+        if capacity is None:
+            self.sections = Counter()
+            self.ips = Counter()
+            # Distinct ips are the keys of ips
+            self.uniqueIps = None
+        else:
+            self.sections = FrequentItems(capacity)
+            self.ips = FrequentItems(capacity)
+            self.uniqueIps = HyperLogLog()
+        self.methods = Counter()
+        self.codes = Counter()
+        self.files = Counter()
+
+    def add(self, entry, logPath):
+        """Adds a parsed LogEntry to the bucket
+        :param entry: parsed LogEntry object
+        :param logPath: path of the log file of the entry"""
+        self.hits += 1
+        self.size += entry.size
+        self.sizes.add(entry.size)
+        if self.capacity is None:
+            self.sections[entry.section] += 1
+            self.ips[entry.ip] += 1
+        else:
+            self.sections.add(entry.section)
+            self.ips.add(entry.ip)
+            self.uniqueIps.add(entry.ip)
+        self.methods[entry.method] += 1
+        self.codes[entry.code] += 1
+        self.files[logPath] += 1
+
+    def merge(self, other):
+        """Adds the entries of another bucket (of the same second)"""
+        self.hits += other.hits
+        self.size += other.size
+        self.sizes.merge(other.sizes)
+        if self.capacity is None:
+            self.sections.update(other.sections)
+            self.ips.update(other.ips)
+        else:
+            self.sections.merge(other.sections)
+            self.ips.merge(other.ips)
+            self.uniqueIps.merge(other.uniqueIps)
+        self.methods.update(other.methods)
+        self.codes.update(other.codes)
+        self.files.update(other.files)
+
+
+class SlidingWindow:
+    """Statistics on the entries of the monitored time frame"""
+
+    def __init__(self, capacity=None):
+        """Constructor
+        :param capacity: if not None, the memory used to count sections
+        and ips is bounded: each second only counts the capacity most
+        frequent ones (see FrequentItems for the error bound)
+        """
+        self.capacity = capacity
+        # Buckets of the window by second
+        self.buckets = {}
+        # Heap of the seconds of the buckets (oldest first)
+        self.timestamps = []
+        # Totals over all the buckets
+        self.hits = 0
+        self.size = 0
+        self.sizes = QuantileSketch()
+        # Counter: dict subclass for counting hashable objects
+        # (sections and ips stay empty when they are approximated,
+        # see top_counts())
+        self.sections = Counter()
+        self.ips = Counter()
+        self.methods = Counter()
+        self.codes = Counter()
+        # Hits by log file
+        self.files = Counter()
+
+    def add(self, entry, logPath):
+        """Adds a parsed LogEntry to the bucket of its second
+        and updates the totals
+        :param entry: parsed LogEntry object
+        :param logPath: path of the log file of the entry"""
+        bucket = self.buckets.get(entry.timestamp)
+        if bucket is None:
+            bucket = Bucket(entry.timestamp, self.capacity)
+            self.buckets[entry.timestamp] = bucket
+            heappush(self.timestamps, entry.timestamp)
+        bucket.add(entry, logPath)
+        self.hits += 1
+        self.size += entry.size
+        self.sizes.add(entry.size)
+        if self.capacity is None:
+            self.sections[entry.section] += 1
+            self.ips[entry.ip] += 1
+        self.methods[entry.method] += 1
+        self.codes[entry.code] += 1
+        self.files[logPath] += 1
+
+    def add_bucket(self, bucket):
+        """Adds the entries aggregated in a bucket and updates the totals
+        (the bucket object is kept by the window)"""
+        existing = self.buckets.get(bucket.timestamp)
+        if existing is None:
+            self.buckets[bucket.timestamp] = bucket
+            heappush(self.timestamps, bucket.timestamp)
+        else:
+            existing.merge(bucket)
+        self.hits += bucket.hits
+        self.size += bucket.size
+        self.sizes.merge(bucket.sizes)
+        if self.capacity is None:
+            self.sections.update(bucket.sections)
+            self.ips.update(bucket.ips)
+        self.methods.update(bucket.methods)
+        self.codes.update(bucket.codes)
+        self.files.update(bucket.files)
+
+    def drop_before(self, limitTime):
+        """Removes the buckets older than a given time
+        :param limitTime: timestamp of the oldest second to keep"""
+        while len(self.timestamps) != 0 and self.timestamps[0] < limitTime:
+            self.remove(self.buckets.pop(heappop(self.timestamps)))
+
+    def remove(self, bucket):
+        """Subtracts a whole bucket from the totals"""
+        self.hits -= bucket.hits
+        self.size -= bucket.size
+        self.sizes.subtract(bucket.sizes)
+        if self.capacity is None:
+            subtract(self.sections, bucket.sections)
+            subtract(self.ips, bucket.ips)
+        subtract(self.methods, bucket.methods)
+        subtract(self.codes, bucket.codes)
+        subtract(self.files, bucket.files)
+
+    def top_counts(self, name):
+        """Returns a Counter of the hits by section or by ip
+        When they are approximated, the estimates are merged from the
+        buckets of the window (expired seconds are thus not counted)
+        :param name: "sections" or "ips"
+        """
+        if self.capacity is None:
+            return getattr(self, name)
+        return merge_counts(getattr(bucket, name)
+                            for bucket in self.buckets.values())
+
+    def unique_ips(self):
+        """Returns the number of distinct ips
+        (estimated from the buckets when ips are approximated)"""
+        if self.capacity is None:
+            return len(self.ips)
+        return merge_count(bucket.uniqueIps
+                           for bucket in self.buckets.values())
+
+    def __len__(self):
+        """Number of buckets (seconds) in the window"""
+        return len(self.buckets)
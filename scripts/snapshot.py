@@ -0,0 +1,72 @@
+# The Snapshot object is an immutable copy of the statistics displayed
+# at a refresh: the display reads it while the window keeps changing
+
+# Number of items of the summary of each Counter
+TOP_COUNT = 3
+# Number of sections of the detailed counts (see counts)
+DETAILED_SECTIONS = 100
+
+
+class Snapshot:
+    """Statistics of the monitored time frame at a given time"""
+
+    __slots__ = ("time", "hits", "size", "hitRate", "alertStatus",
+                 "uniqueIps", "percentiles", "sections", "ips", "codes",
+                 "methods", "files", "fileCount", "queueDepth", "lag",
+                 "backlog", "entryCount", "rates", "stats", "counts",
+                 "alerts", "alertCount")
+
+    def __init__(self, logHandler, detailed=False):
+        """Constructor (called by the thread updating the window)
+        :param logHandler: LogHandler object
+        :param detailed: if True, counts holds the hits of every
+        status code and method and of the DETAILED_SECTIONS most frequent
+        sections (e.g. for the metrics server)
+        """
+        window = logHandler.window
+        self.time = logHandler.now()
+        self.hits = window.hits
+        self.size = window.size
+        self.hitRate = window.hits/logHandler.monitorDuration*60
+        self.alertStatus = logHandler.alertStatus
+        self.uniqueIps = window.unique_ips()
+        # p50, p95 and p99 of the sizes of the hits
+        self.percentiles = tuple(window.sizes.quantile(q)
+                                 for q in (0.5, 0.95, 0.99))
+        # Most frequent items (list of (item, hits) tuples)
+        self.sections = window.top_counts("sections").most_common(TOP_COUNT)
+        self.ips = window.top_counts("ips").most_common(TOP_COUNT)
+        self.codes = window.codes.most_common(TOP_COUNT)
+        self.methods = window.methods.most_common(TOP_COUNT)
+        self.files = window.files.most_common(TOP_COUNT)
+        # Files of the agents too when aggregating them
+        self.fileCount = max(len(logHandler.tailers), len(window.files))
+        # Ingestion: batches waiting to be added to the window, time the
+        # last batch waited and bytes of the logs not read yet
+        self.queueDepth = logHandler.queue.qsize()
+        self.lag = logHandler.lag
+        self.backlog = logHandler.backlog
+        # Entries added to the window since the beginning
+        self.entryCount = logHandler.entryCount
+        # Hits/min over shorter and longer time frames
+        # ((duration, rate) tuples, see Rollups)
+        self.rates = logHandler.rates()
+        # Metrics of the monitor itself (see Instrumentation.to_dict())
+        self.stats = logHandler.stats.to_dict()
+        # Most recent alerts (most recent first) and number of alerts
+        # added since the beginning (see AlertHistory)
+        self.alerts = tuple(logHandler.alerts.recent())
+        self.alertCount = logHandler.alerts.count
+        counts = None
+        if detailed:
+            counts = {"sections": window.top_counts("sections").most_common(
+                          DETAILED_SECTIONS),
+                      "codes": sorted(window.codes.items()),
+                      "methods": sorted(window.methods.items())}
+        self.counts = counts
+
+    def __setattr__(self, name, value):
+        """Attributes can only be set by the constructor"""
+        if hasattr(self, name):
+            raise AttributeError("Snapshot objects are immutable")
+        object.__setattr__(self, name, value)
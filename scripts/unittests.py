@@ -1,9 +1,37 @@
 # Unit tests that check if the classes and methods are working as intended
 
 import unittest
-from log_entry import LogEntry
+from log_entry import LogEntry, parse_many, entry_footprint
 from entry_generator import EntryGenerator
 from log_handler import LogHandler
+from log_tailer import LogTailer
+from log_watcher import LogWatcher
+from catch_up import split_chunks
+from frequent_items import FrequentItems, merge_counts
+from hyper_log_log import HyperLogLog, merge_count
+from quantile_sketch import QuantileSketch
+from rollups import Rollups, format_duration
+from alert_history import Alert, AlertHistory
+from alert_writer import AlertWriter, read_alerts
+from alert_engine import AlertEngine
+from log_archive import rotated_paths, rotated_lines
+from key_alerts import KeyAlerts, parse_rule
+from instrumentation import Profiler
+from sliding_window import Bucket
+from wire_format import encode_message, decode_message, FRAME_HEADER
+from agent import Agent, parse_address
+from checkpoint import write_checkpoint, read_checkpoint
+from aggregator import AggregatorServer
+from collections import Counter
+import random
+import json
+import gzip
+import zlib
+import pstats
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from threading import Thread, Timer
+from glob import glob
 from time import sleep
 from datetime import datetime
 from datetime import timedelta
@@ -43,6 +71,40 @@ class TestLogEntry(unittest.TestCase):
         logEntry = LogEntry(entryLine)
         self.assertFalse(logEntry.parsed)
 
+    def test_parse_many(self):
+        """Checks parsing of several lines at once"""
+        print("********************************")
+        print("test_parse_many()")
+        timeString = "30/May/2015:14:13:09"
+        lines = ['127.0.0.1 - - [%s +1000] "GET / HTTP/1.1" 200 -'
+                 % timeString,
+                 "This is not a log entry!",
+                 '::1 - - [%s +1000] "POST /api/v1 HTTP/1.1" 404 12'
+                 % timeString]
+        entries = list(parse_many(lines))
+        self.assertEqual([entry.parsed for entry in entries],
+                         [True, False, True])
+        self.assertEqual(entries[0].section, "root")
+        self.assertEqual(entries[0].size, 0)
+        self.assertEqual(entries[2].section, "api")
+        self.assertEqual(entries[2].code, "404")
+        # Entries of the same second share the same cached timestamp
+        self.assertIs(entries[0].timestamp, entries[2].timestamp)
+        self.assertEqual(entries[0].time, datetime(2015, 5, 30, 14, 13, 9))
+
+    def test_entry_footprint(self):
+        """Checks that entries are compact and share their common values"""
+        print("********************************")
+        print("test_entry_footprint()")
+        entries = list(parse_many(
+            ['127.0.0.1 - - [30/May/2015:14:13:09 +1000] "GET /icons/a.gif '
+             'HTTP/1.1" 200 %d' % size for size in (100, 2000)]))
+        self.assertFalse(hasattr(entries[0], "__dict__"))
+        self.assertIs(entries[0].section, entries[1].section)
+        self.assertIs(entries[0].code, entries[1].code)
+        self.assertTrue(entry_footprint(entries[0])
+                        < entry_footprint(entries[1]))
+
 
 class TestEntryGenerator(unittest.TestCase):
     """Test the EntryGenerator class"""
@@ -61,6 +123,532 @@ class TestEntryGenerator(unittest.TestCase):
             lines = generatedLog.readlines()
         self.assertTrue(len(lines) > 0)
 
+    def test_seed(self):
+        """Check that seeded generators give the same entries"""
+        print("********************************")
+        print("test_seed()")
+        now = datetime.now()
+        entries = EntryGenerator("tmp.log", 60, seed=1).generate_entries(
+            now, 100)
+        self.assertEqual(len(entries), 100)
+        self.assertEqual(entries, EntryGenerator("tmp.log", 60, seed=1)
+                         .generate_entries(now, 100))
+        self.assertTrue(all(LogEntry(entry).parsed for entry in entries))
+
+    def test_load(self):
+        """Check the rate achieved by the load mode and its profiles"""
+        print("********************************")
+        print("test_load()")
+        entryGenerator = EntryGenerator("tmp.log", 60, seed=0)
+        entryGenerator.clear_log()
+        rate = entryGenerator.load(20000, duration=0.5)
+        self.assertEqual(entryGenerator.written, 10000)
+        self.assertTrue(abs(rate - 20000) < 0.1 * 20000)
+        with open("tmp.log") as generatedLog:
+            self.assertEqual(len(generatedLog.readlines()), 10000)
+        # Nothing is written during the second half of the square periods
+        entryGenerator.load(20000, "square", duration=0.5, period=0.5)
+        self.assertEqual(entryGenerator.written, 5000)
+        with self.assertRaises(ValueError):
+            entryGenerator.load(20000, "unknown")
+
+
+class TestFrequentItems(unittest.TestCase):
+    """Test the FrequentItems class"""
+
+    def setUp(self):
+        """Streams of keys with a few frequent ones"""
+        generator = random.Random(0)
+        self.streams = []
+        for i in range(3):
+            stream = ["heavy"] * 300 + ["medium%d" % i] * 100
+            stream += [str(generator.random()) for j in range(1000)]
+            generator.shuffle(stream)
+            self.streams.append(stream)
+
+    def check_bound(self, counts, capacity, stream):
+        """Checks the error bound of estimated counts"""
+        exact = Counter(stream)
+        error = len(stream)/(capacity + 1)
+        for key, count in exact.items():
+            self.assertTrue(count - error <= counts.get(key, 0) <= count)
+
+    def test_add(self):
+        """Check memory and error bounds of a summary"""
+        print("********************************")
+        print("test_add()")
+        summary = FrequentItems(20)
+        for key in self.streams[0]:
+            summary.add(key)
+        self.assertTrue(len(summary) <= 20)
+        self.assertEqual(summary.total, len(self.streams[0]))
+        self.check_bound(summary.counts, 20, self.streams[0])
+        self.assertIn("heavy", summary.counts)
+
+    def test_merge(self):
+        """Check the error bound of merged summaries"""
+        print("********************************")
+        print("test_merge()")
+        summaries = []
+        for stream in self.streams:
+            summary = FrequentItems(20)
+            for key in stream:
+                summary.add(key)
+            summaries.append(summary)
+        allKeys = sum(self.streams, [])
+        self.check_bound(merge_counts(summaries), 20, allKeys)
+        merged = FrequentItems(20)
+        for summary in summaries:
+            merged.merge(summary)
+        self.assertTrue(len(merged) <= 20)
+        self.check_bound(merged.counts, 20, allKeys)
+
+
+class TestSketches(unittest.TestCase):
+    """Test the HyperLogLog and QuantileSketch classes"""
+
+    def test_hyper_log_log(self):
+        """Check the estimated number of distinct keys"""
+        print("********************************")
+        print("test_hyper_log_log()")
+        sketches = []
+        for i in range(4):
+            sketch = HyperLogLog()
+            # Overlapping streams of 5000 keys, repeated twice
+            for j in range(2 * 5000):
+                sketch.add("key%d" % (i * 2500 + j % 5000))
+            sketches.append(sketch)
+        # 3 standard errors
+        self.assertTrue(abs(sketches[0].count() - 5000) < 0.1 * 5000)
+        self.assertTrue(abs(merge_count(sketches) - 12500) < 0.1 * 12500)
+        # Small cardinalities are almost exact
+        sketch = HyperLogLog()
+        for key in ["a", "b", "c", "a"]:
+            sketch.add(key)
+        self.assertEqual(sketch.count(), 3)
+        self.assertEqual(HyperLogLog().count(), 0)
+
+    def test_quantile_sketch(self):
+        """Check the relative error of the estimated quantiles"""
+        print("********************************")
+        print("test_quantile_sketch()")
+        generator = random.Random(0)
+        values = [generator.randint(1, 100000) for i in range(5000)]
+        first = QuantileSketch()
+        second = QuantileSketch()
+        for value in values[:2500]:
+            first.add(value)
+        for value in values[2500:]:
+            second.add(value)
+        first.merge(second)
+        for q in [0.5, 0.95, 0.99]:
+            exact = sorted(values)[int(q * (len(values) - 1))]
+            self.assertTrue(abs(first.quantile(q) - exact) <= 0.01 * exact)
+        # Removing the values of the second sketch
+        first.subtract(second)
+        values = sorted(values[:2500])
+        exact = values[int(0.5 * (len(values) - 1))]
+        self.assertTrue(abs(first.quantile(0.5) - exact) <= 0.01 * exact)
+        self.assertEqual(QuantileSketch().quantile(0.5), 0)
+
+
+class TestRollups(unittest.TestCase):
+    """Test the Rollups class"""
+
+    def test_rollups(self):
+        """Check the hits of the time frames and the rolled up minutes"""
+        print("********************************")
+        print("test_rollups()")
+        rollups = Rollups((10, 120, 900, 3600))
+        # 2 hours of 1 hit of 100 bytes per second, advanced every 10s
+        start = 1500000000 - 1500000000 % 3600
+        for timestamp in range(start, start + 7200):
+            rollups.add(timestamp, 1, 100)
+            if timestamp % 10 == 9:
+                rollups.advance(timestamp)
+        now = start + 7199
+        counts = rollups.counts(now)
+        self.assertEqual(counts[0], (10, 10, 1000))
+        self.assertEqual(counts[1], (120, 120, 12000))
+        # Whole minutes (the current one is complete)
+        self.assertEqual(counts[2], (900, 900, 90000))
+        self.assertEqual(counts[3], (3600, 3600, 360000))
+        # Memory depends on the number of buckets, not on the hits
+        self.assertTrue(len(rollups) <= 120 + 60 + 1)
+        # Late hits of a minute already rolled up
+        rollups.add(now - 300, 5, 500)
+        rollups.advance(now)
+        self.assertEqual(rollups.counts(now)[3][1], 3605)
+        self.assertEqual([format_duration(duration)
+                          for duration in rollups.durations],
+                         ["10s", "2m", "15m", "1h"])
+
+
+class TestAlertHistory(unittest.TestCase):
+    """Test the AlertHistory class"""
+
+    def test_ring(self):
+        """Check that only the most recent alerts are kept"""
+        print("********************************")
+        print("test_ring()")
+        history = AlertHistory(3)
+        start = datetime(2015, 5, 30, 14, 0, 0)
+        for i in range(5):
+            history.add(Alert(start + timedelta(seconds=i), i % 2 == 0,
+                              200, 100, 120))
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.count, 5)
+        self.assertEqual([alert.time.second for alert in history.recent()],
+                         [4, 3, 2])
+        self.assertEqual(len(history.recent(2)), 2)
+        lines = history.text().split("\n")
+        self.assertEqual(lines[0], "[30/May/2015:14:00:04] HIGH TRAFFIC "
+                         "generated an alert - hits/min = 200")
+        self.assertEqual(lines[1], "[30/May/2015:14:00:03] Traffic slowed "
+                         "down, the alert has recovered")
+
+
+class TestAlertEngine(unittest.TestCase):
+    """Test the AlertEngine class"""
+
+    def crossings(self, engine, rates):
+        """Feeds hits/second to an engine, returns its changes of status
+        as (second, high) tuples"""
+        for second, rate in enumerate(rates):
+            engine.add(second, rate)
+        engine.advance(len(rates))
+        return [(second, high) for second, high, value in engine.pop()]
+
+    def test_alert_engine(self):
+        """Check the hysteresis, the hold time and the smoothing"""
+        print("********************************")
+        print("test_alert_engine()")
+        # Threshold of 2 hits/s over 10s, traffic hovering around it
+        rates = [1] * 20 + ([3] * 4 + [1] * 4) * 5 + [1] * 20
+        self.assertEqual(self.crossings(AlertEngine(120, 10), rates),
+                         [(28, True), (34, False), (36, True), (42, False),
+                          (44, True), (50, False), (52, True), (58, False)])
+        # The alert ends under 90 hits/min
+        self.assertEqual(self.crossings(AlertEngine(120, 10, 0.25), rates),
+                         [(28, True), (65, False)])
+        # Crossings lasting less than 4s are ignored
+        self.assertEqual(self.crossings(AlertEngine(120, 10, 0, 4), rates),
+                         [(28, True), (58, False)])
+        self.assertEqual(len(self.crossings(AlertEngine(120, 10, 0, 0, 10),
+                                            rates)), 2)
+        # Seconds without hits are evaluated by advance()
+        engine = AlertEngine(120, 10)
+        engine.add(0, 30)
+        engine.advance(1000)
+        self.assertEqual([high for second, high, value in engine.pop()],
+                         [True, False])
+
+
+class TestKeyAlerts(unittest.TestCase):
+    """Test the KeyAlerts class"""
+
+    def entry(self, second, ip, code):
+        """Returns a LogEntry of a given second, client and status code"""
+        time = datetime(2015, 5, 30, 14, 0, 0) + timedelta(seconds=second)
+        return LogEntry('%s - - [%s +1000] "GET /api/users HTTP/1.1" %s 100'
+                        % (ip, time.strftime("%d/%b/%Y:%H:%M:%S"), code))
+
+    def test_key_alerts(self):
+        """Check the crossings of the rules and the expiry of the keys"""
+        print("********************************")
+        print("test_key_alerts()")
+        rules = [parse_rule("client", "ip * 60"),
+                 parse_rule("errors", "code 5?? 5%"),
+                 parse_rule("api", "section /api 5000")]
+        self.assertEqual(rules[2].pattern, "api")
+        with self.assertRaises(ValueError):
+            parse_rule("bad", "ip 60")
+        keyAlerts = KeyAlerts(rules, 10)
+        # 10.0.0.1: 2 hits/s (120 hits/min), others: 1 hit/s each
+        for second in range(10):
+            keyAlerts.add(self.entry(second, "10.0.0.1", "200"))
+            keyAlerts.add(self.entry(second, "10.0.0.1", "200"))
+            for i in range(30):
+                keyAlerts.add(self.entry(second, "10.0.1.%d" % i, "200"))
+        events = [(rule.name, key, high) for second, rule, key, high,
+                  value in keyAlerts.pop()]
+        self.assertEqual(events, [("client", "10.0.0.1", True)])
+        # 20 errors out of 340 hits
+        for i in range(20):
+            keyAlerts.add(self.entry(9, "10.0.2.%d" % i, "503"))
+        events = [(rule.name, key, high) for second, rule, key, high,
+                  value in keyAlerts.pop()]
+        self.assertEqual(events, [("errors", "5??", True)])
+        # The hits of 10.0.0.1 expire, the errors remain
+        keyAlerts.drop_before(keyAlerts.timestamps[0] + 6)
+        events = [(rule.name, key, high) for second, rule, key, high,
+                  value in keyAlerts.pop()]
+        self.assertEqual(events, [("client", "10.0.0.1", False)])
+        # Keys without hits are forgotten
+        keyAlerts.drop_before(keyAlerts.timestamps[-1] + 1)
+        self.assertEqual(len(keyAlerts), 0)
+        self.assertEqual([(rule.name, high) for second, rule, key, high,
+                          value in keyAlerts.pop()], [("errors", False)])
+
+    def test_share_expiry(self):
+        """Check that a share crosses its threshold when the hits of the
+        other keys expire"""
+        print("********************************")
+        print("test_share_expiry()")
+        keyAlerts = KeyAlerts([parse_rule("errors", "code 5?? 5%")], 10)
+        for i in range(190):
+            keyAlerts.add(self.entry(0, "10.0.0.1", "200"))
+        # 10 errors out of 300 hits
+        for i in range(100):
+            keyAlerts.add(self.entry(5, "10.0.0.1", "200"))
+        for i in range(10):
+            keyAlerts.add(self.entry(5, "10.0.0.2", "503"))
+        keyAlerts.check_shares()
+        self.assertEqual(keyAlerts.pop(), [])
+        # 10 errors out of 110 hits once the first second expires
+        keyAlerts.drop_before(keyAlerts.timestamps[0] + 1)
+        self.assertEqual([(rule.name, key, high) for second, rule, key, high,
+                          value in keyAlerts.pop()],
+                         [("errors", "5??", True)])
+
+
+class TestAlertWriter(unittest.TestCase):
+    """Test the AlertWriter class"""
+
+    def test_rotation(self):
+        """Check that records are written, rotated and read back"""
+        print("********************************")
+        print("test_rotation()")
+        logPath = "tmp_alerts.log"
+        # Line of an older version of the alert log
+        with open(logPath, "w") as alertLog:
+            alertLog.write("[30/May/2015:13:00:00] HIGH TRAFFIC\n")
+        writer = AlertWriter(logPath, flushInterval=0.1, maxBytes=1500)
+        writer.start()
+        start = datetime(2015, 5, 30, 14, 0, 0)
+        # 3 batches of about 1000 bytes: the log is rotated after the
+        # second one
+        for i in range(30):
+            writer.write(Alert(start + timedelta(seconds=i), i % 2 == 0,
+                               150.5, 100, 120))
+            if i % 10 == 9:
+                sleep(0.3)
+        # Written in the background before being closed
+        self.assertTrue(os.path.getsize(logPath + ".1") > 1500)
+        self.assertTrue(0 < os.path.getsize(logPath) < 1500)
+        writer.close()
+        with open(logPath) as alertLog:
+            record = json.loads(alertLog.readlines()[-1])
+        self.assertEqual(record, {"time": "2015-05-30T14:00:29",
+                                  "event": "recovered", "rate": 150.5,
+                                  "threshold": 100, "window": 120})
+        alerts = read_alerts(logPath, 2, 5)
+        self.assertEqual([alert.time.second for alert in alerts],
+                         [27, 26, 25, 24, 23])
+        self.assertTrue(alerts[1].high)
+        # The backup is read when the log is exhausted
+        alerts = read_alerts(logPath, 0, 100)
+        self.assertEqual([alert.time.second for alert in alerts],
+                         list(range(29, -1, -1)))
+
+
+class TestLogTailer(unittest.TestCase):
+    """Test the LogTailer class"""
+
+    def setUp(self):
+        """Initialization of the tests"""
+        self.logPath = "tmp.log"
+        self.entryGenerator = EntryGenerator(self.logPath, rate=60)
+        self.entryGenerator.clear_log()
+        self.tailer = LogTailer(self.logPath)
+
+    def tearDown(self):
+        """Close the followed file"""
+        self.tailer.close()
+
+    def test_incremental_read(self):
+        """Check that only new complete lines are returned"""
+        print("********************************")
+        print("test_incremental_read()")
+        self.entryGenerator.write("line 1\nline 2\nline")
+        self.assertEqual(list(self.tailer.read_lines()), ["line 1", "line 2"])
+        # The partial line is only returned once it is complete
+        self.entryGenerator.write(" 3\n")
+        self.assertEqual(list(self.tailer.read_lines()), ["line 3"])
+        self.assertEqual(list(self.tailer.read_lines()), [])
+        self.assertEqual(self.tailer.offset, 21)
+
+    def test_truncation(self):
+        """Check that a truncated log (copytruncate) is read again"""
+        print("********************************")
+        print("test_truncation()")
+        self.entryGenerator.write("line 1\nline 2\n")
+        self.assertEqual(len(list(self.tailer.read_lines())), 2)
+        self.entryGenerator.clear_log()
+        self.entryGenerator.write("line 3\n")
+        self.assertEqual(list(self.tailer.read_lines()), ["line 3"])
+
+    def test_rotation(self):
+        """Check that the end of a rotated log and the new log are read"""
+        print("********************************")
+        print("test_rotation()")
+        self.entryGenerator.write("line 1\n")
+        self.assertEqual(list(self.tailer.read_lines()), ["line 1"])
+        # Written before the rotation but not read yet
+        self.entryGenerator.write("line 2\n")
+        rotatedPath = self.logPath + ".1"
+        if os.path.isfile(rotatedPath):
+            os.remove(rotatedPath)
+        os.rename(self.logPath, rotatedPath)
+        self.entryGenerator.write("line 3\n")
+        try:
+            self.assertEqual(list(self.tailer.read_lines()),
+                             ["line 2", "line 3"])
+        finally:
+            self.tailer.close()
+            os.remove(rotatedPath)
+
+    def test_seek_time(self):
+        """Check that reading starts at the first line of a given time"""
+        print("********************************")
+        print("test_seek_time()")
+        start = datetime(2015, 5, 30, 14, 0, 0)
+        lines = []
+        # Offset of the first line of each second
+        offsets = []
+        for second in range(100):
+            offsets.append(len("".join(lines)))
+            # Unparsed lines and several lines per second
+            if second % 10 == 0:
+                lines.append("not an entry\n")
+            for i in range(second % 3 + 1):
+                lines.append(self.entryGenerator.generate_entry(
+                    start + timedelta(seconds=second)))
+        self.entryGenerator.write("".join(lines) + "partial")
+        timestamp = LogEntry(lines[1]).timestamp
+        for second in [0, 1, 10, 50, 99]:
+            self.tailer.close()
+            self.assertEqual(self.tailer.seek_time(timestamp + second),
+                             offsets[second])
+        entry = LogEntry(next(self.tailer.read_lines()))
+        self.assertEqual(entry.timestamp, timestamp + 99)
+        # Whole log and no line (the partial line is not read)
+        self.tailer.close()
+        self.assertEqual(self.tailer.seek_time(timestamp - 10), 0)
+        self.assertEqual(self.tailer.seek_time(timestamp + 100),
+                         len("".join(lines)))
+        self.assertEqual(list(self.tailer.read_lines()), [])
+
+
+class TestLogArchive(unittest.TestCase):
+    """Test reading the rotated files of a log"""
+
+    def setUp(self):
+        """Initialization of the tests"""
+        self.logPath = "tmp_archive.log"
+        self.entryGenerator = EntryGenerator(self.logPath, 60)
+
+    def write_chain(self, start):
+        """Writes 100 entries per file (1 per second from start, oldest in
+        the compressed file) to the log and its rotated files"""
+        lines = [self.entryGenerator.generate_entry(
+            start + timedelta(seconds=second)) for second in range(300)]
+        with gzip.open(self.logPath + ".2.gz", "wt") as logFile:
+            logFile.write("".join(lines[:100]))
+        with open(self.logPath + ".1", "w") as logFile:
+            logFile.write("".join(lines[100:200]))
+        with open(self.logPath, "w") as logFile:
+            logFile.write("".join(lines[200:]))
+        return lines
+
+    def test_rotated_lines(self):
+        """Check that the rotated files are read oldest first"""
+        print("********************************")
+        print("test_rotated_lines()")
+        lines = self.write_chain(datetime(2015, 5, 30, 14, 0, 0))
+        self.assertEqual(rotated_paths(self.logPath),
+                         [self.logPath + ".1", self.logPath + ".2.gz"])
+        self.assertEqual(list(rotated_lines(self.logPath)),
+                         [line.rstrip("\n") for line in lines[:200]])
+        start = LogEntry(lines[0]).timestamp
+        # Only the end of the uncompressed file
+        self.assertEqual(len(list(rotated_lines(self.logPath, start + 150))),
+                         50)
+        # The compressed file is read whole
+        self.assertEqual(len(list(rotated_lines(self.logPath, start + 50))),
+                         200)
+        logHandler = LogHandler(self.logPath, 10, 1e6, 10)
+        logHandler.printStatus = False
+        logHandler.alertLogPath = None
+        self.assertEqual(logHandler.replay()[0], 300)
+        logHandler = LogHandler(self.logPath, 10, 1e6, 10)
+        logHandler.printStatus = False
+        logHandler.alertLogPath = None
+        self.assertEqual(logHandler.replay(
+            datetime(2015, 5, 30, 14, 2, 30))[0], 150)
+
+    def test_backfill(self):
+        """Check that the time frames are read from the rotated files"""
+        print("********************************")
+        print("test_backfill()")
+        # The last 100s are in the log
+        self.write_chain(datetime.now() - timedelta(seconds=299))
+        for backfill, hits in [(True, 121), (False, 100)]:
+            logHandler = LogHandler(self.logPath, 10, 1e6, 120)
+            logHandler.printStatus = False
+            logHandler.backfill = backfill
+            logHandler.read()
+            logHandler.update()
+            logHandler.close()
+            self.assertTrue(abs(logHandler.hits - hits) <= 1)
+
+
+class TestLogWatcher(unittest.TestCase):
+    """Test the LogWatcher class"""
+
+    def setUp(self):
+        """Initialization of the tests"""
+        self.logPath = "tmp.log"
+        self.entryGenerator = EntryGenerator(self.logPath, rate=60)
+        self.entryGenerator.clear_log()
+
+    def check_wait(self, watcher):
+        """Checks that the watcher sleeps until the log changes"""
+        try:
+            # Nothing written: wait until the timeout
+            ready, changed = watcher.wait(0.2)
+            self.assertFalse(changed)
+            # Written during the wait: wakes up before the timeout
+            Timer(0.1, self.entryGenerator.write, ["new line\n"]).start()
+            start = datetime.now()
+            ready, changed = watcher.wait(5)
+            self.assertIn(os.path.abspath(self.logPath), changed)
+            self.assertTrue(datetime.now() - start < timedelta(seconds=2))
+            # Interrupted by another thread
+            Timer(0.1, watcher.wake).start()
+            start = datetime.now()
+            ready, changed = watcher.wait(5)
+            self.assertFalse(changed)
+            self.assertTrue(datetime.now() - start < timedelta(seconds=2))
+        finally:
+            watcher.close()
+
+    def test_wait(self):
+        """Check waiting for changes of the log (inotify if available)"""
+        print("********************************")
+        print("test_wait()")
+        watcher = LogWatcher()
+        watcher.watch(self.logPath)
+        self.check_wait(watcher)
+
+    def test_wait_polling(self):
+        """Check waiting for changes of the log by polling"""
+        print("********************************")
+        print("test_wait_polling()")
+        watcher = LogWatcher(useInotify=False)
+        watcher.watch(self.logPath)
+        self.check_wait(watcher)
+
 
 class TestLogHandler(unittest.TestCase):
     """Test the LogHandler class"""
@@ -71,6 +659,8 @@ class TestLogHandler(unittest.TestCase):
         self.logPath = "tmp.log"
         self.generatingRate = 60
         self.entryGenerator = EntryGenerator(self.logPath, self.generatingRate)
+        # Start from an empty log so that tests do not depend on each other
+        self.entryGenerator.clear_log()
         now = datetime.now()
         # Add a 10 hours old entry
         self.entryGenerator.write_entry(now - timedelta(hours=10))
@@ -89,6 +679,10 @@ class TestLogHandler(unittest.TestCase):
         # Disable logHandler console output for the tests
         self.logHandler.printStatus = False
 
+    def tearDown(self):
+        """Close the log followed by the LogHandler"""
+        self.logHandler.close()
+
     def test_add_entry(self):
         """Tests adding entries to the LogHandler"""
         print("********************************")
@@ -97,7 +691,7 @@ class TestLogHandler(unittest.TestCase):
         logEntry = LogEntry(unparsedEntry)
         self.logHandler.add_entry(logEntry)
         # Check that all the attributes of the entry have been processed
-        self.assertEqual(self.logHandler.log[0], logEntry)
+        self.assertEqual(len(self.logHandler.window), 1)
         self.assertEqual(self.logHandler.hits, 1)
         self.assertEqual(self.logHandler.size, logEntry.size)
         self.assertEqual(self.logHandler.sections, {logEntry.section: 1})
@@ -108,25 +702,31 @@ class TestLogHandler(unittest.TestCase):
         # to check if it's correctly dropped
         logEntry = LogEntry("This is not a formatted entry\n")
         self.logHandler.add_entry(logEntry)
-        self.assertEqual(len(self.logHandler.log), 1)
+        self.assertEqual(len(self.logHandler.window), 1)
         self.assertEqual(self.logHandler.hits, 1)
 
     def test_delete_entry(self):
         """Tests deleting entries from the LogHandler"""
         print("********************************")
         print("test_delete_entry()")
-        # Add 2 entries and delete the oldest
-        unparsedEntry = self.entryGenerator.generate_entry(datetime.now())
+        # Add 3 entries over 2 seconds and delete the oldest second
+        now = datetime.now()
+        before = now - timedelta(seconds=1)
+        unparsedEntry = self.entryGenerator.generate_entry(before)
         logEntry1 = LogEntry(unparsedEntry)
-        unparsedEntry = self.entryGenerator.generate_entry(datetime.now())
+        unparsedEntry = self.entryGenerator.generate_entry(before)
+        logEntry3 = LogEntry(unparsedEntry)
+        unparsedEntry = self.entryGenerator.generate_entry(now)
         logEntry2 = LogEntry(unparsedEntry)
 
         self.logHandler.add_entry(logEntry1)
+        self.logHandler.add_entry(logEntry3)
         self.logHandler.add_entry(logEntry2)
-        self.logHandler.delete_entry()  # logEntry1 should be deleted (oldest)
+        # logEntry1 and logEntry3 should be deleted (oldest second)
+        self.logHandler.window.drop_before(logEntry2.timestamp)
 
         # Check that only logEntry2 is left
-        self.assertEqual(self.logHandler.log[0], logEntry2)
+        self.assertEqual(len(self.logHandler.window), 1)
         self.assertEqual(self.logHandler.hits, 1)
         self.assertEqual(self.logHandler.size, logEntry2.size)
         self.assertEqual(self.logHandler.sections, {logEntry2.section: 1})
@@ -144,11 +744,10 @@ class TestLogHandler(unittest.TestCase):
         self.logHandler.read()
 
         # Check that only the two most recent entries have been processed
-        self.assertEqual(len(self.logHandler.log), 2)
         self.assertEqual(self.logHandler.hits, 2)
-        # Check that all entries are of type LogEntry
-        for entry in self.logHandler.log:
-            self.assertIsInstance(entry, LogEntry)
+        # Check that both entries are in the bucket of their second
+        bucket = next(iter(self.logHandler.window.buckets.values()))
+        self.assertEqual(bucket.hits, 2)
 
     def test_several_reads(self):
         """Test behaviour of LogHandler when reading several times in a row"""
@@ -156,12 +755,28 @@ class TestLogHandler(unittest.TestCase):
         print("test_several_reads()")
         self.logHandler.read()
         # Check that only the two most recententries have been processed
-        self.assertEqual(len(self.logHandler.log), 2)
+        self.assertEqual(self.logHandler.hits, 2)
         # Add a new entry
         self.entryGenerator.write_entry(datetime.now())
         self.logHandler.read()
         # Check that logHandler has 3 entries in total
-        self.assertEqual(len(self.logHandler.log), 3)
+        self.assertEqual(self.logHandler.hits, 3)
+
+    def test_identical_entries(self):
+        """Test that identical requests of the same second are all counted,
+        including when they are read in different reads"""
+        print("********************************")
+        print("test_identical_entries()")
+        entry = self.entryGenerator.generate_entry(datetime.now())
+        self.entryGenerator.write(entry)
+        self.logHandler.read()
+        self.assertEqual(self.logHandler.hits, 3)
+        self.entryGenerator.write(entry)
+        self.logHandler.read()
+        self.assertEqual(self.logHandler.hits, 4)
+        # Nothing new in the log
+        self.logHandler.read()
+        self.assertEqual(self.logHandler.hits, 4)
 
     def test_run(self):
         """Test the main monitoring loop of the LogHandler"""
@@ -184,6 +799,210 @@ class TestLogHandler(unittest.TestCase):
         self.assertTrue(abs((delta-self.refreshPeriod)
                             / self.refreshPeriod) < 0.1)
 
+    def test_read_on_change(self):
+        """Test that new lines are read before the next refresh"""
+        print("********************************")
+        print("test_read_on_change()")
+        self.logHandler.start()
+        sleep(0.1*self.refreshPeriod)
+        self.assertEqual(self.logHandler.hits, 2)
+        self.entryGenerator.write_entry(datetime.now())
+        # Less than a refreshPeriod (and a poll period) later
+        sleep(0.4*self.refreshPeriod)
+        self.logHandler.stop()
+        self.logHandler.join()
+        self.assertEqual(self.logHandler.hits, 3)
+
+    def test_snapshot(self):
+        """Test that the display reads snapshots taken at each refresh"""
+        print("********************************")
+        print("test_snapshot()")
+        self.logHandler.start()
+        sleep(0.1*self.refreshPeriod)
+        self.entryGenerator.write_entry(datetime.now())
+        sleep(0.4*self.refreshPeriod)
+        # Entries are in the window but not in the snapshot yet
+        self.assertEqual(self.logHandler.hits, 3)
+        self.assertEqual(self.logHandler.snapshot.hits, 2)
+        sleep(0.6*self.refreshPeriod)
+        self.logHandler.stop()
+        self.logHandler.join()
+        snapshot = self.logHandler.snapshot
+        self.assertEqual(snapshot.hits, 3)
+        self.assertEqual(snapshot.queueDepth, 0)
+        self.assertEqual(snapshot.backlog, 0)
+        self.assertTrue(0 <= snapshot.lag < 0.5)
+        self.assertIn("Ingestion    -> queue: 0 batches",
+                      self.logHandler.summary_message())
+        with self.assertRaises(AttributeError):
+            snapshot.hits = 0
+        # Alerts are copied in the snapshot of the next refresh
+        self.logHandler.alertLogPath = None
+        self.logHandler.alert()
+        self.assertEqual(snapshot.alerts, ())
+        self.assertEqual(snapshot.alertCount, 0)
+        self.logHandler.update()
+        snapshot = self.logHandler.snapshot
+        self.assertEqual(snapshot.alertCount, 1)
+        self.assertEqual(snapshot.alerts,
+                         tuple(self.logHandler.alerts.recent()))
+
+    def test_checkpoint(self):
+        """Test that a restarted LogHandler resumes from its checkpoint"""
+        print("********************************")
+        print("test_checkpoint()")
+        self.logHandler.alertLogPath = None
+        self.logHandler.checkpointPath = "tmp_checkpoint.log"
+        self.logHandler.read()
+        self.logHandler.update()
+        self.logHandler.alert()
+        self.assertTrue(self.logHandler.checkpoint())
+        self.logHandler.close()
+        self.entryGenerator.write_entry(datetime.now())
+        logHandler = LogHandler(self.logPath, self.refreshPeriod,
+                                self.alertThreshold, self.monitorDuration)
+        logHandler.printStatus = False
+        logHandler.checkpointPath = "tmp_checkpoint.log"
+        self.assertTrue(logHandler.resume())
+        self.assertEqual(logHandler.hits, 2)
+        self.assertTrue(logHandler.alertStatus)
+        self.assertEqual(len(logHandler.alerts), 1)
+        # Only the entry written since the checkpoint is read
+        logHandler.read()
+        logHandler.close()
+        self.assertEqual(logHandler.hits, 3)
+        self.assertEqual(logHandler.entryCount, 3)
+        # Checkpoints of other parameters or other logs are ignored
+        logHandler = LogHandler(self.logPath, self.refreshPeriod,
+                                self.alertThreshold, 20)
+        logHandler.checkpointPath = "tmp_checkpoint.log"
+        self.assertFalse(logHandler.resume())
+        logHandler.close()
+        logHandler = LogHandler("tmp_other.log", self.refreshPeriod,
+                                self.alertThreshold, self.monitorDuration)
+        logHandler.checkpointPath = "tmp_checkpoint.log"
+        self.assertFalse(logHandler.resume())
+        logHandler.close()
+        # Damaged or incomplete checkpoints too
+        with open("tmp_checkpoint.log", "wb") as checkpointFile:
+            # Unpickling raises ValueError (unknown protocol)
+            checkpointFile.write(zlib.compress(b"\x80\x09."))
+        self.assertIsNone(read_checkpoint("tmp_checkpoint.log"))
+        state = {"monitorDuration": self.monitorDuration}
+        write_checkpoint("tmp_checkpoint.log", state)
+        self.assertEqual(read_checkpoint("tmp_checkpoint.log")["version"], 1)
+        self.assertIsNone(read_checkpoint("tmp_checkpoint.log", ["buckets"]))
+        logHandler = LogHandler(self.logPath, self.refreshPeriod,
+                                self.alertThreshold, self.monitorDuration)
+        logHandler.checkpointPath = "tmp_checkpoint.log"
+        self.assertFalse(logHandler.resume())
+        logHandler.close()
+
+    def test_checkpoint_settings(self):
+        """Test the resume of an alert whose settings changed since the
+        checkpoint"""
+        print("********************************")
+        print("test_checkpoint_settings()")
+        self.logHandler.alertLogPath = None
+        self.logHandler.checkpointPath = "tmp_checkpoint.log"
+        self.logHandler.read()
+        self.logHandler.update()
+        self.logHandler.alert()
+        self.assertTrue(self.logHandler.alertStatus)
+        self.assertTrue(self.logHandler.checkpoint())
+        self.logHandler.close()
+        logHandler = LogHandler(self.logPath, self.refreshPeriod,
+                                self.alertThreshold, self.monitorDuration)
+        logHandler.printStatus = False
+        logHandler.checkpointPath = "tmp_checkpoint.log"
+        logHandler.alertHysteresis = 0.5
+        self.assertTrue(logHandler.resume())
+        # New engine, in alert with the hits of the checkpoint
+        engine = logHandler.engine()
+        self.assertEqual(engine.hysteresis, 0.5)
+        self.assertTrue(engine.status)
+        self.assertEqual(engine.hits, 2)
+        self.assertEqual(engine.pop(), [])
+        logHandler.update()
+        logHandler.close()
+        self.assertTrue(logHandler.alertStatus)
+        self.assertEqual(len(logHandler.alerts), 1)
+
+    def test_metrics(self):
+        """Test the metrics served in headless mode"""
+        print("********************************")
+        print("test_metrics()")
+        self.logHandler.metricsAddress = ("127.0.0.1", 0)
+        self.logHandler.start()
+        sleep(0.2*self.refreshPeriod)
+        url = ("http://127.0.0.1:%d/metrics"
+               % self.logHandler.metricsServer.port)
+        with urlopen(url) as response:
+            self.assertIn("text/plain", response.getheader("Content-Type"))
+            lines = response.read().decode().split("\n")
+        with self.assertRaises(HTTPError):
+            urlopen(url + "/other")
+        self.logHandler.stop()
+        self.logHandler.join()
+        self.assertIn("http_monitor_window_hits 2.0", lines)
+        self.assertIn("# TYPE http_monitor_ingested_entries_total counter",
+                      lines)
+        self.assertIn("http_monitor_ingested_entries_total 2.0", lines)
+        self.assertIn("http_monitor_alert_active 0.0", lines)
+        self.assertEqual(sum(float(line.split()[-1]) for line in lines
+                             if line.startswith("http_monitor_code_hits")),
+                         2)
+        self.assertTrue(any(line.startswith(
+            'http_monitor_response_bytes{quantile="0.99"}')
+            for line in lines))
+
+    def test_instrumentation(self):
+        """Test the metrics of the LogHandler itself and the profiler"""
+        print("********************************")
+        print("test_instrumentation()")
+        with open(self.logPath, "a") as logFile:
+            logFile.write("This is not a formatted entry\n")
+        self.logHandler.read()
+        self.logHandler.update()
+        stats = self.logHandler.snapshot.stats
+        # The 10 hours old entry is skipped without being read
+        self.assertEqual(stats["lines"], 3)
+        self.assertEqual(stats["tick_lines"], 3)
+        self.assertEqual(stats["parse_failures"], 1)
+        with open(self.logPath, "rb") as logFile:
+            oldLine = logFile.readline()
+        self.assertEqual(stats["bytes"],
+                         os.path.getsize(self.logPath) - len(oldLine))
+        self.assertEqual(stats["parse"]["count"], 3)
+        self.assertEqual(stats["update"]["count"], 1)
+        self.assertEqual(stats["evict"]["count"], 1)
+        # Nothing was read during the second tick
+        self.logHandler.read()
+        self.logHandler.update()
+        self.assertEqual(self.logHandler.snapshot.stats["tick_lines"], 0)
+        self.assertEqual(self.logHandler.snapshot.stats["lines"], 3)
+        # Panel displayed instead of the statistics
+        self.logHandler.showStats = True
+        lines = self.logHandler.statistics_lines()
+        self.logHandler.showStats = False
+        self.assertEqual(len(lines), len(self.logHandler.statistics_lines()))
+        self.assertIn("Failures     -> 1 lines not parsed", lines)
+        self.logHandler.statsPath = "tmp_stats.log"
+        self.logHandler.dump_stats()
+        with open("tmp_stats.log") as statsFile:
+            self.assertEqual(json.load(statsFile)["parse_failures"], 1)
+        # Profiles of several threads dumped as one
+        profiler = Profiler("tmp_profile.log")
+        thread = Thread(target=profiler.run, args=(sleep, 0.01))
+        thread.start()
+        thread.join()
+        self.assertEqual(profiler.run(sum, [1, 2]), 3)
+        profiler.dump()
+        functions = [function[2] for function
+                     in pstats.Stats("tmp_profile.log").stats]
+        self.assertIn("<built-in method time.sleep>", functions)
+        self.assertIn("<built-in method builtins.sum>", functions)
+
     def test_drop_old_entries(self):
         """Test the removal of entries older than the monitored period"""
         print("********************************")
@@ -198,16 +1017,17 @@ class TestLogHandler(unittest.TestCase):
         # Add them manually to the LogHandler
         self.logHandler.add_entry(oldEntry)
         self.logHandler.add_entry(newEntry)
-        self.assertEqual(len(self.logHandler.log), 2)
+        self.assertEqual(len(self.logHandler.window), 2)
         self.logHandler.drop_old_entries()
         # Only one of the entries should be left
-        self.assertEqual(len(self.logHandler.log), 1)
+        self.assertEqual(len(self.logHandler.window), 1)
         self.assertEqual(self.logHandler.hits, 1)
 
     def test_alert(self):
         """Test alert triggering"""
         print("********************************")
         print("test_alert()")
+        self.logHandler.alertLogPath = None
         self.logHandler.refreshPeriod = 2
         self.logHandler.start()
         self.assertEqual(self.logHandler.alertStatus, False)
@@ -227,6 +1047,7 @@ class TestLogHandler(unittest.TestCase):
         """Test the alert ending went traffic went back to normal"""
         print("********************************")
         print("test_end_alert()")
+        self.logHandler.alertLogPath = None
         # Set time frame of monitoring to 1 second to test faster
         self.logHandler.monitorDuration = 2
         self.logHandler.refreshPeriod = 1
@@ -247,6 +1068,35 @@ class TestLogHandler(unittest.TestCase):
         self.logHandler.join()
         self.assertFalse(self.logHandler.alertStatus)
 
+    def test_sketch(self):
+        """Test approximate counting of clients and sections"""
+        print("********************************")
+        print("test_sketch()")
+        logHandler = LogHandler(self.logPath, self.refreshPeriod,
+                                self.alertThreshold, self.monitorDuration,
+                                sketchCapacity=5)
+        now = datetime.now()
+        before = now - timedelta(seconds=1)
+        for i in range(200):
+            line = self.entryGenerator.generate_entry(before)
+            logHandler.add_entry(LogEntry(line.replace(line.split()[0],
+                                                       "1.2.3.4", 1)))
+            logHandler.add_entry(LogEntry(
+                self.entryGenerator.generate_entry(before)))
+        entry = LogEntry(self.entryGenerator.generate_entry(now))
+        logHandler.add_entry(entry)
+        self.assertEqual(logHandler.hits, 401)
+        # Random ips are not all counted but the frequent one is
+        self.assertTrue(len(logHandler.ips) <= 10)
+        self.assertEqual(logHandler.ips.most_common(1)[0][0], "1.2.3.4")
+        self.assertTrue(sum(logHandler.sections.values()) <= 401)
+        self.assertTrue(logHandler.uniqueIps > 1)
+        # Expired seconds are not counted anymore
+        logHandler.window.drop_before(entry.timestamp)
+        self.assertEqual(logHandler.uniqueIps, 1)
+        self.assertEqual(logHandler.ips, {entry.ip: 1})
+        self.assertEqual(logHandler.sections, {entry.section: 1})
+
     def test_summary(self):
         """Test the processing of information contained in the entries"""
         print("********************************")
@@ -293,13 +1143,318 @@ class TestLogHandler(unittest.TestCase):
         self.assertEqual(self.logHandler.codes, {"200": 4,
                                                  "403": 2,
                                                  "404": 1})
+        self.assertEqual(self.logHandler.uniqueIps, 2)
+        median = self.logHandler.window.sizes.quantile(0.5)
+        self.assertTrue(abs(median - 1000) <= 10)
+
+
+class TestCatchUp(unittest.TestCase):
+    """Test the parallel parsing of large backlogs"""
+
+    def setUp(self):
+        """Initialization of the tests"""
+        self.logPath = "tmp.log"
+        self.entryGenerator = EntryGenerator(self.logPath, 60)
+        self.entryGenerator.clear_log()
+        now = datetime.now()
+        entries = [self.entryGenerator.generate_entry(now
+                                                      - timedelta(hours=1))]
+        for i in range(3000):
+            entries.append(self.entryGenerator.generate_entry(
+                now - timedelta(seconds=i % 5)))
+        entries.append("this is not a formatted entry\n")
+        self.entryGenerator.write("".join(entries))
+
+    def test_split_chunks(self):
+        """Check that chunks cover the range and start on a new line"""
+        print("********************************")
+        print("test_split_chunks()")
+        end = os.path.getsize(self.logPath)
+        chunks = split_chunks(self.logPath, 0, end, 8)
+        self.assertEqual(len(chunks), 8)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], end)
+        with open(self.logPath, "rb") as logFile:
+            data = logFile.read()
+        for (start, chunkEnd), (nextStart, nextEnd) in zip(chunks,
+                                                           chunks[1:]):
+            self.assertEqual(chunkEnd, nextStart)
+            self.assertEqual(data[nextStart - 1:nextStart], b"\n")
+
+    def test_catch_up(self):
+        """Check that parsing with processes gives the same statistics"""
+        print("********************************")
+        print("test_catch_up()")
+        logHandlers = []
+        for processes in (1, 2):
+            logHandler = LogHandler(self.logPath, 2, 20, 10)
+            logHandler.printStatus = False
+            logHandler.alertLogPath = None
+            logHandler.catchUpProcesses = processes
+            logHandler.catchUpSize = 0
+            logHandlers.append(logHandler)
+        # A line is being written
+        self.entryGenerator.write("127.0.0.1 - - [30/May")
+        for logHandler in logHandlers:
+            logHandler.read()
+        sequential, parallel = logHandlers
+        self.assertEqual(parallel.hits, 3000)
+        for name in ("hits", "size", "sections", "ips", "methods", "codes",
+                     "files"):
+            self.assertEqual(getattr(parallel, name),
+                             getattr(sequential, name))
+        self.assertEqual(len(parallel.window), len(sequential.window))
+        # Following lines are read normally
+        self.entryGenerator.write("\n")
+        self.entryGenerator.write_entry(datetime.now())
+        parallel.read()
+        self.assertEqual(parallel.hits, 3001)
+        for logHandler in logHandlers:
+            logHandler.close()
+
+
+class TestReplay(unittest.TestCase):
+    """Test replaying a past log"""
+
+    def test_replay(self):
+        """Check that alerts are triggered and recovered at log time"""
+        print("********************************")
+        print("test_replay()")
+        entryGenerator = EntryGenerator("tmp.log", 60)
+        entryGenerator.clear_log()
+        start = datetime(2015, 5, 30, 14, 0, 0)
+        entries = []
+        # 30s at 60 hits/min, 20s at 300 hits/min, 30s at 60 hits/min
+        for second in range(80):
+            hits = 5 if 30 <= second < 50 else 1
+            for i in range(hits):
+                entries.append(entryGenerator.generate_entry(
+                    start + timedelta(seconds=second)))
+        entryGenerator.write("".join(entries))
+        logHandler = LogHandler("tmp.log", 2, 100, 10)
+        logHandler.printStatus = False
+        logHandler.alertLogPath = None
+        lineCount, duration = logHandler.replay()
+        self.assertEqual(lineCount, len(entries))
+        self.assertFalse(logHandler.alertStatus)
+        alerts = [alert.message() for alert in logHandler.alerts.recent()]
+        # Most recent first, at the second the threshold was crossed
+        self.assertIn("[30/May/2015:14:00:31] HIGH TRAFFIC", alerts[1])
+        self.assertIn("[30/May/2015:14:00:59] Traffic slowed down",
+                      alerts[0])
+        # Replay of the last 30s only, after the alert
+        logHandler = LogHandler("tmp.log", 2, 100, 10)
+        logHandler.printStatus = False
+        logHandler.alertLogPath = None
+        lineCount, duration = logHandler.replay(
+            start + timedelta(seconds=50))
+        self.assertEqual(lineCount, 30)
+        self.assertEqual(len(logHandler.alerts), 0)
+
+
+class TestMultipleLogs(unittest.TestCase):
+    """Test the monitoring of several log files"""
+
+    def setUp(self):
+        """Initialization of the tests"""
+        self.entryGenerators = {}
+        for name in "abc":
+            logPath = "tmp_%s.log" % name
+            if os.path.isfile(logPath):
+                os.remove(logPath)
+            self.entryGenerators[name] = EntryGenerator(logPath, 60)
+        self.entryGenerators["a"].write_entry(datetime.now())
+        self.logHandler = LogHandler("tmp.log, tmp_*.log", 2, 20, 10)
+        self.logHandler.printStatus = False
+
+    def tearDown(self):
+        """Close the logs followed by the LogHandler"""
+        self.logHandler.close()
+
+    def test_glob(self):
+        """Test that entries of all the matching files are merged"""
+        print("********************************")
+        print("test_glob()")
+        EntryGenerator("tmp.log", 60).clear_log()
+        self.logHandler.read()
+        self.assertEqual(self.logHandler.hits, 1)
+        # New file matching the pattern
+        for i in range(2):
+            self.entryGenerators["b"].write_entry(datetime.now())
+        self.logHandler.discover()
+        self.logHandler.read()
+        self.assertEqual(self.logHandler.hits, 3)
+        self.assertEqual(self.logHandler.files, {"tmp_a.log": 1,
+                                                 "tmp_b.log": 2})
+
+    def test_new_file(self):
+        """Test that a file created while monitoring is followed"""
+        print("********************************")
+        print("test_new_file()")
+        EntryGenerator("tmp.log", 60).clear_log()
+        self.logHandler.start()
+        sleep(0.2)
+        self.entryGenerators["c"].write_entry(datetime.now())
+        # Before the next refresh with inotify, at the next one otherwise
+        sleep(1.2*self.logHandler.refreshPeriod)
+        self.logHandler.stop()
+        self.logHandler.join()
+        self.assertEqual(self.logHandler.files, {"tmp_a.log": 1,
+                                                 "tmp_c.log": 1})
+
+
+class TestAggregation(unittest.TestCase):
+    """Test the agents and the aggregator of several monitors"""
+
+    def setUp(self):
+        """Entries of a few seconds counted in buckets"""
+        self.buckets = {}
+        generator = EntryGenerator("tmp.log", 60, seed=2)
+        now = datetime.now()
+        lines = []
+        for second in range(5):
+            lines += generator.generate_entries(
+                now - timedelta(seconds=second), 10)
+        for entry in parse_many(lines):
+            if entry.timestamp not in self.buckets:
+                self.buckets[entry.timestamp] = Bucket(entry.timestamp)
+            self.buckets[entry.timestamp].add(entry, "access.log")
+
+    def test_wire_format(self):
+        """Test that buckets are decoded as they were encoded"""
+        print("********************************")
+        print("test_wire_format()")
+        buckets = list(self.buckets.values())
+        frame = encode_message("web1", buckets)
+        self.assertEqual(FRAME_HEADER.unpack(frame[:4])[0], len(frame) - 4)
+        name, decoded = decode_message(frame[4:])
+        self.assertEqual(name, "web1")
+        self.assertEqual(len(decoded), len(buckets))
+        for bucket, other in zip(buckets, decoded):
+            self.assertEqual(other.timestamp, bucket.timestamp)
+            self.assertEqual((other.hits, other.size),
+                             (bucket.hits, bucket.size))
+            self.assertEqual(other.sizes.counts, bucket.sizes.counts)
+            self.assertEqual(other.ips, bucket.ips)
+            self.assertEqual(other.codes, bucket.codes)
+            self.assertEqual(other.files,
+                             Counter({"web1:access.log": bucket.hits}))
+        # Approximate counts of the aggregator
+        name, decoded = decode_message(frame[4:], 10)
+        self.assertEqual(decoded[0].ips.total, buckets[0].hits)
+        uniqueIps = HyperLogLog()
+        for ip in buckets[0].ips:
+            uniqueIps.add(ip)
+        self.assertEqual(decoded[0].uniqueIps.registers, uniqueIps.registers)
+        # Approximate counts of the agent
+        bucket = Bucket(buckets[0].timestamp, 10)
+        bucket.merge(decoded[0])
+        name, decoded = decode_message(encode_message("web1", [bucket])[4:],
+                                       10)
+        self.assertEqual(decoded[0].uniqueIps.registers,
+                         bucket.uniqueIps.registers)
+        self.assertEqual(decoded[0].sections.counts, bucket.sections.counts)
+        # Much smaller than the lines
+        self.assertTrue(len(frame) < 50 * 50)
+        with self.assertRaises(ValueError):
+            decode_message(frame[4:-1])
+        with self.assertRaises(ValueError):
+            decode_message(b"GET / HTTP/1.1")
+
+    def test_agents(self):
+        """Test that the entries of several agents are merged"""
+        print("********************************")
+        print("test_agents()")
+        aggregator = LogHandler("", 1, 20, 10)
+        aggregator.printStatus = False
+        aggregator.alertLogPath = None
+        aggregator.aggregatorAddress = ("127.0.0.1", 0)
+        aggregator.start()
+        sleep(0.2)
+        agents = []
+        for name, count in [("a", 2), ("b", 3)]:
+            generator = EntryGenerator("tmp_%s.log" % name, 60)
+            generator.clear_log()
+            for i in range(count):
+                generator.write_entry(datetime.now())
+            agent = LogHandler("tmp_%s.log" % name, 1, 20, 10)
+            agent.printStatus = False
+            agent.alertLogPath = None
+            agent.agentAddress = ("127.0.0.1",
+                                  aggregator.aggregatorServer.port)
+            agent.agentName = name
+            agent.agentPeriod = 0.1
+            agent.start()
+            agents.append(agent)
+        sleep(0.5)
+        self.assertEqual(len(aggregator.aggregatorServer.connections), 2)
+        for agent in agents:
+            agent.stop()
+            agent.join()
+        sleep(0.2)
+        aggregator.stop()
+        aggregator.join()
+        self.assertEqual(aggregator.hits, 5)
+        self.assertEqual(aggregator.files, {"a:tmp_a.log": 2,
+                                            "b:tmp_b.log": 3})
+        self.assertEqual(aggregator.entryCount, 5)
+
+    def test_reconnection(self):
+        """Test that an agent keeps its buckets until they are sent"""
+        print("********************************")
+        print("test_reconnection()")
+        received = []
+        address = "tmp_aggregator.sock"
+        agent = Agent(address, "web1")
+        buckets = list(self.buckets.values())
+        agent.add_bucket(buckets[0])
+        # Nothing listens yet: the connection is retried later
+        self.assertFalse(agent.flush())
+        self.assertEqual(len(agent.pending), 1)
+        self.assertFalse(agent.flush())
+        server = AggregatorServer(address, lambda name, buckets:
+                                  received.extend(buckets))
+        server.start()
+        agent.retryTime = 0
+        for bucket in buckets[1:]:
+            agent.add_bucket(bucket)
+        self.assertTrue(agent.flush())
+        self.assertEqual(len(agent.pending), 0)
+        # Aggregator restarted: the closed connection is opened again
+        sleep(0.2)
+        server.close()
+        sleep(0.1)
+        server = AggregatorServer(address, lambda name, buckets:
+                                  received.extend(buckets))
+        server.start()
+        agent.add_bucket(buckets[0])
+        self.assertTrue(agent.flush())
+        self.assertEqual(agent.sent, 2)
+        agent.close()
+        sleep(0.1)
+        server.close()
+        self.assertEqual(sum(bucket.hits for bucket in received),
+                         sum(bucket.hits for bucket in buckets)
+                         + buckets[0].hits)
+        # The oldest seconds are dropped when too many are pending
+        agent = Agent(address, "web1", maxPending=2)
+        for bucket in buckets[:3]:
+            agent.add_bucket(bucket)
+        self.assertFalse(agent.flush())
+        timestamps = sorted(bucket.timestamp for bucket in buckets[:3])
+        self.assertEqual(sorted(agent.pending), timestamps[1:])
+        self.assertEqual(agent.dropped, 1)
+        self.assertEqual(parse_address("unix:/tmp/a.sock"), "/tmp/a.sock")
+        self.assertEqual(parse_address("10.0.0.1:9109"), ("10.0.0.1", 9109))
+        with self.assertRaises(ValueError):
+            parse_address("10.0.0.1")
 
 
 def tearDownModule():
-    """Deletes the temporary log after all the tests"""
-    logPath = "tmp.log"
-    if os.path.isfile(logPath):
-        os.remove(logPath)
+    """Deletes the temporary logs and sockets after all the tests"""
+    for logPath in ["tmp.log"] + glob("tmp_*.log*") + glob("tmp_*.sock"):
+        if os.path.isfile(logPath):
+            os.remove(logPath)
 
 if __name__ == '__main__':
     unittest.main()
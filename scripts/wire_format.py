@@ -0,0 +1,209 @@
+# Binary format of the per-second aggregates sent by the agents to the
+# aggregator (see Agent and AggregatorServer): each message is a frame of
+# buckets whose strings (sections, ips, codes...) are written once in a
+# table and whose integers are varints, so that a second of traffic takes
+# a few hundred bytes whatever its number of hits
+
+from sliding_window import Bucket
+from frequent_items import FrequentItems
+import struct
+
+# First bytes of a message and version of the format
+MAGIC = b"HM"
+VERSION = 1
+# Length prefix of a frame (big-endian unsigned int)
+FRAME_HEADER = struct.Struct(">I")
+# Larger frames are refused (corrupted stream or other protocol)
+MAX_FRAME_SIZE = 64 << 20
+# Counted keys of a bucket, in the order they are written
+COUNT_FIELDS = ("sections", "ips", "methods", "codes", "files")
+
+
+def write_varint(out, value):
+    """Appends an unsigned integer to a bytearray, 7 bits per byte"""
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, position):
+    """Reads an unsigned integer written by write_varint()
+    Raises ValueError if the data ends before it does
+    :return: (value, position after it)"""
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise ValueError("Truncated message")
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def write_string(out, string):
+    """Appends a string (length and utf-8 bytes) to a bytearray"""
+    encoded = string.encode("utf-8")
+    write_varint(out, len(encoded))
+    out += encoded
+
+
+def read_string(data, position):
+    """Reads a string written by write_string()
+    :return: (string, position after it)"""
+    length, position = read_varint(data, position)
+    if position + length > len(data):
+        raise ValueError("Truncated message")
+    return (data[position:position + length].decode("utf-8", "replace"),
+            position + length)
+
+
+def counts_of(counts):
+    """Returns the dict of counts of a Counter or a FrequentItems object"""
+    if isinstance(counts, FrequentItems):
+        return counts.counts
+    return counts
+
+
+def encode_message(name, buckets):
+    """Returns the frame of a message (length prefix included)
+    :param name: name of the agent (its files are prefixed with it by
+    decode_message(), e.g. web1:/var/log/access.log)
+    :param buckets: list of Bucket objects"""
+    # Strings of the table and their index
+    strings = []
+    indexes = {}
+    body = bytearray()
+    write_varint(body, len(buckets))
+    for bucket in buckets:
+        approximate = bucket.capacity is not None
+        for value in (bucket.timestamp, bucket.hits, bucket.size,
+                      int(approximate), len(bucket.sizes.counts)):
+            write_varint(body, value)
+        for sizeBin, count in bucket.sizes.counts.items():
+            write_varint(body, sizeBin)
+            write_varint(body, count)
+        for field in COUNT_FIELDS:
+            counts = counts_of(getattr(bucket, field))
+            write_varint(body, len(counts))
+            for key, count in counts.items():
+                index = indexes.get(key)
+                if index is None:
+                    index = indexes[key] = len(strings)
+                    strings.append(key)
+                write_varint(body, index)
+                write_varint(body, count)
+        if approximate:
+            # Number of keys added to the summaries and non-zero registers
+            # of the distinct ips
+            write_varint(body, bucket.sections.total)
+            write_varint(body, bucket.ips.total)
+            registers = bucket.uniqueIps.registers
+            write_varint(body, len(registers) - registers.count(0))
+            for register, rank in enumerate(registers):
+                if rank != 0:
+                    write_varint(body, register)
+                    write_varint(body, rank)
+    payload = bytearray(MAGIC)
+    payload.append(VERSION)
+    write_string(payload, name)
+    write_varint(payload, len(strings))
+    for string in strings:
+        write_string(payload, string)
+    payload += body
+    return FRAME_HEADER.pack(len(payload)) + bytes(payload)
+
+
+def decode_message(payload, capacity=None):
+    """Returns the buckets of the payload of a frame
+    Raises ValueError if it is not a valid message
+    :param payload: bytes following the length prefix
+    :param capacity: capacity of the buckets created (see Bucket), the
+    counts of the agent are added to them whatever its own capacity
+    :return: (agent name, list of Bucket objects whose files are prefixed
+    with the name of the agent)"""
+    if payload[:len(MAGIC)] != MAGIC or len(payload) <= len(MAGIC) \
+            or payload[len(MAGIC)] != VERSION:
+        raise ValueError("Unknown message format")
+    position = len(MAGIC) + 1
+    name, position = read_string(payload, position)
+    count, position = read_varint(payload, position)
+    strings = []
+    for index in range(count):
+        string, position = read_string(payload, position)
+        strings.append(string)
+
+    def read(count):
+        """Returns the next count varints"""
+        nonlocal position
+        values = []
+        for index in range(count):
+            value, position = read_varint(payload, position)
+            values.append(value)
+        return values
+
+    def read_counts():
+        """Returns the next (key, count) pairs"""
+        length, = read(1)
+        pairs = read(2 * length)
+        try:
+            return [(strings[key], count)
+                    for key, count in zip(pairs[::2], pairs[1::2])]
+        except IndexError:
+            raise ValueError("Invalid string index")
+
+    buckets = []
+    for index in range(read(1)[0]):
+        timestamp, hits, size, approximate, sizeBins = read(5)
+        bucket = Bucket(timestamp, capacity)
+        bucket.hits = hits
+        bucket.size = size
+        pairs = read(2 * sizeBins)
+        bucket.sizes.counts.update(dict(zip(pairs[::2], pairs[1::2])))
+        for field in COUNT_FIELDS:
+            counts = getattr(bucket, field)
+            for key, count in read_counts():
+                if field == "files":
+                    key = "%s:%s" % (name, key)
+                if isinstance(counts, FrequentItems):
+                    counts.add(key, count)
+                    # Exact counts of the agent: every distinct ip
+                    if field == "ips" and not approximate:
+                        bucket.uniqueIps.add(key)
+                else:
+                    counts[key] += count
+        if approximate:
+            totals = read(2)
+            registers = read(1)[0]
+            pairs = read(2 * registers)
+            if capacity is not None:
+                # Keys not kept by the summaries of the agent
+                bucket.sections.total = max(bucket.sections.total,
+                                            totals[0])
+                bucket.ips.total = max(bucket.ips.total, totals[1])
+                uniqueIps = bucket.uniqueIps.registers
+                for register, rank in zip(pairs[::2], pairs[1::2]):
+                    if register < len(uniqueIps):
+                        uniqueIps[register] = max(uniqueIps[register],
+                                                  rank)
+        buckets.append(bucket)
+    return name, buckets
+
+
+def read_frame(stream):
+    """Reads the payload of the next frame of a binary stream
+    Raises ValueError if the frame is too large
+    :return: bytes, None at the end of the stream"""
+    header = stream.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None
+    length, = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("Frame too large: %d bytes" % length)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return payload